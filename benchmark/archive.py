@@ -0,0 +1,61 @@
+'''
+The todo query of the handlers on a panel where most Missions have succeeded,
+with the finished Missions and their Attempts in the active tables (before) versus archived (after).
+Run it with `python -m benchmark.archive`.
+'''
+import datetime
+import time
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+from missionpanel.orm import Base, ContentBlob, Mission, Tag, MissionTag, Attempt
+from missionpanel.orm.content import dump_content, digest_content
+from missionpanel.handler.handler import HandlerInterface
+from missionpanel.archive import Archive
+
+
+def populate(session: Session, n_missions: int, finished: float, n_attempts: int):
+    blobs = [{"name": f"Mission {i}"} for i in range(n_missions)]
+    digests = [digest_content(dump_content(content)) for content in blobs]
+    session.execute(insert(ContentBlob), [{"digest": digest, "content": content} for digest, content in zip(digests, blobs)])
+    session.execute(insert(Tag), [{"name": "mission"}])
+    session.execute(insert(Mission), [{"id": i + 1, "content_digest": digest, "state": "pending"} for i, digest in enumerate(digests)])
+    session.execute(insert(MissionTag), [{"mission_id": i + 1, "tag_name": "mission"} for i in range(n_missions)])
+    past = datetime.datetime.now() - datetime.timedelta(days=1)
+    attempts = []
+    for i, digest in enumerate(digests[:int(n_missions * finished)]):
+        # failed a few times before succeeding
+        attempts.extend({"mission_id": i + 1, "content_digest": digest, "handler": "benchmark", "success": j == n_attempts - 1, "expire_time": past, "create_time": past, "last_update_time": past} for j in range(n_attempts))
+    session.execute(insert(Attempt), attempts)
+    session.commit()
+
+
+def timeit(n, f):
+    start = time.perf_counter()
+    for _ in range(n):
+        result = f()
+    return (time.perf_counter() - start) / n * 1e3, result
+
+
+def main(n_missions=50000, finished=0.95, n_attempts=3, n=5):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        populate(session, n_missions, finished, n_attempts)
+
+        def todo():
+            statement, params = HandlerInterface.prepare_todo_missions(["mission"])
+            return len(session.execute(statement.with_only_columns(Mission.id), params).all())
+
+        before_ms, before = timeit(n, todo)
+        start = time.perf_counter()
+        n_archived = Archive(session).archive(batch_size=5000)
+        archive_s = time.perf_counter() - start
+        after_ms, after = timeit(n, todo)
+        assert before == after == n_missions - n_archived
+        print(f"{n_missions} missions, {finished:.0%} succeeded after {n_attempts} attempts each:")
+        print(f"  todo query   before {before_ms:8.1f} ms  after {after_ms:8.1f} ms  ({after} missions to do)")
+        print(f"  archived {n_archived} missions in {archive_s:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
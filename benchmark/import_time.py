@@ -0,0 +1,51 @@
+'''
+Import time of the missionpanel entry points, each in a fresh interpreter.
+Run it with `python -m benchmark.import_time`.
+'''
+import subprocess
+import sys
+
+ENTRY_POINTS = [
+    "sqlalchemy.orm",
+    "missionpanel.orm",
+    "missionpanel.submitter",
+    "missionpanel.handler",
+    "missionpanel.example",
+    "missionpanel.example.subprocess",
+    "missionpanel.example.rsshub",
+]
+
+
+def import_time(module: str, repeat: int = 5) -> dict:
+    best = None
+    for _ in range(repeat):
+        stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True).stderr
+        total, own = 0, 0
+        for line in stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            if name.strip() == module:
+                total = int(cumulative_us)
+            if name.strip().startswith("missionpanel"):
+                own += int(self_us)
+        if best is None or total < best["total"]:
+            best = {"total": total, "missionpanel": own}
+    return best
+
+
+def configure_time(repeat: int = 5) -> float:
+    code = "import time, missionpanel.handler; from sqlalchemy.orm import configure_mappers; t = time.perf_counter(); configure_mappers(); print(time.perf_counter() - t)"
+    return min(float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout) for _ in range(repeat)) * 1e3
+
+
+def main():
+    print(f"{'module':36s} {'total [ms]':>10s} {'missionpanel [ms]':>18s}")
+    for module in ENTRY_POINTS:
+        t = import_time(module)
+        print(f"{module:36s} {t['total'] / 1e3:10.1f} {t['missionpanel'] / 1e3:18.1f}")
+    print(f"deferred configure_mappers(): {configure_time():.1f} ms, paid on first use instead of at import")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+'''
+Python-side overhead of the hot statements, building a fresh select() per call (before)
+versus reusing the cached statements with bound parameters (after).
+Run it with `python -m benchmark.statement_cache`.
+'''
+import datetime
+import time
+from sqlalchemy import create_engine, select, func, distinct
+from sqlalchemy.orm import Session, selectinload
+from missionpanel.orm import Base, Mission, Tag, MissionTag, Matcher, Attempt, statement_cache
+from missionpanel.submitter import Submitter
+from missionpanel.submitter.abc import SubmitterInterface
+from missionpanel.handler.handler import HandlerInterface
+
+
+def fresh_todo_missions(tags):
+    now = datetime.datetime.now()
+    return (
+        select(Mission)
+        .join(MissionTag)
+        .join(Tag)
+        .filter(Tag.name.in_(tags))
+        .group_by(Mission.id)
+        .having(func.count(distinct(Tag.name)) == len(tags))
+        .outerjoin(Attempt, onclause=(
+            (Attempt.mission_id == Mission.id) &
+            (Attempt.content_digest == Mission.content_digest) & (
+                Attempt.success.is_(True) |
+                (Attempt.expire_time >= now)
+            )
+        ))
+        .where(Attempt.id == None)
+        .where(Mission.quarantined.is_(False))
+        .where(Mission.unresolved_dependencies == 0)
+        .where((Mission.next_eligible_time == None) | (Mission.next_eligible_time <= now))
+        .options(selectinload(Mission.attempts))
+    )
+
+
+def fresh_submission(patterns, tags):
+    return (
+        select(Matcher).where(Matcher.pattern.in_(patterns)).limit(1).with_for_update(),
+        select(Tag).where(Tag.name.in_(tags)).with_for_update(),
+    )
+
+
+def timeit(n, f):
+    start = time.perf_counter()
+    for i in range(n):
+        f(i)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main(n=2000):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        submitter = Submitter(session)
+        for i in range(10):
+            submitter.create_mission(content={"name": f"Mission {i}"}, match_patterns=[f"Mission {i}"], tags=["mission", "bench"])
+        tags = ["mission", "bench"]
+
+        def poll_before(i):
+            session.execute(fresh_todo_missions(tags)).scalars().all()
+            session.commit()
+
+        def poll_after(i):
+            session.execute(*HandlerInterface.prepare_todo_missions(tags)).scalars().all()
+            session.commit()
+
+        def submit_before(i):
+            matcher, tag = fresh_submission([f"Mission {i % 10}"], tags)
+            session.execute(matcher).scalars().first()
+            session.execute(tag).scalars().all()
+            session.commit()
+
+        def submit_after(i):
+            session.execute(*SubmitterInterface.prepare_matcher([f"Mission {i % 10}"])).scalars().first()
+            session.execute(*SubmitterInterface.prepare_tag(tags)).scalars().all()
+            session.commit()
+
+        print("construction only (us per call):")
+        print(f"  poll       before {timeit(n, lambda i: fresh_todo_missions(tags)):8.1f}  after {timeit(n, lambda i: HandlerInterface.prepare_todo_missions(tags)):8.1f}")
+        print(f"  submission before {timeit(n, lambda i: fresh_submission(['Mission'], tags)):8.1f}  after {timeit(n, lambda i: (SubmitterInterface.prepare_matcher(['Mission']), SubmitterInterface.prepare_tag(tags))):8.1f}")
+        print("execution against in-memory SQLite (us per call):")
+        print(f"  poll       before {timeit(n, poll_before):8.1f}  after {timeit(n, poll_after):8.1f}")
+        print(f"  submission before {timeit(n, submit_before):8.1f}  after {timeit(n, submit_after):8.1f}")
+        print(f"statement cache: {statement_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
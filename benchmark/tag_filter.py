@@ -0,0 +1,102 @@
+'''
+Tag filters at large tag cardinalities: the GROUP BY join the todo query used to be built on (before)
+versus the IN / NOT EXISTS subqueries of TagFilter (after),
+and "rsshub but not twitter" filtered in Python (before) versus in SQL (after).
+The query plans are checked to search missiontag by an index instead of scanning it.
+Run it with `python -m benchmark.tag_filter`.
+'''
+import datetime
+import random
+import time
+from sqlalchemy import create_engine, select, func, distinct, insert, text
+from sqlalchemy.orm import Session
+from missionpanel.orm import Base, ContentBlob, Mission, Tag, MissionTag
+from missionpanel.orm.content import dump_content, digest_content
+from missionpanel.handler import AllOf, AnyOf, NoneOf
+from missionpanel.handler.handler import HandlerInterface
+
+
+def group_by_missions(tags):
+    return (
+        select(Mission)
+        .join(MissionTag)
+        .where(MissionTag.tag_name.in_(tags))
+        .group_by(Mission.id)
+        .having(func.count(distinct(MissionTag.tag_name)) == len(set(tags)))
+        .where(Mission.quarantined.is_(False))
+        .where(Mission.unresolved_dependencies == 0)
+        .where((Mission.next_eligible_time == None) | (Mission.next_eligible_time <= datetime.datetime.now()))
+    )
+
+
+def populate(session: Session, n_missions: int, n_tags: int):
+    rng = random.Random(0)
+    content = {"name": "Mission"}
+    digest = digest_content(dump_content(content))
+    session.execute(insert(ContentBlob), [{"digest": digest, "content": content}])
+    names = [f"tag {i}" for i in range(n_tags)] + ["rsshub", "twitter"]
+    session.execute(insert(Tag), [{"name": name} for name in names])
+    session.execute(insert(Mission), [{"id": i + 1, "content_digest": digest} for i in range(n_missions)])
+    rows = []
+    for i in range(n_missions):
+        tags = set(rng.sample(names[:n_tags], 3))
+        if rng.random() < 0.5:
+            tags.add("rsshub")
+        if rng.random() < 0.2:
+            tags.add("twitter")
+        rows.extend({"mission_id": i + 1, "tag_name": tag} for tag in tags)
+    session.execute(insert(MissionTag), rows)
+    session.commit()
+
+
+def plan(session: Session, statement, params) -> str:
+    compiled = statement.params(**params).compile(session.get_bind(), compile_kwargs={"literal_binds": True})
+    return "\n".join(row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all())
+
+
+def timeit(n, f):
+    start = time.perf_counter()
+    for _ in range(n):
+        result = f()
+    return (time.perf_counter() - start) / n * 1e3, result
+
+
+def main(n_missions=50000, n_tags=2000, n=2):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        populate(session, n_missions, n_tags)
+
+        def ids(statement, params={}):
+            return lambda: set(session.execute(statement, params).scalars().all())
+
+        def todo(tag_filter):
+            statement, params = HandlerInterface.prepare_todo_missions(tag_filter)
+            return statement.with_only_columns(Mission.id), params
+
+        def rsshub_not_twitter():
+            missions = session.execute(group_by_missions(["rsshub"])).scalars().all()
+            return {mission.id for mission in missions if "twitter" not in [tag.tag_name for tag in mission.tags]}
+
+        cases = [
+            ("all of 2 tags", ids(group_by_missions(["rsshub", "tag 7"]).with_only_columns(Mission.id)), AllOf("rsshub", "tag 7")),
+            ("any of 50 tags", ids(group_by_missions([]).with_only_columns(Mission.id).where(False)), AnyOf(*[f"tag {i}" for i in range(50)])),
+            ("rsshub but not twitter", rsshub_not_twitter, AnyOf("rsshub") & NoneOf("twitter")),
+        ]
+        print(f"{n_missions} missions, {n_tags + 2} tags (ms per query):")
+        for name, before, tag_filter in cases:
+            statement, params = todo(tag_filter)
+            before_ms, expected = timeit(n, before)
+            after_ms, got = timeit(n, ids(statement, params))
+            if name != "any of 50 tags":  # there is no before for any-of
+                assert got == expected, name
+            query_plan = plan(session, statement, params)
+            assert "SCAN missiontag" not in query_plan, query_plan
+            assert all("SEARCH" in line for line in query_plan.splitlines() if "missiontag" in line), query_plan
+            print(f"  {name:24s} before {before_ms:8.1f}  after {after_ms:8.1f}  ({len(got)} missions)")
+        print("plan of rsshub but not twitter:")
+        print(plan(session, *todo(AnyOf("rsshub") & NoneOf("twitter"))))
+
+
+if __name__ == "__main__":
+    main()
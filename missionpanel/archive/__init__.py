@@ -0,0 +1,2 @@
+from .interface import ArchiveInterface
+from .archive import Archive, AsyncArchive
@@ -0,0 +1,82 @@
+import datetime
+import logging
+from typing import List, Optional, Union
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from missionpanel.orm import Attempt, AttemptArchive
+from missionpanel.orm.stats import move_missions
+from .interface import ArchiveInterface
+
+
+class Archive(ArchiveInterface):
+    logger = logging.getLogger("Archive")
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def archive(self, batch_size: int = 1000, finished_before: Optional[datetime.datetime] = None) -> int:
+        '''
+        Archive the Missions which succeeded on their current content, before finished_before if given.
+        Each batch is committed on its own, so that the handlers are not blocked for long.
+        Return the number of archived Missions.
+        '''
+        last_id, n_archived = 0, 0
+        while True:
+            now = datetime.datetime.now()
+            mission_ids = self.session.execute(ArchiveInterface.query_archivable(last_id, batch_size, now, finished_before)).scalars().all()
+            if len(mission_ids) <= 0:
+                self.session.commit()
+                break
+            last_id = mission_ids[-1]
+            self.session.execute(move_missions(ArchiveInterface.still_archivable(mission_ids, now, finished_before), "done"))
+            n_archived += self.session.execute(ArchiveInterface.mark_archived(mission_ids, now, finished_before)).rowcount
+            archived = ArchiveInterface.query_archived(mission_ids)
+            self.session.execute(ArchiveInterface.copy_attempts(archived, now))
+            self.session.execute(ArchiveInterface.delete_attempts(archived))
+            self.session.commit()
+            self.logger.info(f"Archived missions up to {last_id}, {n_archived} so far")
+        return n_archived
+
+    def history(self, mission_id: int) -> List[Union[Attempt | AttemptArchive]]:
+        '''Attempts of the Mission, archived or not, from the oldest.'''
+        archived = self.session.execute(ArchiveInterface.query_archived_attempts(mission_id)).scalars().all()
+        attempts = self.session.execute(ArchiveInterface.query_attempts(mission_id)).scalars().all()
+        # detach them so that commit does not expire them
+        for attempt in [*archived, *attempts]:
+            self.session.expunge(attempt)
+        self.session.commit()
+        return ArchiveInterface.history(archived, attempts)
+
+
+class AsyncArchive(ArchiveInterface):
+    logger = logging.getLogger("AsyncArchive")
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def archive(self, batch_size: int = 1000, finished_before: Optional[datetime.datetime] = None) -> int:
+        last_id, n_archived = 0, 0
+        while True:
+            now = datetime.datetime.now()
+            mission_ids = (await self.session.execute(ArchiveInterface.query_archivable(last_id, batch_size, now, finished_before))).scalars().all()
+            if len(mission_ids) <= 0:
+                await self.session.commit()
+                break
+            last_id = mission_ids[-1]
+            await self.session.execute(move_missions(ArchiveInterface.still_archivable(mission_ids, now, finished_before), "done"))
+            n_archived += (await self.session.execute(ArchiveInterface.mark_archived(mission_ids, now, finished_before))).rowcount
+            archived = ArchiveInterface.query_archived(mission_ids)
+            await self.session.execute(ArchiveInterface.copy_attempts(archived, now))
+            await self.session.execute(ArchiveInterface.delete_attempts(archived))
+            await self.session.commit()
+            self.logger.info(f"Archived missions up to {last_id}, {n_archived} so far")
+        return n_archived
+
+    async def history(self, mission_id: int) -> List[Union[Attempt | AttemptArchive]]:
+        archived = (await self.session.execute(ArchiveInterface.query_archived_attempts(mission_id))).scalars().all()
+        attempts = (await self.session.execute(ArchiveInterface.query_attempts(mission_id))).scalars().all()
+        # detach them so that commit does not expire them
+        for attempt in [*archived, *attempts]:
+            self.session.expunge(attempt)
+        await self.session.commit()
+        return ArchiveInterface.history(archived, attempts)
@@ -0,0 +1,78 @@
+import datetime
+from typing import List, Optional, Sequence, Tuple, Union
+from sqlalchemy import ColumnElement, Select, Update, Insert, Delete, select, update, insert, delete, exists, literal
+from missionpanel.orm import Mission, Attempt, AttemptArchive
+from missionpanel.orm.archive import ARCHIVED_COLUMNS
+
+
+class ArchiveInterface:
+    '''
+    ArchiveInterface builds the statements of the archive tier for Archive and AsyncArchive.
+    A Mission that succeeded on its current content will never be handled again unless its content changes,
+    so it is flagged archived, which takes it out of the index the handlers search,
+    and its Attempts are moved from attempt to attemptarchive.
+    The archived Missions keep their Matchers and Tags, and are reactivated when submitted with a new content.
+    '''
+
+    @staticmethod
+    def archivable(now: datetime.datetime, finished_before: Optional[datetime.datetime] = None) -> ColumnElement[bool]:
+        current = (Attempt.mission_id == Mission.id) & (Attempt.content_digest == Mission.content_digest)
+        succeeded = select(Attempt.id).where(current).where(Attempt.success.is_(True))
+        if finished_before is not None:
+            succeeded = succeeded.where(Attempt.last_update_time <= finished_before)
+        # a handler may still be working on a Mission that has already succeeded, e.g. after losing its lease
+        working = select(Attempt.id).where(Attempt.mission_id == Mission.id).where(Attempt.expire_time >= now)
+        return Mission.archived.is_(False) & exists(succeeded) & ~exists(working)
+
+    @staticmethod
+    def query_archivable(last_id: int, batch_size: int, now: datetime.datetime, finished_before: Optional[datetime.datetime] = None) -> Select[Tuple[int]]:
+        return (
+            select(Mission.id)
+            .where(Mission.id > last_id)
+            .where(ArchiveInterface.archivable(now, finished_before))
+            .order_by(Mission.id)
+            .limit(batch_size)
+        )
+
+    @staticmethod
+    def still_archivable(mission_ids: List[int], now: datetime.datetime, finished_before: Optional[datetime.datetime] = None) -> Select[Tuple[int]]:
+        # checked again when archiving, since the Missions may have changed since they were queried
+        return select(Mission.id).where(Mission.id.in_(mission_ids)).where(ArchiveInterface.archivable(now, finished_before))
+
+    @staticmethod
+    def mark_archived(mission_ids: List[int], now: datetime.datetime, finished_before: Optional[datetime.datetime] = None) -> Update:
+        # run move_missions(still_archivable(...), "done") before it, so that the tag counters follow
+        return (
+            update(Mission)
+            .where(Mission.id.in_(mission_ids))
+            .where(ArchiveInterface.archivable(now, finished_before))
+            .values(archived=True, state="done", last_update_time=Mission.last_update_time)
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def query_archived(mission_ids: List[int]) -> Select[Tuple[int]]:
+        return select(Mission.id).where(Mission.id.in_(mission_ids)).where(Mission.archived.is_(True))
+
+    @staticmethod
+    def copy_attempts(mission_ids: Union[List[int] | Select], now: datetime.datetime) -> Insert:
+        return insert(AttemptArchive).from_select(
+            [*ARCHIVED_COLUMNS, "archive_time"],
+            select(*[getattr(Attempt, name) for name in ARCHIVED_COLUMNS], literal(now, AttemptArchive.archive_time.type))
+            .where(Attempt.mission_id.in_(mission_ids)))
+
+    @staticmethod
+    def delete_attempts(mission_ids: Union[List[int] | Select]) -> Delete:
+        return delete(Attempt).where(Attempt.mission_id.in_(mission_ids)).execution_options(synchronize_session=False)
+
+    @staticmethod
+    def query_archived_attempts(mission_id: int) -> Select[Tuple[AttemptArchive]]:
+        return select(AttemptArchive).where(AttemptArchive.mission_id == mission_id).order_by(AttemptArchive.create_time)
+
+    @staticmethod
+    def query_attempts(mission_id: int) -> Select[Tuple[Attempt]]:
+        return select(Attempt).where(Attempt.mission_id == mission_id).order_by(Attempt.create_time)
+
+    @staticmethod
+    def history(archived: Sequence[AttemptArchive], attempts: Sequence[Attempt]) -> List[Union[Attempt | AttemptArchive]]:
+        return sorted([*archived, *attempts], key=lambda attempt: attempt.create_time)
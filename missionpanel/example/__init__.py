@@ -1,3 +1,31 @@
-from .rsshub import RSSHubSubmitter, RSSHubRootSubmitter, RSSHubSubitemSubmitter
-from .ttrss import TTRSSClient, TTRSSSubmitter, TTRSSHubSubmitter, TTRSSHubRootSubmitter, TTRSSHubSubitemSubmitter
-from .subprocess import SubprocessAsyncHandler, SubprocessParallelAsyncHandler
+import importlib
+
+# submodules are imported on first access, so that users of the ORM or handlers do not pay for httpx, chardet and xml
+_submodules = {
+    'RSSHubSubmitter': 'rsshub',
+    'RSSHubRootSubmitter': 'rsshub',
+    'RSSHubSubitemSubmitter': 'rsshub',
+    'TTRSSClient': 'ttrss',
+    'TTRSSSubmitter': 'ttrss',
+    'TTRSSHubSubmitter': 'ttrss',
+    'TTRSSHubRootSubmitter': 'ttrss',
+    'TTRSSHubSubitemSubmitter': 'ttrss',
+    'SubprocessAsyncHandler': 'subprocess',
+    'SubprocessParallelAsyncHandler': 'subprocess',
+    'WarmSubprocessAsyncHandler': 'subprocess',
+    'WarmSubprocessParallelAsyncHandler': 'subprocess',
+}
+
+__all__ = list(_submodules)
+
+
+def __getattr__(name):
+    if name not in _submodules:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_submodules[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,11 +1,21 @@
 import abc
 import asyncio
 import logging
-import chardet
-from typing import List
-from missionpanel.handler import AsyncHandler, ParallelAsyncHandler
+import os
+from typing import Any, Dict, List, Optional, Union
+from sqlalchemy import inspect
+from missionpanel.handler import AsyncHandler, ParallelAsyncHandler, ConcurrencyLimiter, TagFilter
 from missionpanel.orm.core import Mission
 from missionpanel.orm.handler import Attempt
+from .worker import HEADER, encode_frame, decode_frame
+
+
+def decode_line(line: bytes) -> str:
+    import chardet  # deferred, it is slow to import and only needed once the subprocess prints something
+    try:
+        return line.decode(chardet.detect(line)['encoding']).strip()
+    except UnicodeDecodeError:
+        return line.strip()
 
 
 class SubprocessAsyncHandler(AsyncHandler, abc.ABC):
@@ -14,19 +24,11 @@ class SubprocessAsyncHandler(AsyncHandler, abc.ABC):
 
     async def __readline_info(self, f):
         async for line in f:
-            try:
-                line = line.decode(chardet.detect(line)['encoding']).strip()
-            except UnicodeDecodeError:
-                line = line.strip()
-            self.getLogger().info('stdout | %s' % line)
+            self.getLogger().info('stdout | %s' % decode_line(line))
 
     async def __readline_debug(self, f):
         async for line in f:
-            try:
-                line = line.decode(chardet.detect(line)['encoding']).strip()
-            except UnicodeDecodeError:
-                line = line.strip()
-            self.getLogger().info('stderr | %s' % line)
+            self.getLogger().info('stderr | %s' % decode_line(line))
 
     @abc.abstractmethod
     async def construct_command(self, mission: Mission, attempt: Attempt) -> List[str]:
@@ -37,11 +39,205 @@ class SubprocessAsyncHandler(AsyncHandler, abc.ABC):
             *(await self.construct_command(mission, attempt)),
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE)
-        await asyncio.gather(self.__readline_info(proc.stdout), self.__readline_debug(proc.stderr))
-        return_code = await proc.wait()
+        try:
+            await asyncio.gather(self.__readline_info(proc.stdout), self.__readline_debug(proc.stderr))
+            return_code = await proc.wait()
+        except asyncio.CancelledError:
+            # lease lost, do not let the subprocess keep working on it
+            proc.kill()
+            await proc.wait()
+            self.getLogger().warning('killed | %d' % proc.pid)
+            raise
         self.getLogger().info('return | %d' % return_code)
         return return_code == 0
 
 
 class SubprocessParallelAsyncHandler(SubprocessAsyncHandler, ParallelAsyncHandler):
     pass
+
+
+class Worker:
+    '''A warm worker process, talking the protocol of missionpanel.example.worker.'''
+
+    def __init__(self, proc: asyncio.subprocess.Process, logger: logging.Logger):
+        self.proc = proc
+        self.n_missions = 0
+        self.logger = logger
+        self.stderr_task = asyncio.create_task(self.__readline_stderr())
+
+    async def __readline_stderr(self):
+        async for line in self.proc.stderr:
+            self.logger.info('stderr %d | %s' % (self.proc.pid, decode_line(line)))
+
+    async def call(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        '''Raise asyncio.IncompleteReadError or ConnectionError if the worker died.'''
+        self.n_missions += 1
+        self.proc.stdin.write(encode_frame(request))
+        await self.proc.stdin.drain()
+        header = await self.proc.stdout.readexactly(HEADER.size)
+        return decode_frame(await self.proc.stdout.readexactly(HEADER.unpack(header)[0]))
+
+    def memory(self) -> Optional[int]:
+        '''Resident memory in bytes, None where /proc is not available.'''
+        try:
+            with open(f"/proc/{self.proc.pid}/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    async def kill(self):
+        if self.proc.returncode is None:
+            self.proc.kill()
+        await self.proc.wait()
+        await self.stderr_task
+
+    async def close(self, timeout: float = 5):
+        # end of file on stdin asks the worker to exit
+        self.proc.stdin.close()
+        try:
+            await asyncio.wait_for(self.proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning('killed | %d' % self.proc.pid)
+        await self.kill()
+
+
+class WorkerPool:
+    '''
+    Up to n_workers warm workers, each serving one Mission at a time.
+    A worker is restarted after max_missions Missions or once its resident memory exceeds max_memory bytes.
+    '''
+
+    def __init__(self, command: List[str], n_workers: int, max_missions: int, max_memory: Optional[int], logger: logging.Logger):
+        self.command = command
+        self.max_missions = max_missions
+        self.max_memory = max_memory
+        self.logger = logger
+        self.idle: List[Worker] = []
+        self.semaphore = asyncio.Semaphore(n_workers)
+        self.n_started = 0
+
+    async def acquire(self) -> Worker:
+        await self.semaphore.acquire()
+        try:
+            while len(self.idle) > 0:
+                worker = self.idle.pop()
+                if worker.proc.returncode is None:
+                    return worker
+                # exited while idle, e.g. killed by the OOM killer, so it is reaped and replaced
+                self.logger.warning('exited | %d with %d while idle' % (worker.proc.pid, worker.proc.returncode))
+                await worker.kill()
+            proc = await asyncio.create_subprocess_exec(
+                *self.command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+        except BaseException:
+            self.semaphore.release()
+            raise
+        self.n_started += 1
+        self.logger.info('started | %d' % proc.pid)
+        return Worker(proc, self.logger)
+
+    def worn_out(self, worker: Worker) -> bool:
+        if worker.n_missions >= self.max_missions:
+            return True
+        if self.max_memory is not None:
+            memory = worker.memory()
+            return memory is not None and memory > self.max_memory
+        return False
+
+    async def release(self, worker: Worker):
+        try:
+            if self.worn_out(worker):
+                self.logger.info('recycled | %d after %d missions' % (worker.proc.pid, worker.n_missions))
+                await worker.close()
+            else:
+                self.idle.append(worker)
+        finally:
+            self.semaphore.release()
+
+    async def discard(self, worker: Worker):
+        try:
+            await worker.kill()
+        finally:
+            self.semaphore.release()
+
+    async def close(self):
+        idle, self.idle = self.idle, []
+        await asyncio.gather(*[worker.close() for worker in idle])
+
+
+class WarmSubprocessAsyncHandler(AsyncHandler, abc.ABC):
+    '''
+    WarmSubprocessAsyncHandler sends the Missions to long-lived worker processes instead of starting a process for each,
+    which saves the interpreter startup and imports on short Missions.
+    The workers run construct_worker_command, which serves missionpanel.example.worker.
+    A worker whose Mission lost its lease is killed, the other workers are not affected.
+    '''
+
+    def __init__(self, *args, n_workers: Optional[int] = None, max_missions: int = 100, max_memory: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # one worker per Mission in flight by default, as many as the limiter of ParallelAsyncHandler may allow
+        limiter: Optional[ConcurrencyLimiter] = getattr(self, "limiter", None)
+        if n_workers is None:
+            n_workers = limiter.max_limit if limiter is not None else getattr(self, "n_parallel", 1)
+        elif limiter is not None and limiter.max_limit > n_workers:
+            # Missions waiting for a worker would hold their lease and look slow to the limiter
+            limiter.max_limit = n_workers
+            limiter.set_limit(limiter.limit, f"capped to {n_workers} workers")
+        self.n_workers = n_workers
+        self.max_missions = max_missions
+        self.max_memory = max_memory
+        self.pool: Optional[WorkerPool] = None
+
+    def getLogger(self) -> logging.Logger:
+        return logging.getLogger("WarmSubprocessAsyncHandler")
+
+    @abc.abstractmethod
+    async def construct_worker_command(self) -> List[str]:
+        raise NotImplementedError("Subclasses must implement construct_worker_command")
+
+    async def construct_request(self, mission: Mission, attempt: Attempt) -> Dict[str, Any]:
+        return {"content": mission.content, "attempt": inspect(attempt).identity[0]}
+
+    async def execute_mission(self, mission: Mission, attempt: Attempt) -> bool:
+        if self.pool is None:
+            self.pool = WorkerPool(await self.construct_worker_command(), self.n_workers, self.max_missions, self.max_memory, self.getLogger())
+        request = await self.construct_request(mission, attempt)
+        worker = await self.pool.acquire()
+        try:
+            response = await worker.call(request)
+            output, success = response["output"], response["success"]
+        except (asyncio.IncompleteReadError, ConnectionError):
+            await self.pool.discard(worker)
+            self.getLogger().error('died | %d with %s' % (worker.proc.pid, worker.proc.returncode))
+            return False
+        except Exception:
+            # e.g. a request that cannot be encoded or a garbled response, the worker may be out of sync with the frames
+            await self.pool.discard(worker)
+            self.getLogger().exception('discarded | %d' % worker.proc.pid)
+            return False
+        except BaseException:
+            # lease lost, do not let the worker keep working on it
+            await self.pool.discard(worker)
+            self.getLogger().warning('killed | %d' % worker.proc.pid)
+            raise
+        for line in output.splitlines():
+            self.getLogger().info('stdout %d | %s' % (worker.proc.pid, line))
+        await self.pool.release(worker)
+        self.getLogger().info('return | %s' % success)
+        return success
+
+    async def close_workers(self):
+        if self.pool is not None:
+            await self.pool.close()
+
+    async def run_all(self, tags: Union[List[str] | TagFilter]):
+        try:
+            await super().run_all(tags)
+        finally:
+            await self.close_workers()
+
+
+class WarmSubprocessParallelAsyncHandler(WarmSubprocessAsyncHandler, ParallelAsyncHandler):
+    pass
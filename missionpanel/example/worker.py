@@ -0,0 +1,72 @@
+'''
+Worker side of the warm worker processes of WarmSubprocessAsyncHandler.
+A worker reads framed requests from stdin and writes framed responses to stdout, one Mission at a time.
+A frame is a 4 bytes big-endian length followed by that many bytes of JSON.
+The request is {"content": <Mission content>, "attempt": <Attempt id>},
+the response is {"success": <bool>, "output": <what the Mission printed>}.
+
+Serve a function taking the request and returning the success with `python -m missionpanel.example.worker module:function`,
+or call serve(function) from a script of your own.
+This module is kept free of imports from missionpanel, so that the workers start fast.
+'''
+import contextlib
+import importlib
+import io
+import json
+import os
+import struct
+import sys
+import traceback
+from typing import Any, BinaryIO, Callable, Dict, Optional
+
+HEADER = struct.Struct(">I")
+
+
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    body = json.dumps(message, ensure_ascii=False).encode("utf8")
+    return HEADER.pack(len(body)) + body
+
+
+def decode_frame(body: bytes) -> Dict[str, Any]:
+    return json.loads(body.decode("utf8"))
+
+
+def read_frame(f: BinaryIO) -> Optional[Dict[str, Any]]:
+    '''None on end of file, which is how the parent tells the worker to exit.'''
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    return decode_frame(f.read(HEADER.unpack(header)[0]))
+
+
+def write_frame(f: BinaryIO, message: Dict[str, Any]):
+    f.write(encode_frame(message))
+    f.flush()
+
+
+def serve(execute: Callable[[Dict[str, Any]], bool]):
+    # keep the real stdout for the frames, anything else written to it (by C code or child processes) goes to stderr
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    requests = sys.stdin.buffer
+    while (request := read_frame(requests)) is not None:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            try:
+                success = bool(execute(request))
+            except Exception:
+                traceback.print_exc()
+                success = False
+        write_frame(channel, {"success": success, "output": output.getvalue()})
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1 or ":" not in argv[0]:
+        sys.exit("usage: python -m missionpanel.example.worker module:function")
+    module, function = argv[0].split(":", 1)
+    serve(getattr(importlib.import_module(module), function))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
 from .handler import Handler
 from .handler import AsyncHandler
 from .parallal_handler import ParallelAsyncHandler
+from .retry import RetryPolicy
+from .adaptive import ConcurrencyLimiter, LimitChange
+from .tag_filter import TagFilter, AllOf, AnyOf, NoneOf
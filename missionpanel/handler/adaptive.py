@@ -0,0 +1,104 @@
+import collections
+import logging
+import time
+from typing import Deque, NamedTuple, Optional
+
+
+class LimitChange(NamedTuple):
+    time: float
+    old_limit: int
+    new_limit: int
+    reason: str
+
+
+class ConcurrencyLimiter:
+    '''
+    ConcurrencyLimiter is an AIMD limiter for the number of in-flight Missions.
+    The limit grows by `increase` once every `limit` successful Missions in a row,
+    and shrinks by `decrease` times when, over the last `window` Missions,
+    the failure rate exceeds max_failure_rate,
+    the average latency exceeds latency_tolerance times the best average latency of the last baseline_windows windows,
+    or a heartbeat is late by more than heartbeat_lag_tolerance seconds.
+    After a change, it waits for a fresh window before shrinking again.
+    The baseline forgets the old windows, so that a workload which became slower for good is not taken for an overload forever.
+    Without initial_limit, ParallelAsyncHandler starts it at its n_parallel.
+    '''
+    logger = logging.getLogger('ConcurrencyLimiter')
+
+    def __init__(
+            self,
+            min_limit: int = 1,
+            max_limit: int = 64,
+            initial_limit: Optional[int] = None,
+            increase: int = 1,
+            decrease: float = 0.5,
+            window: int = 20,
+            max_failure_rate: float = 0.2,
+            latency_tolerance: float = 2.0,
+            heartbeat_lag_tolerance: float = 1.0,
+            baseline_windows: int = 10,
+            max_history: int = 100):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.initial_limit = initial_limit
+        self.limit = min(max(initial_limit if initial_limit is not None else min_limit, min_limit), max_limit)
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.max_failure_rate = max_failure_rate
+        self.latency_tolerance = latency_tolerance
+        self.heartbeat_lag_tolerance = heartbeat_lag_tolerance
+        self.samples: Deque[tuple] = collections.deque(maxlen=window)
+        # average latency of the recent windows
+        self.baseline: Deque[float] = collections.deque(maxlen=baseline_windows)
+        self.samples_since_baseline = 0
+        self.successes_since_change = 0
+        self.history: Deque[LimitChange] = collections.deque(maxlen=max_history)
+
+    @property
+    def best_latency(self) -> Optional[float]:
+        return min(self.baseline) if len(self.baseline) > 0 else None
+
+    def seed(self, limit: int):
+        '''Start from limit instead of min_limit, unless initial_limit was given.'''
+        if self.initial_limit is None and len(self.history) <= 0:
+            self.limit = min(max(limit, self.min_limit), self.max_limit)
+
+    def set_limit(self, limit: int, reason: str):
+        limit = min(max(limit, self.min_limit), self.max_limit)
+        if limit == self.limit:
+            return
+        self.history.append(LimitChange(time.time(), self.limit, limit, reason))
+        self.logger.info(f"Concurrency limit {self.limit} -> {limit}: {reason}")
+        self.limit = limit
+        self.samples.clear()
+        self.successes_since_change = 0
+
+    def shrink(self, reason: str):
+        self.set_limit(int(self.limit * self.decrease), reason)
+
+    def on_complete(self, latency: float, success: bool, in_flight: int):
+        self.samples.append((latency, success))
+        if len(self.samples) >= self.window:
+            failure_rate = sum(1 for _, success in self.samples if not success) / len(self.samples)
+            if failure_rate > self.max_failure_rate:
+                return self.shrink(f"failure rate {failure_rate:.2f} > {self.max_failure_rate:.2f}")
+            avg_latency = sum(latency for latency, _ in self.samples) / len(self.samples)
+            best_latency = self.best_latency
+            if best_latency is not None and avg_latency > best_latency * self.latency_tolerance:
+                return self.shrink(f"latency {avg_latency:.3f}s > {self.latency_tolerance} * {best_latency:.3f}s")
+            self.samples_since_baseline += 1
+            if best_latency is None or self.samples_since_baseline >= self.window:
+                self.baseline.append(avg_latency)
+                self.samples_since_baseline = 0
+        if not success:
+            self.successes_since_change = 0
+            return
+        self.successes_since_change += 1
+        # only grow when the current limit is actually used
+        if self.successes_since_change >= self.limit and in_flight >= self.limit:
+            self.set_limit(self.limit + self.increase, f"{self.successes_since_change} successes at full concurrency")
+
+    def on_heartbeat(self, lag: float):
+        if lag > self.heartbeat_lag_tolerance and len(self.samples) > 0:
+            self.shrink(f"heartbeat lag {lag:.3f}s > {self.heartbeat_lag_tolerance}s")
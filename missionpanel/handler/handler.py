@@ -1,75 +1,231 @@
 import abc
 import asyncio
 import datetime
-from typing import List, Optional, Tuple, Union
-from sqlalchemy.orm import Session, Query, selectinload, configure_mappers
+import logging
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Union
+from sqlalchemy.orm import Session, Query, selectinload, joinedload, aliased
 from sqlalchemy.ext.asyncio import AsyncSession
-from missionpanel.orm import Mission, Tag, MissionTag, Attempt
-from sqlalchemy import select, func, distinct, Select, cast, Text
-
-configure_mappers()
+from missionpanel.orm import Mission, MissionDependency, Attempt, statement_cache, content_matches
+from missionpanel.orm.index import ContentValue
+from missionpanel.orm.stats import record_attempt_stat
+from missionpanel.submitter.abc import SubmitterInterface
+from sqlalchemy import select, update, exists, inspect, bindparam, Select, Update, Engine
+from sqlalchemy.pool import SingletonThreadPool
+from .retry import RetryPolicy
+from .tag_filter import TagFilter, as_tag_filter
 
 
 class HandlerInterface(abc.ABC):
+    logger = logging.getLogger('HandlerInterface')
 
     @staticmethod
-    def query_missions_by_tag(tags: List[str]) -> Select[Tuple[Mission]]:
-        return (
-            select(Mission)
-            .join(MissionTag)
-            .join(Tag)
-            .filter(Tag.name.in_(tags))
-            .group_by(Mission.id)
-            .having(func.count(distinct(Tag.name)) == len(tags))
-        )
+    def _build_missions_by_tag(tag_filter: TagFilter) -> Select[Tuple[Mission]]:
+        return select(Mission).where(tag_filter.compile())
 
     @staticmethod
-    def query_todo_missions(tags: List[str]) -> Select[Tuple[Mission]]:
-        return (
-            HandlerInterface.query_missions_by_tag(tags)
+    def prepare_missions_by_tag(tags: Union[List[str] | TagFilter]) -> Tuple[Select[Tuple[Mission]], dict]:
+        '''tags is a TagFilter such as AnyOf("rsshub") & NoneOf("twitter"), or a list of tags meaning AllOf them.'''
+        tag_filter = as_tag_filter(tags)
+        statement = statement_cache.get(("missions_by_tag", tag_filter.key()), lambda: HandlerInterface._build_missions_by_tag(tag_filter))
+        return statement, tag_filter.parameters()
+
+    @staticmethod
+    def query_missions_by_tag(tags: Union[List[str] | TagFilter]) -> Select[Tuple[Mission]]:
+        statement, params = HandlerInterface.prepare_missions_by_tag(tags)
+        return statement.params(**params)
+
+    @staticmethod
+    def _build_todo_missions(tag_filter: TagFilter, content_paths: Tuple[str, ...] = ()) -> Select[Tuple[Mission]]:
+        now = bindparam("now")
+        statement = (
+            HandlerInterface._build_missions_by_tag(tag_filter)
             .outerjoin(Attempt, onclause=(
-                (cast(Attempt.content, Text) == cast(Mission.content, Text)) & (
+                (Attempt.mission_id == Mission.id) &
+                (Attempt.content_digest == Mission.content_digest) & (
                     # see if Attempt is finished or working on the Mission
                     Attempt.success.is_(True) |  # have finished handler
-                    (Attempt.last_update_time + Attempt.max_time_interval >= datetime.datetime.now())  # have working handler
+                    (Attempt.expire_time >= now)  # have working handler
                 )
             ))
             .where(Attempt.id == None)
-            .options(selectinload(Mission.attempts))
+            # see if Mission is waiting for retry, quarantined or waiting for its dependencies
+            .where(Mission.archived.is_(False))
+            .where(Mission.quarantined.is_(False))
+            .where(Mission.unresolved_dependencies == 0)
+            .where((Mission.next_eligible_time == None) | (Mission.next_eligible_time <= now))
+            .options(selectinload(Mission.attempts), joinedload(Mission.blob))
         )
+        for i, path in enumerate(content_paths):
+            statement = statement.where(content_matches(path, bindparam(f"content_{i}", type_=ContentValue())))
+        return statement
+
+    @staticmethod
+    def todo_missions_key(tags: Union[List[str] | TagFilter], content_filter: Dict[str, Any] = {}) -> Hashable:
+        return ("todo_missions", as_tag_filter(tags).key(), tuple(sorted(content_filter.keys())))
+
+    @staticmethod
+    def prepare_todo_missions(tags: Union[List[str] | TagFilter], content_filter: Dict[str, Any] = {}) -> Tuple[Select[Tuple[Mission]], dict]:
+        '''
+        tags is a TagFilter or a list of tags meaning AllOf them.
+        content_filter maps content paths registered with content_index to the values that Missions should have.
+        '''
+        tag_filter = as_tag_filter(tags)
+        content_paths = tuple(sorted(content_filter.keys()))
+        statement = statement_cache.get(
+            HandlerInterface.todo_missions_key(tag_filter, content_filter),
+            lambda: HandlerInterface._build_todo_missions(tag_filter, content_paths))
+        params = {"now": datetime.datetime.now(), **tag_filter.parameters()}
+        params.update({f"content_{i}": content_filter[path] for i, path in enumerate(content_paths)})
+        return statement, params
+
+    @staticmethod
+    def query_todo_missions(tags: Union[List[str] | TagFilter], content_filter: Dict[str, Any] = {}) -> Select[Tuple[Mission]]:
+        statement, params = HandlerInterface.prepare_todo_missions(tags, content_filter)
+        return statement.params(**params)
 
     @staticmethod
     def create_attempt(session: Union[Session | AsyncSession], mission: Mission, name: str, max_time_interval: datetime.timedelta = datetime.timedelta(seconds=1)) -> Attempt:
         attempt = Attempt(
             handler=name,
             max_time_interval=max_time_interval,
-            content=mission.content,
+            expire_time=datetime.datetime.now() + max_time_interval,
+            content_digest=mission.content_digest,
             mission=mission)
         session.add(attempt)
+        mission.state = "running"
         return attempt
 
+    @staticmethod
+    def _build_renew_lease() -> Update:
+        newer = aliased(Attempt)
+        return (
+            update(Attempt)
+            .where(Attempt.id == bindparam("attempt_id"))
+            .where(exists(
+                select(Mission.id)
+                .where(Mission.id == Attempt.mission_id)
+                .where(Mission.content_digest == Attempt.content_digest)
+            ))
+            .where(~exists(
+                select(newer.id)
+                .where(newer.mission_id == Attempt.mission_id)
+                .where(newer.id > Attempt.id)
+                .where(newer.content_digest == Attempt.content_digest)
+            ))
+            .values(last_update_time=bindparam("now"), expire_time=bindparam("expire_time"))
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def prepare_renew_lease(attempt_id: int, max_time_interval: datetime.timedelta) -> Tuple[Update, dict]:
+        '''
+        Heartbeat of an Attempt which only succeeds (rowcount 1) if the Attempt still holds the lease on its Mission:
+        the Mission content is still the one the Attempt is working on, and no other Attempt has taken the Mission over.
+        '''
+        statement = statement_cache.get("renew_lease", HandlerInterface._build_renew_lease)
+        now = datetime.datetime.now()
+        return statement, {"attempt_id": attempt_id, "now": now, "expire_time": now + max_time_interval}
+
+    @staticmethod
+    def resolve_dependencies(mission_ids: List[int]) -> Update:
+        return (
+            update(MissionDependency)
+            .where(MissionDependency.depends_on_id.in_(mission_ids))
+            .where(MissionDependency.resolved.is_(False))
+            .values(resolved=True)
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def query_dependents(mission_ids: List[int]) -> Select[Tuple[int]]:
+        return select(MissionDependency.mission_id).where(MissionDependency.depends_on_id.in_(mission_ids))
+
+    @staticmethod
+    def record_success(mission: Mission):
+        mission.state = "done"
+        if mission.failure_count or mission.next_eligible_time is not None:
+            mission.failure_count = 0
+            mission.next_eligible_time = None
+
+    @staticmethod
+    def record_failure(mission: Mission, retry_policy: RetryPolicy):
+        mission.failure_count = (mission.failure_count or 0) + 1
+        mission.next_eligible_time = datetime.datetime.now() + retry_policy.backoff(mission.failure_count)
+        if retry_policy.should_quarantine(mission.failure_count):
+            mission.quarantined = True
+        mission.state = "quarantined" if mission.quarantined else "pending"
+
+    @staticmethod
+    def attempt_latency(attempt: Attempt) -> float:
+        return (attempt.last_update_time - attempt.create_time).total_seconds()
+
+    @staticmethod
+    def thread_bound(engine: Engine) -> bool:
+        '''If every thread gets its own database from the engine, like the default pool of the in-memory SQLite.'''
+        return isinstance(engine.pool, SingletonThreadPool) and engine.url.database in (None, "", ":memory:")
+
 
 class Handler(HandlerInterface, abc.ABC):
-    def __init__(self, session: Session, name: str, max_time_interval: datetime.timedelta = datetime.timedelta(seconds=1)):
+    '''
+    Handler renews the lease of its Attempt from a heartbeat thread while execute_mission runs,
+    so its session has to be bound to an engine whose connections can be used from any thread:
+    the in-memory SQLite gives every thread its own empty database unless it uses StaticPool.
+    '''
+
+    def __init__(self, session: Session, name: str, max_time_interval: datetime.timedelta = datetime.timedelta(seconds=1), retry_policy: RetryPolicy = RetryPolicy(), content_filter: Dict[str, Any] = {}):
         self.session = session
         self.name = name
         self.max_time_interval = max_time_interval
+        self.retry_policy = retry_policy
+        # only handle the Missions having these values in their content
+        self.content_filter = content_filter
+        # execute_mission should give up as soon as possible once this is set
+        self.lease_lost = threading.Event()
+        if HandlerInterface.thread_bound(session.get_bind().engine):
+            self.logger.warning(f"{name} cannot renew its leases on {session.get_bind().engine.url}, use StaticPool for an in-memory SQLite")
 
     @abc.abstractmethod
     def select_mission(self, missions: Query[Mission]) -> Optional[Mission]:
         return missions[0] if missions else None
 
     def report_attempt(self, mission: Mission, attempt: Attempt):
-        attempt.success = False
         attempt.last_update_time = datetime.datetime.now()
+        attempt.expire_time = attempt.last_update_time + self.max_time_interval
         self.session.commit()
 
     @abc.abstractmethod
     def execute_mission(self, mission: Mission, attempt: Attempt) -> bool:
         pass
 
-    def run_once(self, tags: List[str]):
-        missions = self.session.execute(HandlerInterface.query_todo_missions(tags)).scalars().all()
+    def heartbeat(self, attempt_id: int, lease_lost: threading.Event, stop: threading.Event):
+        '''
+        Renew the lease of the Attempt from its own thread until stop is set.
+        The lease is lost once another Attempt takes the Mission over, or once the renewals kept failing
+        for longer than max_time_interval, since another handler may have taken the Mission over meanwhile.
+        '''
+        # Session is not thread safe, so the heartbeat thread has its own
+        with Session(self.session.get_bind()) as session:
+            renewed_at = time.monotonic()
+            while not stop.wait(self.max_time_interval.total_seconds() / 2):
+                try:
+                    renewed = session.execute(*HandlerInterface.prepare_renew_lease(attempt_id, self.max_time_interval)).rowcount > 0
+                    session.commit()
+                except Exception:
+                    session.rollback()
+                    self.logger.exception(f"Heartbeat of attempt {attempt_id} failed, error: ")
+                    if time.monotonic() - renewed_at > self.max_time_interval.total_seconds():
+                        lease_lost.set()
+                        return
+                    continue
+                if not renewed:
+                    lease_lost.set()
+                    return
+                renewed_at = time.monotonic()
+
+    def run_once(self, tags: Union[List[str] | TagFilter]):
+        missions = self.session.execute(*HandlerInterface.prepare_todo_missions(tags, self.content_filter)).scalars().all()
         mission = self.select_mission(missions)
         if mission is None:
             # avoid idle in transaction
@@ -77,17 +233,53 @@ class Handler(HandlerInterface, abc.ABC):
             return
         attempt = HandlerInterface.create_attempt(self.session, mission, self.name, self.max_time_interval)
         self.report_attempt(mission, attempt)
-        if self.execute_mission(mission, attempt):
+        self.lease_lost = threading.Event()
+        if HandlerInterface.thread_bound(self.session.get_bind().engine):
+            # the heartbeat thread would only see an empty database
+            return self.finish_attempt(mission, attempt, self.execute_mission(mission, attempt))
+        stop = threading.Event()
+        watchdog = threading.Thread(target=self.heartbeat, args=(attempt.id, self.lease_lost, stop), daemon=True)
+        watchdog.start()
+        try:
+            success = self.execute_mission(mission, attempt)
+        finally:
+            stop.set()
+            watchdog.join()
+        if self.lease_lost.is_set():
+            self.logger.warning(f"Attempt {attempt.id} lost its lease on mission {mission.id}")
+            return attempt
+        return self.finish_attempt(mission, attempt, success)
+
+    def finish_attempt(self, mission: Mission, attempt: Attempt, success: bool):
+        if success:
             attempt.success = True
-        self.report_attempt(mission, attempt)
+            HandlerInterface.record_success(mission)
+            self.release_dependents([mission.id])
+        else:
+            HandlerInterface.record_failure(mission, self.retry_policy)
+        attempt.last_update_time = datetime.datetime.now()
+        # not working on it anymore
+        attempt.expire_time = attempt.last_update_time
+        record_attempt_stat(self.session.connection(), self.name, attempt.last_update_time, HandlerInterface.attempt_latency(attempt), success)
+        self.session.commit()
         return attempt
 
+    def release_dependents(self, mission_ids: List[int]):
+        # not committed here, so that it can be committed together with the succeeded Attempt
+        # the lock makes the submitters adding dependencies on these Missions wait, see SubmitterInterface.lock_missions
+        self.session.execute(SubmitterInterface.lock_missions(mission_ids))
+        self.session.execute(HandlerInterface.resolve_dependencies(mission_ids))
+        self.session.execute(SubmitterInterface.recount_dependencies(HandlerInterface.query_dependents(mission_ids)))
+
 
 class AsyncHandler(HandlerInterface, abc.ABC):
-    def __init__(self, session: AsyncSession, name: str, max_time_interval: datetime.timedelta = datetime.timedelta(seconds=1)):
+    def __init__(self, session: AsyncSession, name: str, max_time_interval: datetime.timedelta = datetime.timedelta(seconds=1), retry_policy: RetryPolicy = RetryPolicy(), content_filter: Dict[str, Any] = {}):
         self.session = session
         self.name = name
         self.max_time_interval = max_time_interval
+        self.retry_policy = retry_policy
+        # only handle the Missions having these values in their content
+        self.content_filter = content_filter
 
     @abc.abstractmethod
     async def select_mission(self, missions: Query[Mission]) -> Optional[Mission]:
@@ -95,16 +287,26 @@ class AsyncHandler(HandlerInterface, abc.ABC):
 
     async def report_attempt(self, mission: Mission, attempt: Attempt):
         attempt.last_update_time = datetime.datetime.now()
+        attempt.expire_time = attempt.last_update_time + self.max_time_interval
         await self.session.commit()
         await self.session.refresh(attempt)
         await self.session.refresh(mission)
 
+    async def renew_attempt(self, mission: Mission, attempt: Attempt) -> bool:
+        # identity does not trigger a load even if attempt has been expired by a commit
+        attempt_id = inspect(attempt).identity[0]
+        renewed = (await self.session.execute(*HandlerInterface.prepare_renew_lease(attempt_id, self.max_time_interval))).rowcount > 0
+        await self.session.commit()
+        await self.session.refresh(attempt)
+        await self.session.refresh(mission)
+        return renewed
+
     @abc.abstractmethod
     async def execute_mission(self, mission: Mission, attempt: Attempt) -> bool:
         pass
 
-    async def get_mission(self, tags: List[str]) -> Optional[Mission]:
-        missions = (await self.session.execute(HandlerInterface.query_todo_missions(tags))).scalars().all()
+    async def get_mission(self, tags: Union[List[str] | TagFilter]) -> Optional[Mission]:
+        missions = (await self.session.execute(*HandlerInterface.prepare_todo_missions(tags, self.content_filter))).scalars().all()
         mission = await self.select_mission(missions)
         # avoid idle in transaction
         await self.session.commit()
@@ -117,16 +319,44 @@ class AsyncHandler(HandlerInterface, abc.ABC):
         await self.report_attempt(mission, attempt)
         task = asyncio.create_task(self.execute_mission(mission, attempt))
         while not task.done():
-            await self.report_attempt(mission, attempt)
-            await asyncio.sleep(self.max_time_interval.total_seconds() / 2)
+            if not await self.renew_attempt(mission, attempt):
+                self.logger.warning(f"Attempt {attempt.id} lost its lease on mission {mission.id}, cancelling it")
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                return attempt
+            await asyncio.wait([task], timeout=self.max_time_interval.total_seconds() / 2)
+        return await self.finish_attempt(mission, attempt, task.result())
+
+    async def finish_attempt(self, mission: Mission, attempt: Attempt, success: bool):
         # refresh attempt state because the transaction may have been committed during execute_mission
         await self.session.refresh(attempt)
-        if task.result():
+        await self.session.refresh(mission)
+        if success:
             attempt.success = True
-        await self.report_attempt(mission, attempt)
+            HandlerInterface.record_success(mission)
+            await self.release_dependents([mission.id])
+        else:
+            HandlerInterface.record_failure(mission, self.retry_policy)
+        attempt.last_update_time = datetime.datetime.now()
+        # not working on it anymore
+        attempt.expire_time = attempt.last_update_time
+        finish_time, latency = attempt.last_update_time, HandlerInterface.attempt_latency(attempt)
+        await self.session.run_sync(lambda session: record_attempt_stat(session.connection(), self.name, finish_time, latency, success))
+        await self.session.commit()
+        await self.session.refresh(attempt)
+        await self.session.refresh(mission)
         return attempt
 
-    async def run_once(self, tags: List[str]):
+    async def release_dependents(self, mission_ids: List[int]):
+        # not committed here, so that it can be committed together with the succeeded Attempt
+        await self.session.execute(SubmitterInterface.lock_missions(mission_ids))
+        await self.session.execute(HandlerInterface.resolve_dependencies(mission_ids))
+        await self.session.execute(SubmitterInterface.recount_dependencies(HandlerInterface.query_dependents(mission_ids)))
+
+    async def run_once(self, tags: Union[List[str] | TagFilter]):
         mission = await self.get_mission(tags)
         if mission is None:
             return
@@ -137,6 +367,6 @@ class AsyncHandler(HandlerInterface, abc.ABC):
         await self.session.refresh(mission)
         return await self.watchdog_mission(mission, attempt)
 
-    async def run_all(self, tags: List[str]):
+    async def run_all(self, tags: Union[List[str] | TagFilter]):
         while await self.run_once(tags):
             pass
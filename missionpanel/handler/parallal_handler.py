@@ -1,31 +1,74 @@
 import abc
 import asyncio
-from typing import List
+import time
+from typing import Dict, List, Optional, Union
 
+from sqlalchemy import inspect
 from missionpanel.orm import Mission, Attempt
 from .handler import AsyncHandler, HandlerInterface
+from .adaptive import ConcurrencyLimiter
+from .tag_filter import TagFilter
 
 
 class ParallelAsyncHandler(AsyncHandler, abc.ABC):
-    def __init__(self, n_parallel: int, *args, **kwargs):
+    '''
+    ParallelAsyncHandler runs up to n_parallel Missions at the same time.
+    If a limiter is given, the number of Missions in flight follows limiter.limit instead, which adapts at runtime
+    starting from n_parallel, unless the limiter has its own initial_limit.
+    '''
+
+    def __init__(self, n_parallel: int, *args, limiter: Optional[ConcurrencyLimiter] = None, **kwargs):
         super().__init__(*args, **kwargs)
-        self.task_queue = asyncio.Queue(n_parallel)
-        for i in range(n_parallel):
-            self.task_queue.put_nowait(i)
-        self.task_dict = {}
+        self.n_parallel = n_parallel
+        self.limiter = limiter
+        if limiter is not None:
+            limiter.seed(n_parallel)
+        self.slot_condition = asyncio.Condition()
+        self.task_dict: Dict[int, asyncio.Task] = {}
+        self.last_heartbeat: Dict[int, float] = {}
+        self.outcomes: Dict[int, bool] = {}
         self.sem_report = asyncio.Semaphore(1)
 
+    @property
+    def concurrency_limit(self) -> int:
+        return self.limiter.limit if self.limiter is not None else self.n_parallel
+
     async def report_attempt(self, mission: Mission, attempt: Attempt):
         async with self.sem_report:
             await super().report_attempt(mission, attempt)
 
-    async def run_all(self, tags: List[str]):
+    async def finish_attempt(self, mission: Mission, attempt: Attempt, success: bool):
+        self.outcomes[inspect(attempt).identity[0]] = success
+        async with self.sem_report:
+            return await super().finish_attempt(mission, attempt, success)
+
+    async def renew_attempt(self, mission: Mission, attempt: Attempt) -> bool:
+        now = time.monotonic()
+        attempt_id = inspect(attempt).identity[0]
+        if self.limiter is not None and attempt_id in self.last_heartbeat:
+            self.limiter.on_heartbeat(now - self.last_heartbeat[attempt_id] - self.max_time_interval.total_seconds() / 2)
+        self.last_heartbeat[attempt_id] = now
+        async with self.sem_report:
+            return await super().renew_attempt(mission, attempt)
+
+    async def run_all(self, tags: Union[List[str] | TagFilter]):
         async def task(mission: Mission, attempt: Attempt, id: int):
-            attempt = await self.watchdog_mission(mission, attempt)
-            await self.task_queue.put(id)
-            return attempt
+            start = time.monotonic()
+            try:
+                attempt = await self.watchdog_mission(mission, attempt)
+                if self.limiter is not None:
+                    # no outcome means the lease was lost
+                    self.limiter.on_complete(time.monotonic() - start, self.outcomes.get(id, False), len(self.task_dict))
+                return attempt
+            finally:
+                self.last_heartbeat.pop(id, None)
+                self.outcomes.pop(id, None)
+                async with self.slot_condition:
+                    del self.task_dict[id]
+                    self.slot_condition.notify_all()
         while True:
-            id = await self.task_queue.get()
+            async with self.slot_condition:
+                await self.slot_condition.wait_for(lambda: len(self.task_dict) < self.concurrency_limit)
             async with self.sem_report:
                 mission = await self.get_mission(tags)
                 if mission is None:
@@ -35,7 +78,5 @@ class ParallelAsyncHandler(AsyncHandler, abc.ABC):
                 await self.session.commit()
                 await self.session.refresh(attempt)
                 await self.session.refresh(mission)
-                self.task_dict[id] = asyncio.create_task(task(mission, attempt, id))
-        for i in self.task_dict:
-            await self.task_dict[i]
-        self.task_dict = {}
+                self.task_dict[attempt.id] = asyncio.create_task(task(mission, attempt, attempt.id))
+        await asyncio.gather(*self.task_dict.values())
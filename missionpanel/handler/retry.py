@@ -0,0 +1,31 @@
+import datetime
+import random
+from typing import Optional
+
+
+class RetryPolicy:
+    '''
+    RetryPolicy decides when a failed Mission can be handled again.
+    The delay grows exponentially with the number of consecutive failures, with random jitter so that handlers do not retry in lockstep.
+    After max_failures consecutive failures the Mission is quarantined until someone requeues it (max_failures=None never quarantines).
+    '''
+
+    def __init__(
+            self,
+            base_delay: datetime.timedelta = datetime.timedelta(seconds=10),
+            max_delay: datetime.timedelta = datetime.timedelta(hours=1),
+            multiplier: float = 2.0,
+            jitter: float = 0.5,
+            max_failures: Optional[int] = 10):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_failures = max_failures
+
+    def backoff(self, failure_count: int) -> datetime.timedelta:
+        delay = min(self.base_delay.total_seconds() * self.multiplier ** max(failure_count - 1, 0), self.max_delay.total_seconds())
+        return datetime.timedelta(seconds=delay * (1 + self.jitter * random.random()))
+
+    def should_quarantine(self, failure_count: int) -> bool:
+        return self.max_failures is not None and failure_count >= self.max_failures
@@ -0,0 +1,147 @@
+import abc
+import itertools
+from typing import Hashable, Iterator, List, Union
+from sqlalchemy import ColumnElement, select, exists, func, bindparam, and_, or_, not_
+from missionpanel.orm import Mission, MissionTag
+
+
+class TagFilter(abc.ABC):
+    '''
+    Expression over the tags of a Mission, combined with & (and), | (or) and ~ (not).
+    It compiles to subqueries on missiontag with the tags as bound parameters,
+    so that filters of the same shape share one cached statement.
+    '''
+
+    def __and__(self, other: Union['TagFilter', List[str]]) -> 'TagFilter':
+        return And(self, as_tag_filter(other))
+
+    def __or__(self, other: Union['TagFilter', List[str]]) -> 'TagFilter':
+        return Or(self, as_tag_filter(other))
+
+    def __invert__(self) -> 'TagFilter':
+        return Not(self)
+
+    @abc.abstractmethod
+    def key(self) -> Hashable:
+        '''Shape of the filter, the tags excluded.'''
+        pass
+
+    @abc.abstractmethod
+    def clause(self, names: Iterator[str]) -> ColumnElement[bool]:
+        pass
+
+    @abc.abstractmethod
+    def params(self, names: Iterator[str]) -> dict:
+        '''Values of the bound parameters of clause, given the same names.'''
+        pass
+
+    def compile(self) -> ColumnElement[bool]:
+        return self.clause(parameter_names())
+
+    def parameters(self) -> dict:
+        return self.params(parameter_names())
+
+
+def parameter_names() -> Iterator[str]:
+    return (f"tag_filter_{i}" for i in itertools.count())
+
+
+class TagSet(TagFilter, abc.ABC):
+    def __init__(self, *tags: str):
+        if len(tags) == 1 and not isinstance(tags[0], str):
+            tags = tuple(tags[0])  # AllOf(["a", "b"]) is AllOf("a", "b")
+        self.tags = sorted(set(tags))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({', '.join(tag.__repr__() for tag in self.tags)})"
+
+    def key(self) -> Hashable:
+        return (self.__class__.__name__,)
+
+    def params(self, names: Iterator[str]) -> dict:
+        return {next(names): self.tags}
+
+    @staticmethod
+    def tagged(name: str):
+        # range scans of the (tag_name, mission_id) primary key
+        return select(MissionTag.mission_id).where(MissionTag.tag_name.in_(bindparam(name, expanding=True)))
+
+
+class AnyOf(TagSet):
+    '''Mission has at least one of the tags.'''
+
+    def clause(self, names: Iterator[str]) -> ColumnElement[bool]:
+        # uncorrelated, so that the database runs it once instead of probing the tags for every Mission
+        return Mission.id.in_(TagSet.tagged(next(names)))
+
+
+class NoneOf(TagSet):
+    '''Mission has none of the tags.'''
+
+    def clause(self, names: Iterator[str]) -> ColumnElement[bool]:
+        # NOT EXISTS rather than NOT IN, which PostgreSQL cannot turn into an anti-join
+        return ~exists(TagSet.tagged(next(names)).where(MissionTag.mission_id == Mission.id))
+
+
+class AllOf(TagSet):
+    '''Mission has every one of the tags.'''
+
+    def clause(self, names: Iterator[str]) -> ColumnElement[bool]:
+        name = next(names)
+        return Mission.id.in_(
+            TagSet.tagged(name)
+            .group_by(MissionTag.mission_id)
+            .having(func.count() == bindparam(f"{name}_n")))
+
+    def params(self, names: Iterator[str]) -> dict:
+        name = next(names)
+        return {name: self.tags, f"{name}_n": len(self.tags)}
+
+
+class Combination(TagFilter, abc.ABC):
+    def __init__(self, *filters: TagFilter):
+        self.filters = filters
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({', '.join(f.__repr__() for f in self.filters)})"
+
+    def key(self) -> Hashable:
+        return (self.__class__.__name__, *[f.key() for f in self.filters])
+
+    def params(self, names: Iterator[str]) -> dict:
+        params = {}
+        for f in self.filters:
+            params.update(f.params(names))
+        return params
+
+
+class And(Combination):
+    def __and__(self, other: Union[TagFilter, List[str]]) -> TagFilter:
+        return And(*self.filters, as_tag_filter(other))
+
+    def clause(self, names: Iterator[str]) -> ColumnElement[bool]:
+        return and_(*[f.clause(names) for f in self.filters])
+
+
+class Or(Combination):
+    def __or__(self, other: Union[TagFilter, List[str]]) -> TagFilter:
+        return Or(*self.filters, as_tag_filter(other))
+
+    def clause(self, names: Iterator[str]) -> ColumnElement[bool]:
+        return or_(*[f.clause(names) for f in self.filters])
+
+
+class Not(Combination):
+    def __init__(self, filter: TagFilter):
+        super().__init__(filter)
+
+    def __invert__(self) -> TagFilter:
+        return self.filters[0]
+
+    def clause(self, names: Iterator[str]) -> ColumnElement[bool]:
+        return not_(self.filters[0].clause(names))
+
+
+def as_tag_filter(tags: Union[TagFilter, List[str]]) -> TagFilter:
+    '''A plain list of tags means all of them, as it always did.'''
+    return tags if isinstance(tags, TagFilter) else AllOf(tags)
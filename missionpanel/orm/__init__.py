@@ -1,2 +1,7 @@
-from .core import Base, Mission, Tag, MissionTag, Matcher
+from .core import Base, ContentBlob, Mission, Tag, MissionTag, Matcher, MissionDependency, MISSION_STATES
 from .handler import Attempt
+from .archive import AttemptArchive
+from .cache import StatementCache, statement_cache
+from .content import ContentCache, content_cache
+from .index import ContentField, content_index, content_matches, create_content_indexes
+from .stats import TagStat, TagStatDelta, HandlerStat, HandlerStatDelta
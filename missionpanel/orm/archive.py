@@ -0,0 +1,51 @@
+import datetime
+from sqlalchemy import (
+    Column,
+    Integer,
+    Text,
+    Boolean,
+    DateTime,
+    Interval,
+    ForeignKey,
+    Index,
+    event,
+)
+from sqlalchemy.orm import relationship, Mapped
+from .core import Base, Mission, ContentBlob
+from .content import HasContent, store_content
+
+
+class AttemptArchive(HasContent, Base):
+    '''
+    Attempts of the archived Missions, moved out of attempt so that the queries of the handlers do not join them.
+    The columns are those of Attempt, except for the id which SQLite may reuse once the Attempts are deleted.
+    '''
+    __tablename__ = "attemptarchive"
+    __table_args__ = (
+        Index("ix_attemptarchive_mission_id", "mission_id"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True, comment="Archived Attempt ID")
+    handler = Column(Text, comment="Handler Name")
+    create_time = Column(DateTime, comment="Attempt Start Time")
+    last_update_time = Column(DateTime, comment="Attempt Last Update Time")
+    max_time_interval = Column(Interval, comment="Attempt Update Time Interval")
+    expire_time = Column(DateTime, nullable=True, comment="Attempt is considered dead if not updated before this time")
+    content_digest = Column(Text, ForeignKey("contentblob.digest"), comment="Digest of the Mission Content at that time")
+    success = Column(Boolean, default=False, comment="If this Attempt has succeed")
+    archive_time = Column(DateTime, default=datetime.datetime.now, comment="When the Attempt was archived")
+
+    # relationship
+    mission_id = Column(Integer, ForeignKey("mission.id"), comment="Mission ID")
+    mission: Mapped['Mission'] = relationship(Mission, back_populates="archived_attempts")
+    blob: Mapped['ContentBlob'] = relationship(ContentBlob, viewonly=True)
+
+    def __repr__(self):
+        return f"AttemptArchive(id={self.id}, handler={self.handler.__repr__()}, create_time={self.create_time.__repr__()}, last_update_time={self.last_update_time.__repr__()}, content_digest={self.content_digest.__repr__()}, success={self.success}, mission_id={self.mission_id}, archive_time={self.archive_time.__repr__()})"
+
+
+# columns copied from attempt on archiving
+ARCHIVED_COLUMNS = ("handler", "create_time", "last_update_time", "max_time_interval", "expire_time", "content_digest", "success", "mission_id")
+
+
+event.listen(AttemptArchive, "before_insert", store_content)
+event.listen(AttemptArchive, "before_update", store_content)
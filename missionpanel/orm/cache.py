@@ -0,0 +1,50 @@
+import threading
+from typing import Callable, Dict, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class StatementCache:
+    '''
+    StatementCache keeps the hot statements built once per process.
+    The statements take their inputs as bound parameters, so one statement object serves every call
+    and SQLAlchemy finds its compiled form in the compiled cache without building a new select() graph.
+    '''
+
+    def __init__(self):
+        self.statements: Dict[Hashable, object] = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, build: Callable[[], T]) -> T:
+        statement = self.statements.get(key)
+        if statement is not None:
+            self.hits += 1
+            return statement
+        with self.lock:
+            statement = self.statements.get(key)
+            if statement is None:
+                self.misses += 1
+                statement = self.statements[key] = build()
+            else:
+                self.hits += 1
+        return statement
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self) -> dict:
+        return {"size": len(self.statements), "hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}
+
+    def clear(self):
+        with self.lock:
+            self.statements.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# the instance shared by the process, imported as missionpanel.orm.statement_cache
+statement_cache = StatementCache()
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+from sqlalchemy import select, insert
+
+
+def dump_content(content: Any) -> str:
+    '''Canonical JSON of a content, so that equal contents always have the same digest.'''
+    return json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def digest_content(dumped: str) -> str:
+    return hashlib.sha256(dumped.encode('utf-8')).hexdigest()
+
+
+class ContentCache:
+    '''
+    Small LRU of canonical JSON keyed by digest.
+    JSON text is kept instead of the object, so that a caller modifying its content in place cannot corrupt the cache.
+    '''
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.items: OrderedDict[str, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, digest: str) -> Optional[str]:
+        with self.lock:
+            dumped = self.items.get(digest)
+            if dumped is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(digest)
+            self.hits += 1
+            return dumped
+
+    def put(self, digest: str, dumped: str):
+        with self.lock:
+            self.items[digest] = dumped
+            self.items.move_to_end(digest)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+content_cache = ContentCache()
+
+
+class HasContent:
+    '''
+    Mixin for the models referencing a ContentBlob by content_digest instead of embedding the JSON.
+    Assigning content computes the digest, the blob itself is written on flush by store_content.
+    Reading content tries the loaded blob, then the LRU, then loads the blob.
+    '''
+
+    @property
+    def content(self) -> Any:
+        digest = self.content_digest
+        if digest is None:
+            return None
+        memo = self.__dict__.get('_content_memo')
+        if memo is not None and memo[0] == digest:
+            return memo[1]
+        blob = self.__dict__.get('blob')
+        if blob is not None and blob.__dict__.get('digest') == digest and 'content' in blob.__dict__:
+            content = blob.content  # already loaded and not expired
+        else:
+            dumped = content_cache.get(digest)
+            if dumped is None:
+                blob = self.blob
+                content = blob.content if blob is not None else None
+                content_cache.put(digest, dump_content(content))
+            else:
+                content = json.loads(dumped)
+        self.__dict__['_content_memo'] = (digest, content)
+        return content
+
+    @content.setter
+    def content(self, content: Any):
+        dumped = dump_content(content)
+        digest = digest_content(dumped)
+        content_cache.put(digest, dumped)
+        self.content_digest = digest
+        self.__dict__['_content_memo'] = (digest, content)
+        self.__dict__['_content_pending'] = (digest, content)
+
+
+def store_content(mapper, connection, target: HasContent):
+    '''
+    before_insert / before_update listener writing the blob of a newly assigned content.
+    Blobs are never updated, a conflicting digest means the same content is already there.
+    '''
+    from .core import ContentBlob
+    from .dialect import insert_ignore
+    from .index import index_content
+    if target.content_digest is None:
+        target.content = {}
+    pending = target.__dict__.pop('_content_pending', None)
+    if pending is None or pending[0] != target.content_digest:
+        return
+    digest, content = pending
+    table = ContentBlob.__table__
+    statement = insert_ignore(connection.dialect.name, table)
+    if statement is not None:
+        connection.execute(statement, [{"digest": digest, "content": content}])
+    elif connection.execute(select(table.c.digest).where(table.c.digest == digest)).first() is None:
+        connection.execute(insert(table), [{"digest": digest, "content": content}])
+    index_content(connection, digest, content)
@@ -6,30 +6,65 @@ from sqlalchemy import (
     Text,
     JSON,
     DateTime,
+    Boolean,
     ForeignKey,
     Index,
+    event,
 )
 from sqlalchemy.orm import relationship, DeclarativeBase, Mapped
 from sqlalchemy.ext.asyncio import AsyncAttrs
+from .content import HasContent, store_content
 
 
 class Base(AsyncAttrs, DeclarativeBase):
     pass
 
 
-class Mission(Base):
+# states of a Mission counted by the panel statistics
+MISSION_STATES = ("pending", "running", "done", "quarantined")
+
+
+class ContentBlob(Base):
+    __tablename__ = "contentblob"
+    digest = Column(Text, primary_key=True, comment="SHA-256 of the canonical JSON of the Content")
+    content = Column(JSON, comment="Content")
+
+    def __repr__(self):
+        return f"ContentBlob(digest={self.digest.__repr__()}, content={self.content.__repr__()})"
+
+
+class Mission(HasContent, Base):
     __tablename__ = "mission"
+    __table_args__ = (
+        Index("ix_mission_content_digest", "content_digest"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, comment="Mission ID")
-    content = Column(JSON, default={}, comment="Mission Content")
+    content_digest = Column(Text, ForeignKey("contentblob.digest"), comment="Mission Content Digest")
     create_time = Column(DateTime, default=datetime.datetime.now, comment="Mission Create Time")
     last_update_time = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now, comment="Mission Update Time")
+    failure_count = Column(Integer, default=0, comment="Number of consecutive failed Attempts on current content")
+    next_eligible_time = Column(DateTime, default=None, nullable=True, comment="Mission will not be handled before this time")
+    quarantined = Column(Boolean, default=False, comment="If this Mission has failed too many times")
+    unresolved_dependencies = Column(Integer, default=0, comment="Number of depended Missions that have not succeeded")
+    state = Column(Text, default="pending", comment="One of MISSION_STATES, maintained for the panel statistics")
+    archived = Column(Boolean, default=False, comment="If this Mission has succeeded and its Attempts have been moved to attemptarchive")
 
     # back populate relationships
     matchers: Mapped[List['Matcher']] = relationship(back_populates="mission")
     tags: Mapped[List['MissionTag']] = relationship(back_populates="mission")
+    attempts: Mapped[List['Attempt']] = relationship(back_populates="mission")
+    archived_attempts: Mapped[List['AttemptArchive']] = relationship(back_populates="mission")
+    # not joined to every load of Missions, the queries reading the content load it explicitly
+    blob: Mapped['ContentBlob'] = relationship(ContentBlob, viewonly=True)
 
     def __repr__(self):
-        return f"Mission(id={self.id}, content={self.content.__repr__()}, create_time={self.create_time.__repr__()}, last_update_time={self.last_update_time.__repr__()})"
+        return f"Mission(id={self.id}, content={self.content.__repr__()}, create_time={self.create_time.__repr__()}, last_update_time={self.last_update_time.__repr__()}, failure_count={self.failure_count}, next_eligible_time={self.next_eligible_time.__repr__()}, quarantined={self.quarantined}, unresolved_dependencies={self.unresolved_dependencies}, state={self.state.__repr__()}, archived={self.archived})"
+
+
+# only the active Missions are indexed, so that the archived ones cost nothing to the queries of the handlers
+Index(
+    "ix_mission_eligible", Mission.quarantined, Mission.unresolved_dependencies, Mission.next_eligible_time,
+    sqlite_where=Mission.archived.is_(False), postgresql_where=Mission.archived.is_(False))
 
 
 class Matcher(Base):
@@ -71,3 +106,21 @@ class MissionTag(Base):
 
     def __repr__(self):
         return f"MissionTag(tag_name={self.tag_name.__repr__()}, mission_id={self.mission_id})"
+
+
+class MissionDependency(Base):
+    __tablename__ = "missiondependency"
+    __table_args__ = (
+        Index("ix_missiondependency_depends_on_id", "depends_on_id", "resolved"),
+    )
+
+    mission_id = Column(Integer, ForeignKey("mission.id"), primary_key=True, comment="Dependent Mission ID")
+    depends_on_id = Column(Integer, ForeignKey("mission.id"), primary_key=True, comment="Depended Mission ID")
+    resolved = Column(Boolean, default=False, comment="If the depended Mission has succeeded")
+
+    def __repr__(self):
+        return f"MissionDependency(mission_id={self.mission_id}, depends_on_id={self.depends_on_id}, resolved={self.resolved})"
+
+
+event.listen(Mission, "before_insert", store_content)
+event.listen(Mission, "before_update", store_content)
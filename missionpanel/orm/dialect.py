@@ -0,0 +1,39 @@
+from typing import List, Optional
+from sqlalchemy import Table, Insert, Connection, insert
+from sqlalchemy.exc import IntegrityError
+
+
+def insert_ignore(dialect_name: str, table: Table) -> Optional[Insert]:
+    '''
+    INSERT that silently skips the rows conflicting with an existing primary key or unique constraint.
+    Return None if the dialect has no such statement, then the caller should check before inserting.
+    '''
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table).on_conflict_do_nothing()
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+        return postgresql_insert(table).on_conflict_do_nothing()
+    if dialect_name in ("mysql", "mariadb"):
+        return insert(table).prefix_with("IGNORE")
+    return None
+
+
+def insert_or_skip(connection: Connection, table: Table, rows: List[dict]) -> int:
+    '''
+    Insert the rows with insert_ignore, or one at a time in a savepoint on the other dialects,
+    where a row inserted concurrently by another transaction is skipped instead of failing the whole transaction.
+    Return the number of inserted rows.
+    '''
+    statement = insert_ignore(connection.dialect.name, table)
+    if statement is not None:
+        return connection.execute(statement, rows).rowcount
+    inserted = 0
+    for row in rows:
+        try:
+            with connection.begin_nested():
+                connection.execute(insert(table), [row])
+            inserted += 1
+        except IntegrityError:
+            pass
+    return inserted
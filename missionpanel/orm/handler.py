@@ -3,33 +3,41 @@ from sqlalchemy import (
     Column,
     Integer,
     Text,
-    JSON,
     Boolean,
     DateTime,
     Interval,
     ForeignKey,
     Index,
+    event,
 )
 from sqlalchemy.orm import relationship, Mapped
-from .core import Base, Mission
+from .core import Base, Mission, ContentBlob
+from .content import HasContent, store_content
 
 
-class Attempt(Base):
+class Attempt(HasContent, Base):
     __tablename__ = "attempt"
     __table_args__ = (
         Index("ix_attempt_mission_id", "mission_id"),
+        Index("ix_attempt_mission_id_expire_time", "mission_id", "expire_time"),
     )
     id = Column(Integer, primary_key=True, autoincrement=True, comment="Mission ID")
     handler = Column(Text, comment="Handler Name")
     create_time = Column(DateTime, default=datetime.datetime.now, comment="Attempt Start Time")
     last_update_time = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now, comment="Attempt Last Update Time")
     max_time_interval = Column(Interval, default=datetime.timedelta(seconds=1), comment="Attempt Update Time Interval")
-    content = Column(JSON, default={}, comment="Mission Content at that time")
+    expire_time = Column(DateTime, default=None, nullable=True, comment="Attempt is considered dead if not updated before this time")
+    content_digest = Column(Text, ForeignKey("contentblob.digest"), comment="Digest of the Mission Content at that time")
     success = Column(Boolean, default=False, comment="If this Attempt has succeed")
 
     # relationship
     mission_id = Column(Integer, ForeignKey("mission.id"), comment="Mission ID")
-    mission: Mapped['Mission'] = relationship(Mission, backref="attempts")
+    mission: Mapped['Mission'] = relationship(Mission, back_populates="attempts")
+    blob: Mapped['ContentBlob'] = relationship(ContentBlob, viewonly=True)
 
     def __repr__(self):
-        return f"Attempt(id={self.id}, handler={self.handler.__repr__()}, create_time={self.create_time.__repr__()}, last_update_time={self.last_update_time.__repr__()}, max_time_interval={self.max_time_interval.__repr__()}, content={self.content.__repr__()}, success={self.success}, mission_id={self.mission_id})"
+        return f"Attempt(id={self.id}, handler={self.handler.__repr__()}, create_time={self.create_time.__repr__()}, last_update_time={self.last_update_time.__repr__()}, max_time_interval={self.max_time_interval.__repr__()}, expire_time={self.expire_time.__repr__()}, content_digest={self.content_digest.__repr__()}, success={self.success}, mission_id={self.mission_id})"
+
+
+event.listen(Attempt, "before_insert", store_content)
+event.listen(Attempt, "before_update", store_content)
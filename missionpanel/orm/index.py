@@ -0,0 +1,219 @@
+import re
+from typing import Any, Dict, List, Union
+from sqlalchemy import (
+    Column,
+    Text,
+    ForeignKey,
+    Index,
+    Engine,
+    Connection,
+    TypeDecorator,
+    event,
+    select,
+    insert,
+    literal,
+)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.sql.expression import ColumnElement, BindParameter
+from sqlalchemy.sql.visitors import InternalTraversal
+from sqlalchemy.sql.sqltypes import NullType
+from .core import Base, ContentBlob, Mission
+from .content import dump_content
+from .dialect import insert_ignore
+
+# dialects on which a path of content can be indexed with an expression index
+EXPRESSION_INDEX_DIALECTS = ("sqlite", "postgresql")
+
+_path_segment = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class SideIndexBase(DeclarativeBase):
+    '''Metadata of the side index, created along with Base only on the dialects which use it.'''
+    pass
+
+
+class ContentField(SideIndexBase):
+    '''Side index of the registered content paths, for the dialects without expression indexes.'''
+    __tablename__ = "contentfield"
+    __table_args__ = (
+        Index("ix_contentfield_path_value", "path", "value"),
+    )
+    digest = Column(Text, ForeignKey(ContentBlob.__table__.c.digest), primary_key=True, comment="Content Digest")
+    path = Column(Text, primary_key=True, comment="Indexed Path of the Content")
+    value = Column(Text, comment="Value at the Path")
+
+    def __repr__(self):
+        return f"ContentField(digest={self.digest.__repr__()}, path={self.path.__repr__()}, value={self.value.__repr__()})"
+
+
+def uses_content_fields(dialect_name: str) -> bool:
+    return dialect_name not in EXPRESSION_INDEX_DIALECTS
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_content_fields(target, connection, **kw):
+    if uses_content_fields(connection.dialect.name):
+        ContentField.__table__.create(connection, checkfirst=True)
+
+
+@event.listens_for(Base.metadata, "before_drop")
+def _drop_content_fields(target, connection, **kw):
+    # it refers to contentblob
+    ContentField.__table__.drop(connection, checkfirst=True)
+
+
+def index_value(value: Any, dialect_name: str) -> Any:
+    if dialect_name == "sqlite":
+        return value  # json_extract gives back native scalars
+    return value if isinstance(value, str) else dump_content(value)
+
+
+class ContentValue(TypeDecorator):
+    '''Scalar compared with a value extracted from content, in the form the dialect extracts it.'''
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else index_value(value, dialect.name)
+
+
+class content_value(ColumnElement):
+    '''
+    Scalar at a path of ContentBlob.content.
+    The path is rendered literally, so that the expression in a query is the same as in the expression index.
+    '''
+    inherit_cache = True
+    _traverse_internals = [
+        ("path", InternalTraversal.dp_string),
+        ("column", InternalTraversal.dp_clauseelement),
+    ]
+    type = ContentValue()
+
+    def __init__(self, path: str):
+        self.path = path
+        self.column = ContentBlob.__table__.c.content
+
+
+@compiles(content_value, "sqlite")
+def _compile_content_value_sqlite(element: content_value, compiler, **kw):
+    return f"json_extract({compiler.process(element.column, **kw)}, '$.{element.path}')"
+
+
+@compiles(content_value, "postgresql")
+def _compile_content_value_postgresql(element: content_value, compiler, **kw):
+    return f"({compiler.process(element.column, **kw)} #>> '{{{element.path.replace('.', ',')}}}')"
+
+
+@compiles(content_value)
+def _compile_content_value(element: content_value, compiler, **kw):
+    raise NotImplementedError(f"{compiler.dialect.name} has no expression index on content, use content_matches instead")
+
+
+content_indexes: Dict[str, Index] = {}
+
+
+def content_index(path: str) -> str:
+    '''
+    Register an index on a path of Mission content, such as "url" or "feed.url".
+    Call it before the tables are created, or call create_content_indexes afterwards.
+    '''
+    if not all(_path_segment.match(segment) for segment in path.split(".")):
+        raise ValueError(f"Invalid content path: {path}")
+    if path not in content_indexes:
+        content_indexes[path] = Index(
+            f"ix_contentblob_{path.replace('.', '_')}",
+            content_value(path),
+        ).ddl_if(dialect=EXPRESSION_INDEX_DIALECTS)
+    return path
+
+
+def extract_path(content: Any, path: str) -> Any:
+    for segment in path.split("."):
+        if not isinstance(content, dict) or segment not in content:
+            return None
+        content = content[segment]
+    return None if isinstance(content, (dict, list)) else content
+
+
+class content_matches(ColumnElement):
+    '''
+    Mission.content[path] == value, as a lookup in the index registered by content_index.
+    Compiles to an expression index lookup where the dialect supports it, to a side index lookup otherwise.
+    '''
+    inherit_cache = True
+    _traverse_internals = [
+        ("path", InternalTraversal.dp_string),
+        ("value", InternalTraversal.dp_clauseelement),
+    ]
+    type = NullType()  # a Boolean would be rendered as "= 1" on the dialects without native booleans
+
+    def __init__(self, path: str, value: Union[Any, BindParameter]):
+        if path not in content_indexes:
+            raise ValueError(f"Content path {path} is not indexed, register it with content_index")
+        self.path = path
+        self.value = value if isinstance(value, BindParameter) else literal(value, ContentValue())
+
+
+@compiles(content_matches)
+def _compile_content_matches(element: content_matches, compiler, **kw):
+    if not uses_content_fields(compiler.dialect.name):
+        digests = select(ContentBlob.digest).where(content_value(element.path) == element.value)
+    else:
+        digests = (
+            select(ContentField.digest)
+            .where(ContentField.path == literal(element.path, literal_execute=True))
+            .where(ContentField.value == element.value)
+        )
+    return compiler.process(Mission.content_digest.in_(digests), **kw)
+
+
+def content_field_rows(digest: str, content: Any) -> List[dict]:
+    rows = []
+    for path in content_indexes.keys():
+        value = extract_path(content, path)
+        if value is not None:
+            rows.append({"digest": digest, "path": path, "value": index_value(value, "")})
+    return rows
+
+
+def index_content(connection: Connection, digest: str, content: Any):
+    '''Write the side index of a new blob, nothing to do where expression indexes are used.'''
+    if not uses_content_fields(connection.dialect.name) or len(content_indexes) <= 0:
+        return
+    rows = content_field_rows(digest, content)
+    if len(rows) <= 0:
+        return
+    statement = insert_ignore(connection.dialect.name, ContentField.__table__)
+    if statement is None:
+        exist = set(connection.execute(select(ContentField.path).where(ContentField.digest == digest)).scalars().all())
+        rows = [row for row in rows if row["path"] not in exist]
+        statement = insert(ContentField.__table__)
+    if len(rows) > 0:
+        connection.execute(statement, rows)
+
+
+def create_content_indexes(engine: Engine, batch_size: int = 1000):
+    '''
+    Create the indexes registered after the tables had been created.
+    On the dialects without expression indexes, the side index is filled from the existing blobs instead.
+    '''
+    if not uses_content_fields(engine.dialect.name):
+        for index in content_indexes.values():
+            index.create(engine, checkfirst=True)
+        return
+    ContentField.__table__.create(engine, checkfirst=True)
+    last_digest = ""
+    while True:
+        with engine.begin() as connection:
+            blobs = connection.execute(
+                select(ContentBlob.digest, ContentBlob.content)
+                .where(ContentBlob.digest > last_digest)
+                .order_by(ContentBlob.digest)
+                .limit(batch_size)
+            ).all()
+            if len(blobs) <= 0:
+                break
+            last_digest = blobs[-1].digest
+            for blob in blobs:
+                index_content(connection, blob.digest, blob.content)
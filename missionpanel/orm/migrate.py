@@ -0,0 +1,181 @@
+import datetime
+import logging
+from typing import Dict, Tuple
+from sqlalchemy import Engine, JSON, Text, Boolean, inspect, select, update, insert, delete, exists, or_, bindparam, text
+from sqlalchemy.sql import table, column
+from .core import Base, ContentBlob, Mission
+from .handler import Attempt
+from .archive import AttemptArchive
+from .index import ContentField
+from .content import dump_content, digest_content
+from .dialect import insert_ignore
+
+logger = logging.getLogger("migrate")
+
+
+def _store_blobs(connection, blobs: Dict[str, object]):
+    statement = insert_ignore(connection.dialect.name, ContentBlob.__table__)
+    if statement is None:
+        exist = set(connection.execute(select(ContentBlob.digest).where(ContentBlob.digest.in_(list(blobs.keys())))).scalars().all())
+        blobs = {digest: content for digest, content in blobs.items() if digest not in exist}
+        statement = insert(ContentBlob.__table__)
+    if len(blobs) > 0:
+        connection.execute(statement, [{"digest": digest, "content": content} for digest, content in blobs.items()])
+
+
+def migrate_content_blobs(engine: Engine, batch_size: int = 1000, drop_legacy: bool = False) -> Tuple[int, int]:
+    '''
+    Move the JSON embedded in the legacy mission.content and attempt.content columns into content blobs.
+    Rows with equal content share one blob, so the copies made for every Attempt collapse into one.
+    Safe to run again after an interruption, rows which already have a digest are skipped.
+    The legacy columns are dropped only if drop_legacy, after every row has been migrated.
+    Return the number of migrated rows and the number of blobs they collapsed into.
+    '''
+    ContentBlob.__table__.create(engine, checkfirst=True)
+    quote = engine.dialect.identifier_preparer.quote
+    n_rows, digests = 0, set()
+    for model in (Mission, Attempt):
+        name = model.__tablename__
+        columns = {c['name'] for c in inspect(engine).get_columns(name)}
+        if 'content_digest' not in columns:
+            with engine.begin() as connection:
+                connection.execute(text(f"ALTER TABLE {quote(name)} ADD COLUMN content_digest {Text().compile(dialect=engine.dialect)}"))
+        if 'content' not in columns:
+            continue
+        legacy = table(name, column('id'), column('content', JSON), column('content_digest', Text))
+        last_id = 0
+        while True:
+            with engine.begin() as connection:
+                rows = connection.execute(
+                    select(legacy.c.id, legacy.c.content)
+                    .where(legacy.c.content_digest == None)
+                    .where(legacy.c.id > last_id)
+                    .order_by(legacy.c.id)
+                    .limit(batch_size)
+                ).all()
+                if len(rows) <= 0:
+                    break
+                last_id = rows[-1].id
+                blobs, updates = {}, []
+                for row in rows:
+                    content = {} if row.content is None else row.content
+                    digest = digest_content(dump_content(content))
+                    blobs[digest] = content
+                    updates.append({"_id": row.id, "_digest": digest})
+                _store_blobs(connection, blobs)
+                connection.execute(
+                    update(legacy).where(legacy.c.id == bindparam("_id")).values(content_digest=bindparam("_digest")),
+                    updates)
+                n_rows += len(rows)
+                digests.update(blobs.keys())
+                logger.info(f"Migrated {len(rows)} rows of {name} into {len(blobs)} blobs")
+        if drop_legacy:
+            with engine.begin() as connection:
+                connection.execute(text(f"ALTER TABLE {quote(name)} DROP COLUMN {quote('content')}"))
+    return n_rows, len(digests)
+
+
+def migrate_archive(engine: Engine):
+    '''
+    Add the archive tier to a panel created before it, which migrate_panel does along with the other changes: the mission.archived flag, the attemptarchive table,
+    and ix_mission_eligible rebuilt to leave out the archived Missions.
+    Safe to run again.
+    '''
+    quote = engine.dialect.identifier_preparer.quote
+    AttemptArchive.__table__.create(engine, checkfirst=True)
+    if 'archived' not in {c['name'] for c in inspect(engine).get_columns(Mission.__tablename__)}:
+        with engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE {quote(Mission.__tablename__)} ADD COLUMN archived {Boolean().compile(dialect=engine.dialect)}"))
+            connection.execute(update(Mission.__table__).values(archived=False))
+        eligible = next(index for index in Mission.__table__.indexes if index.name == "ix_mission_eligible")
+        if eligible.name in {index['name'] for index in inspect(engine).get_indexes(Mission.__tablename__)}:
+            eligible.drop(engine)
+        eligible.create(engine)
+        logger.info("Added the archive tier")
+
+
+# values of the columns added to the existing rows, the scalar default of the column is used for the others
+BACKFILLS = {
+    ("mission", "state"): "pending",  # then recomputed from the Attempts
+    ("attempt", "expire_time"): Attempt.__table__.c.last_update_time,
+}
+
+
+def migrate_panel(engine: Engine, batch_size: int = 1000, drop_legacy: bool = False) -> int:
+    '''
+    Bring a panel created by an older version to the current schema: migrate the content blobs,
+    then add the missing tables, columns and indexes, with the existing rows filled by BACKFILLS or the column defaults instead of NULL,
+    e.g. a NULL mission.quarantined would hide the Mission from every handler.
+    The states and the tag counters are recomputed if they are new.
+    Safe to run again. Stop the handlers and the submitters while it runs.
+    Return the number of added columns.
+    '''
+    migrate_content_blobs(engine, batch_size, drop_legacy)
+    quote = engine.dialect.identifier_preparer.quote
+    new_tables = {table.name for table in Base.metadata.sorted_tables} - set(inspect(engine).get_table_names())
+    Base.metadata.create_all(engine)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if table.name in new_tables:
+            continue
+        exist = {c['name'] for c in inspect(engine).get_columns(table.name)}
+        for col in table.columns:
+            if col.name in exist:
+                continue
+            value = BACKFILLS.get((table.name, col.name))
+            if value is None and col.default is not None and col.default.is_scalar:
+                value = col.default.arg
+            with engine.begin() as connection:
+                connection.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(col.name)} {col.type.compile(dialect=engine.dialect)}"))
+                if value is not None:
+                    connection.execute(update(table).values({col.name: value}))
+            added.append((table.name, col.name))
+            logger.info(f"Added column {col.name} to {table.name}")
+    if ("mission", "archived") in added:
+        # rebuilt to leave out the archived Missions
+        eligible = next(index for index in Mission.__table__.indexes if index.name == "ix_mission_eligible")
+        if eligible.name in {index['name'] for index in inspect(engine).get_indexes(Mission.__tablename__)}:
+            eligible.drop(engine)
+    for table in Base.metadata.sorted_tables:
+        exist = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in exist:
+                index.create(engine)
+    if ("mission", "state") in added or "tagstat" in new_tables:
+        from missionpanel.stats.interface import StatsInterface
+        with engine.begin() as connection:
+            connection.execute(StatsInterface.reconcile_states(datetime.datetime.now()))
+            connection.execute(StatsInterface.clear_tag_stats())
+            connection.execute(StatsInterface.clear_tag_deltas())
+            connection.execute(StatsInterface.recount_tag_stats())
+    return len(added)
+
+
+def collect_content_blobs(engine: Engine, batch_size: int = 1000) -> int:
+    '''
+    Delete the blobs no Mission or Attempt refers to anymore, e.g. the old contents of the Missions moved to another shard.
+    A writer reusing a blob while it is deleted fails on the foreign key and has to retry, so run it when the panel is quiet.
+    Return the number of deleted blobs.
+    '''
+    referenced = or_(*[exists().where(model.content_digest == ContentBlob.digest) for model in (Mission, Attempt, AttemptArchive)])
+    has_fields = inspect(engine).has_table(ContentField.__tablename__)
+    last_digest, n_deleted = "", 0
+    while True:
+        with engine.begin() as connection:
+            digests = connection.execute(
+                select(ContentBlob.digest)
+                .where(ContentBlob.digest > last_digest)
+                .where(~referenced)
+                .order_by(ContentBlob.digest)
+                .limit(batch_size)
+            ).scalars().all()
+            if len(digests) <= 0:
+                break
+            last_digest = digests[-1]
+            # checked again when deleting, since a writer may have reused them since
+            unreferenced = select(ContentBlob.digest).where(ContentBlob.digest.in_(digests)).where(~referenced)
+            if has_fields:
+                connection.execute(delete(ContentField).where(ContentField.digest.in_(unreferenced)))
+            n_deleted += connection.execute(delete(ContentBlob).where(ContentBlob.digest.in_(digests)).where(~referenced)).rowcount
+            logger.info(f"Collected blobs up to {last_digest}, {n_deleted} so far")
+    return n_deleted
@@ -0,0 +1,253 @@
+import datetime
+from typing import List, Optional, Union
+from sqlalchemy import (
+    Column,
+    Integer,
+    Float,
+    Text,
+    DateTime,
+    ForeignKey,
+    Select,
+    Update,
+    Insert,
+    event,
+    select,
+    update,
+    insert,
+    delete,
+    func,
+    case,
+    literal,
+    inspect,
+    union_all,
+)
+from .core import Base, Mission, MissionTag, MISSION_STATES
+from .dialect import insert_or_skip
+
+# upper bounds in seconds of the latency histogram of HandlerStat, the last bin takes the rest
+LATENCY_BOUNDS = (1, 10, 60, 600)
+# width of the throughput buckets of HandlerStat
+BUCKET_WIDTH = datetime.timedelta(minutes=1)
+
+
+class TagStat(Base):
+    __tablename__ = "tagstat"
+    tag_name = Column(Text, ForeignKey("tag.name"), primary_key=True, comment="Tag")
+    state = Column(Text, primary_key=True, comment="One of MISSION_STATES")
+    count = Column(Integer, default=0, comment="Number of Missions with this Tag in this state")
+
+    def __repr__(self):
+        return f"TagStat(tag_name={self.tag_name.__repr__()}, state={self.state.__repr__()}, count={self.count})"
+
+
+class TagStatDelta(Base):
+    '''
+    Changes of the tag counters not folded into TagStat yet.
+    The handlers and the submitters append them instead of updating TagStat in place,
+    so that their transactions never wait on the counter row of a popular tag.
+    '''
+    __tablename__ = "tagstatdelta"
+    id = Column(Integer, primary_key=True, autoincrement=True, comment="Delta ID")
+    tag_name = Column(Text, ForeignKey("tag.name"), comment="Tag")
+    state = Column(Text, comment="One of MISSION_STATES")
+    delta = Column(Integer, comment="Change of the number of Missions with this Tag in this state")
+
+    def __repr__(self):
+        return f"TagStatDelta(id={self.id}, tag_name={self.tag_name.__repr__()}, state={self.state.__repr__()}, delta={self.delta})"
+
+
+class HandlerStat(Base):
+    __tablename__ = "handlerstat"
+    handler = Column(Text, primary_key=True, comment="Handler Name")
+    bucket = Column(DateTime, primary_key=True, comment="Start of the time bucket")
+    succeeded = Column(Integer, default=0, comment="Number of Attempts succeeded in this bucket")
+    failed = Column(Integer, default=0, comment="Number of Attempts failed in this bucket")
+    latency_sum = Column(Float, default=0.0, comment="Total seconds from start to end of the finished Attempts")
+    latency_max = Column(Float, default=0.0, comment="Longest seconds from start to end of the finished Attempts")
+    latency_1 = Column(Integer, default=0, comment="Number of Attempts finished within 1 second")
+    latency_10 = Column(Integer, default=0, comment="Number of Attempts finished within 1 to 10 seconds")
+    latency_60 = Column(Integer, default=0, comment="Number of Attempts finished within 10 to 60 seconds")
+    latency_600 = Column(Integer, default=0, comment="Number of Attempts finished within 60 to 600 seconds")
+    latency_inf = Column(Integer, default=0, comment="Number of Attempts finished after 600 seconds")
+
+    def __repr__(self):
+        return f"HandlerStat(handler={self.handler.__repr__()}, bucket={self.bucket.__repr__()}, succeeded={self.succeeded}, failed={self.failed}, latency_sum={self.latency_sum}, latency_max={self.latency_max})"
+
+
+class HandlerStatDelta(Base):
+    '''
+    Finished Attempts not folded into HandlerStat yet, one row per Attempt with the same columns as HandlerStat.
+    The handlers append them instead of updating the bucket in place, so that they never wait on each other.
+    '''
+    __tablename__ = "handlerstatdelta"
+    id = Column(Integer, primary_key=True, autoincrement=True, comment="Delta ID")
+    handler = Column(Text, comment="Handler Name")
+    bucket = Column(DateTime, comment="Start of the time bucket")
+    succeeded = Column(Integer, default=0, comment="1 if the Attempt succeeded")
+    failed = Column(Integer, default=0, comment="1 if the Attempt failed")
+    latency_sum = Column(Float, default=0.0, comment="Seconds from start to end of the Attempt")
+    latency_max = Column(Float, default=0.0, comment="Seconds from start to end of the Attempt")
+    latency_1 = Column(Integer, default=0, comment="1 if the Attempt finished within 1 second")
+    latency_10 = Column(Integer, default=0, comment="1 if the Attempt finished within 1 to 10 seconds")
+    latency_60 = Column(Integer, default=0, comment="1 if the Attempt finished within 10 to 60 seconds")
+    latency_600 = Column(Integer, default=0, comment="1 if the Attempt finished within 60 to 600 seconds")
+    latency_inf = Column(Integer, default=0, comment="1 if the Attempt finished after 600 seconds")
+
+    def __repr__(self):
+        return f"HandlerStatDelta(id={self.id}, handler={self.handler.__repr__()}, bucket={self.bucket.__repr__()}, succeeded={self.succeeded}, failed={self.failed}, latency_sum={self.latency_sum})"
+
+
+LATENCY_COLUMNS = ("latency_1", "latency_10", "latency_60", "latency_600", "latency_inf")
+# columns of HandlerStat added up by the fold, latency_max takes the max instead
+SUM_COLUMNS = ("succeeded", "failed", "latency_sum") + LATENCY_COLUMNS
+
+
+def bucket_of(time: datetime.datetime) -> datetime.datetime:
+    midnight = time.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + ((time - midnight) // BUCKET_WIDTH) * BUCKET_WIDTH
+
+
+def latency_column(latency: float) -> str:
+    for bound, column in zip(LATENCY_BOUNDS, LATENCY_COLUMNS):
+        if latency <= bound:
+            return column
+    return LATENCY_COLUMNS[-1]
+
+
+def move_missions(mission_ids: Union[List[int] | Select], state: Optional[str]) -> Insert:
+    '''
+    Move the tag counters of the Missions from their current state to state, or remove them if state is None.
+    Run it before the Missions are updated or deleted, since it reads their current state.
+    '''
+    moving = (
+        select(MissionTag.tag_name, Mission.state)
+        .join(Mission, MissionTag.mission_id == Mission.id)
+        .where(Mission.id.in_(mission_ids))
+        .where(Mission.state.is_not(None))
+    )
+    if state is not None:
+        moving = moving.where(Mission.state != state)
+    moving = moving.subquery("moving")
+    deltas = select(moving.c.tag_name, moving.c.state, -func.count()).group_by(moving.c.tag_name, moving.c.state)
+    if state is not None:
+        deltas = union_all(deltas, select(moving.c.tag_name, literal(state, Text), func.count()).group_by(moving.c.tag_name))
+    return insert(TagStatDelta).from_select(["tag_name", "state", "delta"], deltas)
+
+
+def count_mission_tag(tag_name: str, mission_id: int, delta: int) -> Insert:
+    return insert(TagStatDelta).from_select(
+        ["tag_name", "state", "delta"],
+        select(literal(tag_name, Text), Mission.state, literal(delta, Integer))
+        .where(Mission.id == mission_id)
+        .where(Mission.state.is_not(None)))
+
+
+def uncount_mission_tags(mission_id: int, tags_name: List[str]) -> Insert:
+    '''Remove the Mission from the counters of the tags, run it before its MissionTags are deleted in bulk.'''
+    return insert(TagStatDelta).from_select(
+        ["tag_name", "state", "delta"],
+        select(MissionTag.tag_name, Mission.state, literal(-1, Integer))
+        .join(Mission, MissionTag.mission_id == Mission.id)
+        .where(MissionTag.mission_id == mission_id)
+        .where(MissionTag.tag_name.in_(tags_name))
+        .where(Mission.state.is_not(None)))
+
+
+def ensure_tag_stats(connection, tags_name: List[str]):
+    '''Create the zero counters of the tags, so that the deltas can always be folded in place.'''
+    insert_or_skip(connection, TagStat.__table__, [{"tag_name": tag_name, "state": state, "count": 0} for tag_name in tags_name for state in MISSION_STATES])
+
+
+def take_deltas(connection, table, columns) -> list:
+    '''
+    Delete all the deltas of the table and return the columns of exactly the deleted rows.
+    A delta committed by another transaction while this one runs is either returned or left in place, never lost.
+    '''
+    if connection.dialect.delete_returning:
+        return connection.execute(delete(table).returning(*columns)).all()
+    rows = connection.execute(select(table.c.id, *columns).with_for_update()).all()
+    ids = [row[0] for row in rows]
+    for i in range(0, len(ids), 1000):
+        connection.execute(delete(table).where(table.c.id.in_(ids[i:i + 1000])))
+    return [tuple(row[1:]) for row in rows]
+
+
+def fold_tag_stats(connection) -> int:
+    '''
+    Add the deltas to TagStat and delete them, return the number of folded deltas.
+    The counters are updated in the order of (tag_name, state), so that a fold never deadlocks with another writer.
+    Run one fold at a time, since two folds reading the same deltas would count them twice.
+    '''
+    rows = take_deltas(connection, TagStatDelta.__table__, [TagStatDelta.tag_name, TagStatDelta.state, TagStatDelta.delta])
+    if len(rows) <= 0:
+        return 0
+    deltas = {}
+    for tag_name, state, delta in rows:
+        deltas[(tag_name, state)] = deltas.get((tag_name, state), 0) + delta
+    ensure_tag_stats(connection, sorted({tag_name for tag_name, _ in deltas}))
+    for (tag_name, state), delta in sorted(deltas.items()):
+        if delta != 0:
+            connection.execute(update(TagStat).where(TagStat.tag_name == tag_name, TagStat.state == state).values(count=TagStat.count + delta))
+    return len(rows)
+
+
+def fold_handler_stats(connection) -> int:
+    '''
+    Add the finished Attempts to their HandlerStat bucket and delete them, return the number of folded Attempts.
+    The buckets are updated in the order of (handler, bucket) like fold_tag_stats.
+    '''
+    rows = take_deltas(connection, HandlerStatDelta.__table__, [HandlerStatDelta.handler, HandlerStatDelta.bucket, HandlerStatDelta.latency_max] + [getattr(HandlerStatDelta, name) for name in SUM_COLUMNS])
+    if len(rows) <= 0:
+        return 0
+    buckets = {}
+    for handler, bucket, latency_max, *sums in rows:
+        folded = buckets.setdefault((handler, bucket), [0.0] + [0] * len(SUM_COLUMNS))
+        folded[0] = max(folded[0], latency_max)
+        for i, value in enumerate(sums):
+            folded[i + 1] += value
+    keys = sorted(buckets)
+    insert_or_skip(connection, HandlerStat.__table__, [{"handler": handler, "bucket": bucket} for handler, bucket in keys])
+    for handler, bucket in keys:
+        latency_max, *sums = buckets[(handler, bucket)]
+        connection.execute(
+            update(HandlerStat)
+            .where(HandlerStat.handler == handler, HandlerStat.bucket == bucket)
+            .values({
+                "latency_max": case((HandlerStat.latency_max < latency_max, literal(latency_max)), else_=HandlerStat.latency_max),
+                **{name: getattr(HandlerStat, name) + value for name, value in zip(SUM_COLUMNS, sums)},
+            })
+        )
+    return len(rows)
+
+
+def _mission_state_changed(mapper, connection, target: Mission):
+    history = inspect(target).attrs.state.history
+    if history.has_changes() and target.state is not None:
+        connection.execute(move_missions([target.id], target.state))
+
+
+def _mission_tag_inserted(mapper, connection, target: MissionTag):
+    connection.execute(count_mission_tag(target.tag_name, target.mission_id, 1))
+
+
+def _mission_tag_deleted(mapper, connection, target: MissionTag):
+    connection.execute(count_mission_tag(target.tag_name, target.mission_id, -1))
+
+
+event.listen(Mission, "before_update", _mission_state_changed)
+event.listen(MissionTag, "after_insert", _mission_tag_inserted)
+event.listen(MissionTag, "before_delete", _mission_tag_deleted)
+
+
+def record_attempt_stat(connection, handler: str, finish_time: datetime.datetime, latency: float, success: bool):
+    '''Count a finished Attempt into the throughput bucket of its handler, by appending it to HandlerStatDelta.'''
+    column = latency_column(latency)
+    connection.execute(insert(HandlerStatDelta).values({
+        "handler": handler,
+        "bucket": bucket_of(finish_time),
+        "succeeded": 1 if success else 0,
+        "failed": 0 if success else 1,
+        "latency_sum": latency,
+        "latency_max": latency,
+        **{name: 1 if name == column else 0 for name in LATENCY_COLUMNS},
+    }))
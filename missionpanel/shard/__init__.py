@@ -0,0 +1,4 @@
+from .router import ShardRouter
+from .submitter import ShardedSubmitter, ShardedAsyncSubmitter
+from .handler import ShardedHandler, ShardedAsyncHandler
+from .rebalance import rebalance
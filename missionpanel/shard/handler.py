@@ -0,0 +1,87 @@
+import abc
+from typing import Any, Dict, List, Tuple, Union
+from sqlalchemy import select, func, Select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from missionpanel.orm import statement_cache
+from missionpanel.handler import Handler, AsyncHandler
+from missionpanel.handler.handler import HandlerInterface
+from missionpanel.handler.tag_filter import TagFilter
+
+
+class ShardedHandlerInterface:
+
+    @staticmethod
+    def prepare_backlog(tags: Union[List[str] | TagFilter], content_filter: Dict[str, Any] = {}) -> Tuple[Select[Tuple[int]], dict]:
+        statement, params = HandlerInterface.prepare_todo_missions(tags, content_filter)
+        return statement_cache.get(("backlog", HandlerInterface.todo_missions_key(tags, content_filter)), lambda: select(func.count()).select_from(statement.subquery())), params
+
+    @staticmethod
+    def rotate(n_shards: int, cursor: int) -> List[int]:
+        return [(cursor + i) % n_shards for i in range(n_shards)]
+
+
+class ShardedHandler(Handler, abc.ABC):
+    '''
+    ShardedHandler claims missions from several shards, one shard per run_once.
+    Shards are visited in rotation, or in descending order of backlog if by_backlog is set.
+    '''
+
+    def __init__(self, sessions: List[Session], *args, by_backlog: bool = False, **kwargs):
+        super().__init__(sessions[0], *args, **kwargs)
+        self.sessions = sessions
+        self.by_backlog = by_backlog
+        self.shard_cursor = 0
+
+    def order_shards(self, tags: Union[List[str] | TagFilter]) -> List[int]:
+        shards = ShardedHandlerInterface.rotate(len(self.sessions), self.shard_cursor)
+        if not self.by_backlog:
+            return shards
+        backlogs = {}
+        for shard in shards:
+            backlogs[shard] = self.sessions[shard].execute(*ShardedHandlerInterface.prepare_backlog(tags, self.content_filter)).scalar()
+            # avoid idle in transaction
+            self.sessions[shard].commit()
+        return sorted(shards, key=lambda shard: -backlogs[shard])
+
+    def run_once(self, tags: Union[List[str] | TagFilter]):
+        for shard in self.order_shards(tags):
+            self.session = self.sessions[shard]
+            self.shard_cursor = (shard + 1) % len(self.sessions)
+            attempt = super().run_once(tags)
+            if attempt is not None:
+                return attempt
+        return None
+
+
+class ShardedAsyncHandler(AsyncHandler, abc.ABC):
+    '''
+    ShardedAsyncHandler claims missions from several shards, one shard per run_once.
+    Shards are visited in rotation, or in descending order of backlog if by_backlog is set.
+    '''
+
+    def __init__(self, sessions: List[AsyncSession], *args, by_backlog: bool = False, **kwargs):
+        super().__init__(sessions[0], *args, **kwargs)
+        self.sessions = sessions
+        self.by_backlog = by_backlog
+        self.shard_cursor = 0
+
+    async def order_shards(self, tags: Union[List[str] | TagFilter]) -> List[int]:
+        shards = ShardedHandlerInterface.rotate(len(self.sessions), self.shard_cursor)
+        if not self.by_backlog:
+            return shards
+        backlogs = {}
+        for shard in shards:
+            backlogs[shard] = (await self.sessions[shard].execute(*ShardedHandlerInterface.prepare_backlog(tags, self.content_filter))).scalar()
+            # avoid idle in transaction
+            await self.sessions[shard].commit()
+        return sorted(shards, key=lambda shard: -backlogs[shard])
+
+    async def run_once(self, tags: Union[List[str] | TagFilter]):
+        for shard in await self.order_shards(tags):
+            self.session = self.sessions[shard]
+            self.shard_cursor = (shard + 1) % len(self.sessions)
+            attempt = await super().run_once(tags)
+            if attempt is not None:
+                return attempt
+        return None
@@ -0,0 +1,125 @@
+import logging
+from typing import List
+from sqlalchemy import select, delete, inspect, or_
+from sqlalchemy.orm import Session, selectinload
+from missionpanel.orm import Mission, Matcher, MissionTag, MissionDependency, Attempt, AttemptArchive
+from missionpanel.orm.stats import move_missions
+from missionpanel.submitter.abc import SubmitterInterface
+from .router import ShardRouter
+
+logger = logging.getLogger("rebalance")
+
+
+def _copy_columns(obj, exclude: List[str] = []) -> dict:
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs if attr.key not in exclude}
+
+
+def copy_mission(session: Session, mission: Mission) -> Mission:
+    '''
+    Copy a mission with its matchers, tags and attempts, archived or not, into another session.
+    The copied mission gets a new id from the target shard.
+    '''
+    tags_name = [tag.tag_name for tag in mission.tags]
+    copied = Mission(
+        **_copy_columns(mission, ['id', 'content_digest']),
+        content=mission.content,  # the target shard may not have the blob yet
+        matchers=[Matcher(pattern=matcher.pattern) for matcher in mission.matchers],
+        attempts=[Attempt(**_copy_columns(attempt, ['id', 'mission_id', 'content_digest']), content=attempt.content) for attempt in mission.attempts],
+        archived_attempts=[AttemptArchive(**_copy_columns(attempt, ['id', 'mission_id', 'content_digest']), content=attempt.content) for attempt in mission.archived_attempts],
+    )
+    session.add(copied)
+    session.flush()
+    SubmitterInterface.upsert_mission_tags(session.connection(), copied.id, tags_name)
+    return copied
+
+
+def delete_missions(session: Session, mission_ids: List[int]):
+    session.execute(move_missions(mission_ids, None))
+    session.execute(delete(Attempt).where(Attempt.mission_id.in_(mission_ids)))
+    session.execute(delete(AttemptArchive).where(AttemptArchive.mission_id.in_(mission_ids)))
+    session.execute(delete(MissionTag).where(MissionTag.mission_id.in_(mission_ids)))
+    session.execute(delete(Matcher).where(Matcher.mission_id.in_(mission_ids)))
+    session.execute(delete(Mission).where(Mission.id.in_(mission_ids)))
+
+
+def query_pinned(mission_ids: List[int]):
+    return (
+        select(MissionDependency.mission_id, MissionDependency.depends_on_id)
+        .where(or_(MissionDependency.mission_id.in_(mission_ids), MissionDependency.depends_on_id.in_(mission_ids)))
+    )
+
+
+def reroute_mission(sessions: List[Session], router: ShardRouter, shard: int, mission_id: int) -> int:
+    '''
+    Move one mission from the shard to its owning shard if they differ, the same way as rebalance does.
+    Return the shard the mission is on.
+    '''
+    mission = sessions[shard].execute(
+        select(Mission)
+        .where(Mission.id == mission_id)
+        .options(selectinload(Mission.matchers), selectinload(Mission.tags), selectinload(Mission.attempts), selectinload(Mission.archived_attempts))
+    ).scalar_one()
+    target = router.route([matcher.pattern for matcher in mission.matchers], [tag.tag_name for tag in mission.tags])
+    if target == shard or sessions[shard].execute(query_pinned([mission_id]).limit(1)).first() is not None:
+        sessions[shard].commit()
+        return shard
+    copy_mission(sessions[target], mission)
+    sessions[target].commit()
+    delete_missions(sessions[shard], [mission_id])
+    sessions[shard].commit()
+    logger.info(f"Moved mission {mission_id} from shard {shard} to shard {target}")
+    return target
+
+
+def rebalance(sessions: List[Session], router: ShardRouter, batch_size: int = 1000) -> int:
+    '''
+    Move every mission that is not on its owning shard to the owning shard, batch by batch.
+    sessions[i] is the shard i of the router, so resharding from N to M shards means passing M sessions and ShardRouter(M).
+    Each batch is committed to the target shards before being deleted from the source shard,
+    so an interrupted rebalance may leave duplicates but never loses missions.
+    Dependencies cannot cross shards, so missions with dependencies are left where they are.
+    Return the number of moved missions.
+    '''
+    assert len(sessions) == router.n_shards, "there should be one session per shard"
+    moved = 0
+    for shard, session in enumerate(sessions):
+        last_id = 0
+        while True:
+            missions = session.execute(
+                select(Mission)
+                .where(Mission.id > last_id)
+                .order_by(Mission.id)
+                .limit(batch_size)
+                .options(selectinload(Mission.matchers), selectinload(Mission.tags), selectinload(Mission.attempts), selectinload(Mission.archived_attempts))
+            ).scalars().all()
+            if len(missions) <= 0:
+                session.commit()
+                break
+            last_id = missions[-1].id
+            batch_ids = [mission.id for mission in missions]
+            pinned_ids = set()
+            for mission_id, depends_on_id in session.execute(query_pinned(batch_ids)).all():
+                pinned_ids.update((mission_id, depends_on_id))
+            moving_ids, targets = [], set()
+            for mission in missions:
+                patterns = [matcher.pattern for matcher in mission.matchers]
+                tags_name = [tag.tag_name for tag in mission.tags]
+                if len(patterns) <= 0 and not (router.by_tag and len(tags_name) > 0):
+                    continue  # nothing to route it by, leave it where it is
+                if mission.id in pinned_ids:
+                    continue
+                target = router.route(patterns, tags_name)
+                if target == shard:
+                    continue
+                copy_mission(sessions[target], mission)
+                moving_ids.append(mission.id)
+                targets.add(target)
+            for target in targets:
+                sessions[target].commit()
+            if len(moving_ids) > 0:
+                delete_missions(session, moving_ids)
+                logger.info(f"Moved {len(moving_ids)} missions from shard {shard}")
+            session.commit()
+            session.expunge_all()
+            moved += len(moving_ids)
+    return moved
@@ -0,0 +1,25 @@
+import hashlib
+from typing import List
+
+
+class ShardRouter:
+    '''
+    ShardRouter decides which shard owns a mission.
+    The routing key is the primary matcher pattern (or the primary tag if by_tag is set).
+    "Primary" means the smallest one, so that the key can be recomputed from the stored matchers and tags when rebalancing.
+    The sharded submitters move a mission to the shard of its tags when they are added after its creation.
+    '''
+
+    def __init__(self, n_shards: int, by_tag: bool = False):
+        self.n_shards = n_shards
+        self.by_tag = by_tag
+
+    @staticmethod
+    def hash_key(key: str, n_shards: int) -> int:
+        # stable across processes, unlike the builtin hash()
+        return int.from_bytes(hashlib.md5(key.encode('utf8')).digest()[:8], 'big') % n_shards
+
+    def route(self, match_patterns: List[str], tags: List[str] = []) -> int:
+        if self.by_tag and len(tags) > 0:
+            return self.hash_key(min(tags), self.n_shards)
+        return self.hash_key(min(match_patterns), self.n_shards)
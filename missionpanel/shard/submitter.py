@@ -0,0 +1,136 @@
+from typing import List, Optional, Tuple
+from sqlalchemy import select, bindparam, Select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from missionpanel.orm import Mission, Matcher
+from missionpanel.submitter.submitter import SyncSubmitterInterface
+from missionpanel.submitter.asynchronous import AsyncSubmitterInterface
+from missionpanel.orm import statement_cache
+from .router import ShardRouter
+from .handler import ShardedHandlerInterface
+from .rebalance import reroute_mission
+
+
+class ShardedSubmitterInterface:
+
+    @staticmethod
+    def prepare_owner(match_patterns: List[str]) -> Tuple[Select[Tuple[int]], dict]:
+        return statement_cache.get("shard_owner", lambda: select(Matcher.mission_id).where(Matcher.pattern.in_(bindparam("patterns", expanding=True))).limit(1)), {"patterns": match_patterns}
+
+
+class ShardedSubmitter(SyncSubmitterInterface):
+    def __init__(self, sessions: List[Session], router: Optional[ShardRouter] = None):
+        self.sessions = sessions
+        self.router = router if router is not None else ShardRouter(len(sessions))
+
+    def locate_session(self, match_patterns: List[str], tags: List[str] = []) -> Session:
+        '''
+        The shard where one of the patterns already matches a mission, or the routed shard if none does.
+        A mission may be on another shard than the route of these patterns,
+        e.g. it was created with other patterns, or routed by its tags.
+        '''
+        shard = self.router.route(match_patterns, tags)
+        return self.sessions[self.probe_shards(match_patterns, shard)]
+
+    def probe_shards(self, match_patterns: List[str], shard: int) -> int:
+        # the routed shard first, since it is where the mission usually is
+        for i in ShardedHandlerInterface.rotate(len(self.sessions), shard):
+            mission_id = self.sessions[i].execute(*ShardedSubmitterInterface.prepare_owner(match_patterns)).scalar()
+            # avoid idle in transaction
+            self.sessions[i].commit()
+            if mission_id is not None:
+                return i
+        return shard
+
+    def match_mission(self, match_patterns: List[str]) -> Mission:
+        return SyncSubmitterInterface.match_mission(self.locate_session(match_patterns), match_patterns)
+
+    def create_mission(self, content: str, match_patterns: List[str], tags: List[str] = []):
+        return SyncSubmitterInterface.create_mission(self.locate_session(match_patterns, tags), content, match_patterns, tags)
+
+    def add_tags(self, match_patterns: List[str], tags: List[str]):
+        shard = self.probe_shards(match_patterns, self.router.route(match_patterns))
+        SyncSubmitterInterface.add_tags(self.sessions[shard], match_patterns, tags)
+        if self.router.by_tag:
+            # missions created without tags, as the example submitters do, move to the shard of their tags
+            mission_id = self.sessions[shard].execute(*ShardedSubmitterInterface.prepare_owner(match_patterns)).scalar()
+            reroute_mission(self.sessions, self.router, shard, mission_id)
+
+    def delete_tags(self, match_patterns: List[str], tags: List[str]):
+        return SyncSubmitterInterface.delete_tags(self.locate_session(match_patterns), match_patterns, tags)
+
+    def add_dependencies(self, match_patterns: List[str], depends_on: List[List[str]]):
+        '''The dependencies are resolved within a shard, so a mission can only depend on the missions of its own shard.'''
+        shard = self.probe_shards(match_patterns, self.router.route(match_patterns))
+        for parent_patterns in depends_on:
+            # a parent found nowhere is reported as not found by add_dependencies
+            if self.probe_shards(parent_patterns, shard) != shard:
+                raise ValueError(f"Mission {match_patterns} and its dependency {parent_patterns} are on different shards")
+        return SyncSubmitterInterface.add_dependencies(self.sessions[shard], match_patterns, depends_on)
+
+    def list_quarantined(self, tags: List[str] = []) -> List[Mission]:
+        '''The quarantined missions of every shard, whose ids are only unique within their shard.'''
+        return [mission for session in self.sessions for mission in SyncSubmitterInterface.list_quarantined(session, tags)]
+
+    def find_missions(self, path: str, value) -> List[Mission]:
+        return [mission for session in self.sessions for mission in SyncSubmitterInterface.find_missions(session, path, value)]
+
+    def requeue(self, match_patterns: List[str]):
+        return SyncSubmitterInterface.requeue(self.locate_session(match_patterns), match_patterns)
+
+
+class ShardedAsyncSubmitter(AsyncSubmitterInterface):
+    def __init__(self, sessions: List[AsyncSession], router: Optional[ShardRouter] = None):
+        self.sessions = sessions
+        self.router = router if router is not None else ShardRouter(len(sessions))
+
+    async def locate_session(self, match_patterns: List[str], tags: List[str] = []) -> AsyncSession:
+        shard = self.router.route(match_patterns, tags)
+        return self.sessions[await self.probe_shards(match_patterns, shard)]
+
+    async def probe_shards(self, match_patterns: List[str], shard: int) -> int:
+        for i in ShardedHandlerInterface.rotate(len(self.sessions), shard):
+            mission_id = (await self.sessions[i].execute(*ShardedSubmitterInterface.prepare_owner(match_patterns))).scalar()
+            await self.sessions[i].commit()
+            if mission_id is not None:
+                return i
+        return shard
+
+    async def match_mission(self, match_patterns: List[str]) -> Mission:
+        return await AsyncSubmitterInterface.match_mission(await self.locate_session(match_patterns), match_patterns)
+
+    async def create_mission(self, content: str, match_patterns: List[str], tags: List[str] = []):
+        return await AsyncSubmitterInterface.create_mission(await self.locate_session(match_patterns, tags), content, match_patterns, tags)
+
+    async def add_tags(self, matchers: List[str], tags: List[str]):
+        shard = await self.probe_shards(matchers, self.router.route(matchers))
+        await AsyncSubmitterInterface.add_tags(self.sessions[shard], matchers, tags)
+        if self.router.by_tag:
+            mission_id = (await self.sessions[shard].execute(*ShardedSubmitterInterface.prepare_owner(matchers))).scalar()
+            sessions = [session.sync_session for session in self.sessions]
+            await self.sessions[shard].run_sync(lambda _: reroute_mission(sessions, self.router, shard, mission_id))
+
+    async def delete_tags(self, matchers: List[str], tags: List[str]):
+        return await AsyncSubmitterInterface.delete_tags(await self.locate_session(matchers), matchers, tags)
+
+    async def add_dependencies(self, matchers: List[str], depends_on: List[List[str]]):
+        shard = await self.probe_shards(matchers, self.router.route(matchers))
+        for parent_patterns in depends_on:
+            if await self.probe_shards(parent_patterns, shard) != shard:
+                raise ValueError(f"Mission {matchers} and its dependency {parent_patterns} are on different shards")
+        return await AsyncSubmitterInterface.add_dependencies(self.sessions[shard], matchers, depends_on)
+
+    async def list_quarantined(self, tags: List[str] = []) -> List[Mission]:
+        missions = []
+        for session in self.sessions:
+            missions.extend(await AsyncSubmitterInterface.list_quarantined(session, tags))
+        return missions
+
+    async def find_missions(self, path: str, value) -> List[Mission]:
+        missions = []
+        for session in self.sessions:
+            missions.extend(await AsyncSubmitterInterface.find_missions(session, path, value))
+        return missions
+
+    async def requeue(self, matchers: List[str]):
+        return await AsyncSubmitterInterface.requeue(await self.locate_session(matchers), matchers)
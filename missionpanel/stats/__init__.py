@@ -0,0 +1,2 @@
+from .interface import StatsInterface, LatencySummary
+from .stats import Stats, AsyncStats
@@ -0,0 +1,150 @@
+import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from sqlalchemy import Select, CompoundSelect, Update, Delete, Insert, select, update, delete, insert, exists, func, case, union_all, literal, true, Text
+from missionpanel.orm import Mission, Tag, MissionTag, Attempt, TagStat, TagStatDelta, HandlerStat, HandlerStatDelta, MISSION_STATES
+from missionpanel.orm.stats import LATENCY_BOUNDS, LATENCY_COLUMNS, SUM_COLUMNS
+
+
+class LatencySummary(NamedTuple):
+    count: int
+    mean: float
+    max: float
+    # estimated by the upper bound of the histogram bin they fall in, max for the last bin
+    p50: float
+    p95: float
+    p99: float
+
+
+class StatsInterface:
+    '''
+    StatsInterface builds the statements of the panel statistics for Stats and AsyncStats.
+    The counters are maintained as the Missions change, so reading them does not scan mission, missiontag or attempt.
+    The changes are appended to tagstatdelta and handlerstatdelta,
+    and read along with tagstat and handlerstat until they are folded into them.
+    '''
+
+    @staticmethod
+    def query_tag_stats(tags: Optional[List[str]] = None) -> CompoundSelect:
+        folded = select(TagStat.tag_name, TagStat.state, TagStat.count)
+        deltas = (
+            select(TagStatDelta.tag_name, TagStatDelta.state, func.sum(TagStatDelta.delta).label("count"))
+            .group_by(TagStatDelta.tag_name, TagStatDelta.state)
+        )
+        if tags is not None:
+            folded = folded.where(TagStat.tag_name.in_(tags))
+            deltas = deltas.where(TagStatDelta.tag_name.in_(tags))
+        return union_all(folded, deltas)
+
+    @staticmethod
+    def tag_stats(rows: Sequence[Tuple[str, str, int]]) -> Dict[str, Dict[str, int]]:
+        stats = {}
+        for tag_name, state, count in sorted(rows):
+            counters = stats.setdefault(tag_name, {state: 0 for state in MISSION_STATES})
+            counters[state] = counters.get(state, 0) + count
+        return stats
+
+    @staticmethod
+    def _handler_stat_rows(handler: Optional[str] = None, since: Optional[datetime.datetime] = None):
+        names = ("handler", "bucket", "latency_max") + SUM_COLUMNS
+        folded = select(*[getattr(HandlerStat, name) for name in names])
+        deltas = select(*[getattr(HandlerStatDelta, name) for name in names])
+        if handler is not None:
+            folded = folded.where(HandlerStat.handler == handler)
+            deltas = deltas.where(HandlerStatDelta.handler == handler)
+        if since is not None:
+            folded = folded.where(HandlerStat.bucket >= since)
+            deltas = deltas.where(HandlerStatDelta.bucket >= since)
+        return union_all(folded, deltas).subquery("rows")
+
+    @staticmethod
+    def query_handler_stats(handler: Optional[str] = None, since: Optional[datetime.datetime] = None) -> Select:
+        rows = StatsInterface._handler_stat_rows(handler, since)
+        return (
+            select(
+                rows.c.handler, rows.c.bucket,
+                func.max(rows.c.latency_max).label("latency_max"),
+                *[func.sum(rows.c[name]).label(name) for name in SUM_COLUMNS])
+            .group_by(rows.c.handler, rows.c.bucket)
+            .order_by(rows.c.handler, rows.c.bucket)
+        )
+
+    @staticmethod
+    def handler_stats(rows) -> List[HandlerStat]:
+        return [HandlerStat(**row._mapping) for row in rows]
+
+    @staticmethod
+    def query_latency(handler: str, since: datetime.datetime) -> Select:
+        rows = StatsInterface._handler_stat_rows(handler, since)
+        return select(
+            func.coalesce(func.sum(rows.c.succeeded + rows.c.failed), 0),
+            func.coalesce(func.sum(rows.c.latency_sum), 0.0),
+            func.coalesce(func.max(rows.c.latency_max), 0.0),
+            *[func.coalesce(func.sum(rows.c[name]), 0) for name in LATENCY_COLUMNS])
+
+    @staticmethod
+    def latency_summary(row) -> LatencySummary:
+        count, total, longest, *histogram = row
+
+        def quantile(q: float) -> float:
+            seen = 0
+            for bound, n in zip(LATENCY_BOUNDS + (longest,), histogram):
+                seen += n
+                if seen >= q * count:
+                    return min(bound, longest)
+            return longest
+        if count <= 0:
+            return LatencySummary(0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        return LatencySummary(count, total / count, longest, quantile(0.5), quantile(0.95), quantile(0.99))
+
+    @staticmethod
+    def reconcile_states(now: datetime.datetime) -> Update:
+        '''
+        Recompute Mission.state from the Attempts, which catches the Attempts whose handler died without finishing.
+        last_update_time is kept as is, since the Missions themselves are not changed.
+        The archived Missions are done and have no Attempt left in attempt, so they are skipped.
+        '''
+        current = (Attempt.mission_id == Mission.id) & (Attempt.content_digest == Mission.content_digest)
+        state = case(
+            (exists(select(Attempt.id).where(current).where(Attempt.success.is_(True))), "done"),
+            (Mission.quarantined.is_(True), "quarantined"),
+            (exists(select(Attempt.id).where(current).where(Attempt.expire_time >= now)), "running"),
+            else_="pending",
+        )
+        return (
+            update(Mission)
+            .where(Mission.archived.is_(False))
+            .where((Mission.state == None) | (Mission.state != state))
+            .values(state=state, last_update_time=Mission.last_update_time)
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def clear_tag_stats() -> Delete:
+        return delete(TagStat)
+
+    @staticmethod
+    def clear_tag_deltas() -> Delete:
+        return delete(TagStatDelta)
+
+    @staticmethod
+    def recount_tag_stats() -> Insert:
+        states = union_all(*[select(literal(state, Text).label("state")) for state in MISSION_STATES]).subquery("states")
+        counted = (
+            select(func.count())
+            .select_from(MissionTag)
+            .join(Mission, MissionTag.mission_id == Mission.id)
+            .where(MissionTag.tag_name == Tag.name)
+            .where(Mission.state == states.c.state)
+            .scalar_subquery()
+        )
+        return insert(TagStat).from_select(
+            ["tag_name", "state", "count"],
+            select(Tag.name, states.c.state, counted).select_from(Tag.__table__.join(states, true())))
+
+    @staticmethod
+    def prune_handler_stats(before: datetime.datetime) -> Delete:
+        return delete(HandlerStat).where(HandlerStat.bucket < before)
+
+    @staticmethod
+    def prune_handler_stat_deltas(before: datetime.datetime) -> Delete:
+        return delete(HandlerStatDelta).where(HandlerStatDelta.bucket < before)
@@ -0,0 +1,105 @@
+import datetime
+import logging
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from missionpanel.orm import HandlerStat
+from missionpanel.orm.stats import fold_tag_stats, fold_handler_stats
+from .interface import StatsInterface, LatencySummary
+
+
+class Stats(StatsInterface):
+    logger = logging.getLogger("Stats")
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def tag_stats(self, tags: Optional[List[str]] = None) -> Dict[str, Dict[str, int]]:
+        '''
+        Number of Missions in each state, per tag.
+        A Mission whose handler died or lost its lease is counted as running until reconcile recomputes its state.
+        '''
+        stats = StatsInterface.tag_stats(self.session.execute(StatsInterface.query_tag_stats(tags)).all())
+        self.session.commit()
+        return stats
+
+    def handler_stats(self, handler: Optional[str] = None, since: Optional[datetime.datetime] = None) -> List[HandlerStat]:
+        '''Throughput buckets of the handlers, including the Attempts not folded yet. They are not attached to the session.'''
+        stats = StatsInterface.handler_stats(self.session.execute(StatsInterface.query_handler_stats(handler, since)).all())
+        self.session.commit()
+        return stats
+
+    def latency_summary(self, handler: str, window: datetime.timedelta = datetime.timedelta(hours=1)) -> LatencySummary:
+        '''Latency of the Attempts finished by the handler within the last window.'''
+        row = self.session.execute(StatsInterface.query_latency(handler, datetime.datetime.now() - window)).one()
+        self.session.commit()
+        return StatsInterface.latency_summary(row)
+
+    def reconcile(self) -> int:
+        '''
+        Recompute the states and the tag counters from scratch, to repair what the incremental updates cannot see.
+        This is the full scan the counters are there to avoid, so run it rarely.
+        Return the number of Missions whose state was wrong.
+        '''
+        fixed = self.session.execute(StatsInterface.reconcile_states(datetime.datetime.now())).rowcount
+        self.session.execute(StatsInterface.clear_tag_stats())
+        self.session.execute(StatsInterface.clear_tag_deltas())
+        self.session.execute(StatsInterface.recount_tag_stats())
+        self.session.commit()
+        self.logger.info(f"Reconciled, {fixed} missions had a stale state")
+        return fixed
+
+    def fold(self) -> int:
+        '''
+        Fold the appended changes of the tag counters and the handler buckets into them, so that reading them stays cheap.
+        Run it periodically from a single process. Return the number of folded changes.
+        '''
+        folded = fold_tag_stats(self.session.connection()) + fold_handler_stats(self.session.connection())
+        self.session.commit()
+        return folded
+
+    def prune(self, before: datetime.datetime):
+        self.session.execute(StatsInterface.prune_handler_stats(before))
+        self.session.execute(StatsInterface.prune_handler_stat_deltas(before))
+        self.session.commit()
+
+
+class AsyncStats(StatsInterface):
+    logger = logging.getLogger("AsyncStats")
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def tag_stats(self, tags: Optional[List[str]] = None) -> Dict[str, Dict[str, int]]:
+        stats = StatsInterface.tag_stats((await self.session.execute(StatsInterface.query_tag_stats(tags))).all())
+        await self.session.commit()
+        return stats
+
+    async def handler_stats(self, handler: Optional[str] = None, since: Optional[datetime.datetime] = None) -> List[HandlerStat]:
+        stats = StatsInterface.handler_stats((await self.session.execute(StatsInterface.query_handler_stats(handler, since))).all())
+        await self.session.commit()
+        return stats
+
+    async def latency_summary(self, handler: str, window: datetime.timedelta = datetime.timedelta(hours=1)) -> LatencySummary:
+        row = (await self.session.execute(StatsInterface.query_latency(handler, datetime.datetime.now() - window))).one()
+        await self.session.commit()
+        return StatsInterface.latency_summary(row)
+
+    async def reconcile(self) -> int:
+        fixed = (await self.session.execute(StatsInterface.reconcile_states(datetime.datetime.now()))).rowcount
+        await self.session.execute(StatsInterface.clear_tag_stats())
+        await self.session.execute(StatsInterface.clear_tag_deltas())
+        await self.session.execute(StatsInterface.recount_tag_stats())
+        await self.session.commit()
+        self.logger.info(f"Reconciled, {fixed} missions had a stale state")
+        return fixed
+
+    async def fold(self) -> int:
+        folded = await self.session.run_sync(lambda session: fold_tag_stats(session.connection()) + fold_handler_stats(session.connection()))
+        await self.session.commit()
+        return folded
+
+    async def prune(self, before: datetime.datetime):
+        await self.session.execute(StatsInterface.prune_handler_stats(before))
+        await self.session.execute(StatsInterface.prune_handler_stat_deltas(before))
+        await self.session.commit()
@@ -1,8 +1,12 @@
 from typing import List, Union, Tuple
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import flag_modified
 from sqlalchemy.ext.asyncio import AsyncSession
-from missionpanel.orm import Mission, Tag, Matcher, MissionTag
-from sqlalchemy import select, delete, Select
+from missionpanel.orm import Mission, Tag, Matcher, MissionTag, MissionDependency, Attempt, statement_cache, content_matches
+from missionpanel.orm.index import ContentValue
+from missionpanel.orm.dialect import insert_or_skip
+from missionpanel.orm.stats import count_mission_tag
+from sqlalchemy import select, delete, update, exists, func, bindparam, Connection, Select, Update
 import logging
 
 
@@ -13,9 +17,20 @@ class SubmitterInterface:
     '''
     logger = logging.getLogger('SubmitterInterface')
 
+    @staticmethod
+    def prepare_matcher(match_patterns: List[str]) -> Tuple[Select[Tuple[Matcher]], dict]:
+        statement = statement_cache.get("matcher", lambda: (
+            select(Matcher)
+            .where(Matcher.pattern.in_(bindparam("patterns", expanding=True)))
+            .limit(1)
+            .with_for_update()
+        ))
+        return statement, {"patterns": list(match_patterns)}
+
     @staticmethod
     def query_matcher(match_patterns: List[str]) -> Select[Tuple[Matcher]]:
-        return select(Matcher).where(Matcher.pattern.in_(match_patterns)).limit(1).with_for_update()
+        statement, params = SubmitterInterface.prepare_matcher(match_patterns)
+        return statement.params(**params)
 
     @staticmethod
     def add_mission_matchers(session: Union[Session | AsyncSession], mission: Mission, match_patterns: List[str], existing_matchers: List[Matcher] = []) -> Mission:
@@ -36,19 +51,138 @@ class SubmitterInterface:
             if mission.content != content:
                 SubmitterInterface.logger.info(f"Update mission {mission.id}: {mission.content} -> {content}")
                 mission.content = content
+                # new content deserves a fresh retry budget
+                mission.failure_count = 0
+                mission.next_eligible_time = None
+                mission.quarantined = False
+                mission.state = "pending"
+                # reactivate it if archived, even if it was archived after being loaded
+                mission.archived = False
+                flag_modified(mission, "archived")
         return mission
 
     @staticmethod
-    def query_tag(tags_name: List[str]) -> Select[Tuple[Matcher]]:
-        return select(Tag).where(Tag.name.in_(tags_name)).with_for_update()
+    def prepare_tag(tags_name: List[str]) -> Tuple[Select[Tuple[Tag]], dict]:
+        statement = statement_cache.get("tag", lambda: (
+            select(Tag)
+            .where(Tag.name.in_(bindparam("tags", expanding=True)))
+        ))
+        return statement, {"tags": list(tags_name)}
+
+    @staticmethod
+    def query_tag(tags_name: List[str]) -> Select[Tuple[Tag]]:
+        statement, params = SubmitterInterface.prepare_tag(tags_name)
+        return statement.params(**params)
 
     @staticmethod
-    def add_mission_tags(session: Union[Session | AsyncSession], mission: Mission, tags_name: List[str], exist_tags: List[Tag] = [], exist_mission_tags: List[MissionTag] = []):
-        exist_tags_name = [tag.name for tag in exist_tags]
-        session.add_all([Tag(name=tag_name) for tag_name in tags_name if tag_name not in exist_tags_name])
-        exist_mission_tags_name = [tag.tag_name for tag in exist_mission_tags]
-        session.add_all([MissionTag(mission=mission, tag_name=tag_name) for tag_name in tags_name if tag_name not in exist_mission_tags_name])
+    def upsert_mission_tags(connection: Connection, mission_id: int, tags_name: List[str]):
+        '''
+        Add the Tags to a flushed Mission, creating the missing Tags, without reading or locking the existing rows.
+        Rows are inserted one at a time in sorted order, so that submitters sharing Tags wait for each other but never deadlock.
+        The counters only get a delta row appended, see TagStatDelta.
+        '''
+        tags_name = sorted(set(tags_name))
+        if len(tags_name) == 0:
+            return
+        for tag_name in tags_name:
+            insert_or_skip(connection, Tag.__table__, [{"name": tag_name}])
+        for tag_name in tags_name:
+            # counted only if inserted, bypassing the ORM events of MissionTag
+            if insert_or_skip(connection, MissionTag.__table__, [{"mission_id": mission_id, "tag_name": tag_name}]) > 0:
+                connection.execute(count_mission_tag(tag_name, mission_id, 1))
 
     @staticmethod
     def delete_mission_tags(mission_id: int, tags_name: List[str]):
         return delete(MissionTag).where(MissionTag.mission_id == mission_id, MissionTag.tag_name.in_(tags_name))
+
+    @staticmethod
+    def query_quarantined_missions(tags: List[str] = []) -> Select[Tuple[Mission]]:
+        query = select(Mission)
+        if len(tags) > 0:
+            query = query.where(Mission.id.in_(select(MissionTag.mission_id).where(MissionTag.tag_name.in_(tags))))
+        return query.where(Mission.quarantined.is_(True)).order_by(Mission.id).options(selectinload(Mission.blob))
+
+    @staticmethod
+    def requeue_missions(mission_ids: List[int]):
+        # run move_missions(mission_ids, "pending") before it, so that the tag counters follow
+        return update(Mission).where(Mission.id.in_(mission_ids)).values(failure_count=0, next_eligible_time=None, quarantined=False, state="pending")
+
+    @staticmethod
+    def prepare_missions_by_content(path: str, value) -> Tuple[Select[Tuple[Mission]], dict]:
+        '''Missions whose content[path] equals value, path should have been registered with content_index.'''
+        statement = statement_cache.get(("missions_by_content", path), lambda: (
+            select(Mission)
+            .where(content_matches(path, bindparam("value", type_=ContentValue())))
+            .order_by(Mission.id)
+            .options(selectinload(Mission.blob))
+        ))
+        return statement, {"value": value}
+
+    @staticmethod
+    def query_dependency_cycle(mission_id: int, depends_on_id: int) -> Select[Tuple[bool]]:
+        # see if mission_id is depended on by depends_on_id, directly or not
+        ancestors = (
+            select(MissionDependency.depends_on_id.label("id"))
+            .where(MissionDependency.mission_id == depends_on_id)
+            .cte("ancestors", recursive=True)
+        )
+        ancestors = ancestors.union(
+            select(MissionDependency.depends_on_id)
+            .join(ancestors, MissionDependency.mission_id == ancestors.c.id)
+        )
+        return select(exists().where(ancestors.c.id == mission_id))
+
+    @staticmethod
+    def query_dependencies(mission_id: int) -> Select[Tuple[MissionDependency]]:
+        return select(MissionDependency).where(MissionDependency.mission_id == mission_id)
+
+    @staticmethod
+    def query_succeeded_missions(mission_ids: List[int]) -> Select[Tuple[int]]:
+        succeeded = (
+            select(Attempt.id)
+            .where(Attempt.mission_id == Mission.id)
+            .where(Attempt.success.is_(True))
+            .where(Attempt.content_digest == Mission.content_digest)
+        )
+        # archived Missions have succeeded on their current content, their Attempts are in attemptarchive
+        return select(Mission.id).where(Mission.id.in_(mission_ids)).where(Mission.archived.is_(True) | exists(succeeded))
+
+    @staticmethod
+    def lock_missions(mission_ids: List[int]) -> Select[Tuple[int]]:
+        # a Mission succeeds and releases its dependents under this lock, see Handler.release_dependents
+        return select(Mission.id).where(Mission.id.in_(mission_ids)).order_by(Mission.id).with_for_update()
+
+    @staticmethod
+    def resolve_succeeded_dependencies(mission_id: int, depends_on_ids: List[int]) -> Update:
+        # checked after the dependencies are inserted, so that a parent succeeding meanwhile is not missed
+        return (
+            update(MissionDependency)
+            .where(MissionDependency.mission_id == mission_id)
+            .where(MissionDependency.resolved.is_(False))
+            .where(MissionDependency.depends_on_id.in_(SubmitterInterface.query_succeeded_missions(depends_on_ids)))
+            .values(resolved=True)
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def add_mission_dependencies(session: Union[Session | AsyncSession], mission: Mission, depends_on: List[Mission], succeeded_ids: List[int] = [], exist_dependencies: List[MissionDependency] = []):
+        exist_ids = [dependency.depends_on_id for dependency in exist_dependencies]
+        session.add_all([
+            MissionDependency(mission_id=mission.id, depends_on_id=parent.id, resolved=parent.id in succeeded_ids)
+            for parent in depends_on if parent.id not in exist_ids])
+
+    @staticmethod
+    def recount_dependencies(mission_ids: Union[List[int] | Select]) -> Update:
+        # recount instead of decrement, so that releasing the same dependency twice is harmless
+        return (
+            update(Mission)
+            .where(Mission.id.in_(mission_ids))
+            .values(unresolved_dependencies=(
+                select(func.count())
+                .select_from(MissionDependency)
+                .where(MissionDependency.mission_id == Mission.id)
+                .where(MissionDependency.resolved.is_(False))
+                .scalar_subquery()
+            ))
+            .execution_options(synchronize_session=False)
+        )
@@ -1,6 +1,7 @@
 from typing import List, Union
 from sqlalchemy.ext.asyncio import AsyncSession
 from missionpanel.orm import Mission
+from missionpanel.orm.stats import move_missions, uncount_mission_tags
 from .abc import SubmitterInterface
 
 
@@ -8,24 +9,33 @@ class AsyncSubmitterInterface(SubmitterInterface):
 
     @staticmethod
     async def _query_mission(session: AsyncSession, match_patterns: List[str]) -> Mission:
-        matcher = (await session.execute(SubmitterInterface.query_matcher(match_patterns))).scalars().first()
+        matcher = (await session.execute(*SubmitterInterface.prepare_matcher(match_patterns))).scalars().first()
         if matcher is None:
             return None
         mission = await matcher.awaitable_attrs.mission
         existing_matchers = await mission.awaitable_attrs.matchers
+        # content falls back to the blob on an LRU miss, which cannot be lazy loaded here
+        await mission.awaitable_attrs.blob
         SubmitterInterface.add_mission_matchers(session, mission, match_patterns, existing_matchers)
         return mission
 
+    @staticmethod
+    async def _reload_mission(session: AsyncSession, mission: Mission):
+        await session.refresh(mission)
+        await mission.awaitable_attrs.blob
+
     @staticmethod
     async def _add_tags(session: AsyncSession, mission: Union[Mission | None] = None, tags: List[str] = []):
-        exist_tags = (await session.execute(SubmitterInterface.query_tag(tags))).scalars().all() if len(tags) > 0 else []
-        exist_mission_tags = await mission.awaitable_attrs.tags
-        SubmitterInterface.add_mission_tags(session, mission, tags, exist_tags, exist_mission_tags)
+        # the Mission needs its id
+        await session.flush()
+        await session.run_sync(lambda session: SubmitterInterface.upsert_mission_tags(session.connection(), mission.id, tags))
 
     @staticmethod
     async def match_mission(session: AsyncSession, match_patterns: List[str]) -> Mission:
         mission = await AsyncSubmitterInterface._query_mission(session, match_patterns)
         await session.commit()
+        if mission is not None:
+            await AsyncSubmitterInterface._reload_mission(session, mission)
         return mission
 
     @staticmethod
@@ -34,7 +44,7 @@ class AsyncSubmitterInterface(SubmitterInterface):
         mission = SubmitterInterface.create_mission(session, content, match_patterns, mission)
         await AsyncSubmitterInterface._add_tags(session, mission, tags)
         await session.commit()
-        await session.refresh(mission)
+        await AsyncSubmitterInterface._reload_mission(session, mission)
         return mission
 
     @staticmethod
@@ -47,6 +57,7 @@ class AsyncSubmitterInterface(SubmitterInterface):
 
     @staticmethod
     async def _delete_tags(session: AsyncSession, mission: Mission, tags: List[str]):
+        await session.execute(uncount_mission_tags(mission.id, tags))
         await session.execute(SubmitterInterface.delete_mission_tags(mission.id, tags))
 
     @staticmethod
@@ -57,6 +68,56 @@ class AsyncSubmitterInterface(SubmitterInterface):
         await AsyncSubmitterInterface._delete_tags(session, mission, tags)
         await session.commit()
 
+    @staticmethod
+    async def add_dependencies(session: AsyncSession, match_patterns: List[str], depends_on: List[List[str]]):
+        mission = await AsyncSubmitterInterface._query_mission(session, match_patterns)
+        if mission is None:
+            raise ValueError("Mission not found")
+        parents = []
+        for parent_patterns in depends_on:
+            parent = await AsyncSubmitterInterface._query_mission(session, parent_patterns)
+            if parent is None:
+                raise ValueError("Depended mission not found")
+            if parent.id == mission.id or (await session.execute(SubmitterInterface.query_dependency_cycle(mission.id, parent.id))).scalar():
+                await session.rollback()
+                raise ValueError(f"Mission {mission.id} depending on {parent.id} makes a cycle")
+            parents.append(parent)
+        parent_ids = [parent.id for parent in parents]
+        await session.execute(SubmitterInterface.lock_missions(parent_ids))
+        exist_dependencies = (await session.execute(SubmitterInterface.query_dependencies(mission.id))).scalars().all()
+        SubmitterInterface.add_mission_dependencies(session, mission, parents, [], exist_dependencies)
+        await session.flush()
+        await session.execute(SubmitterInterface.resolve_succeeded_dependencies(mission.id, parent_ids))
+        await session.execute(SubmitterInterface.recount_dependencies([mission.id]))
+        await session.commit()
+
+    @staticmethod
+    async def list_quarantined(session: AsyncSession, tags: List[str] = []) -> List[Mission]:
+        missions = (await session.execute(SubmitterInterface.query_quarantined_missions(tags))).scalars().all()
+        # detach them so that commit does not expire them
+        for mission in missions:
+            session.expunge(mission)
+        await session.commit()
+        return missions
+
+    @staticmethod
+    async def find_missions(session: AsyncSession, path: str, value) -> List[Mission]:
+        missions = (await session.execute(*SubmitterInterface.prepare_missions_by_content(path, value))).scalars().all()
+        # detach them so that commit does not expire them
+        for mission in missions:
+            session.expunge(mission)
+        await session.commit()
+        return missions
+
+    @staticmethod
+    async def requeue(session: AsyncSession, match_patterns: List[str]):
+        mission = await AsyncSubmitterInterface._query_mission(session, match_patterns)
+        if mission is None:
+            raise ValueError("Mission not found")
+        await session.execute(move_missions([mission.id], "pending"))
+        await session.execute(SubmitterInterface.requeue_missions([mission.id]))
+        await session.commit()
+
 
 class AsyncSubmitter(AsyncSubmitterInterface):
     def __init__(self, session: AsyncSession):
@@ -73,3 +134,15 @@ class AsyncSubmitter(AsyncSubmitterInterface):
 
     async def delete_tags(self, matchers: List[str], tags: List[str]):
         return await AsyncSubmitterInterface.delete_tags(self.session, matchers, tags)
+
+    async def add_dependencies(self, matchers: List[str], depends_on: List[List[str]]):
+        return await AsyncSubmitterInterface.add_dependencies(self.session, matchers, depends_on)
+
+    async def list_quarantined(self, tags: List[str] = []) -> List[Mission]:
+        return await AsyncSubmitterInterface.list_quarantined(self.session, tags)
+
+    async def find_missions(self, path: str, value) -> List[Mission]:
+        return await AsyncSubmitterInterface.find_missions(self.session, path, value)
+
+    async def requeue(self, matchers: List[str]):
+        return await AsyncSubmitterInterface.requeue(self.session, matchers)
@@ -1,6 +1,7 @@
 from typing import List, Union
 from sqlalchemy.orm import Session
 from missionpanel.orm import Mission
+from missionpanel.orm.stats import move_missions, uncount_mission_tags
 from .abc import SubmitterInterface
 
 
@@ -8,7 +9,7 @@ class SyncSubmitterInterface(SubmitterInterface):
 
     @staticmethod
     def _query_mission(session: Session, match_patterns: List[str]) -> Mission:
-        matcher = session.execute(SubmitterInterface.query_matcher(match_patterns)).scalars().first()
+        matcher = session.execute(*SubmitterInterface.prepare_matcher(match_patterns)).scalars().first()
         if matcher is None:
             return None
         SubmitterInterface.add_mission_matchers(session, matcher.mission, match_patterns, matcher.mission.matchers)
@@ -16,8 +17,9 @@ class SyncSubmitterInterface(SubmitterInterface):
 
     @staticmethod
     def _add_tags(session: Session, mission: Union[Mission | None] = None, tags: List[str] = []):
-        exist_tags = session.execute(SubmitterInterface.query_tag(tags)).scalars().all()
-        tags = SubmitterInterface.add_mission_tags(session, mission, tags, exist_tags, mission.tags)
+        # the Mission needs its id
+        session.flush()
+        SubmitterInterface.upsert_mission_tags(session.connection(), mission.id, tags)
 
     @staticmethod
     def match_mission(session: Session, match_patterns: List[str]) -> Mission:
@@ -43,6 +45,7 @@ class SyncSubmitterInterface(SubmitterInterface):
 
     @staticmethod
     def _delete_tags(session: Session, mission: Mission, tags: List[str]):
+        session.execute(uncount_mission_tags(mission.id, tags))
         session.execute(SubmitterInterface.delete_mission_tags(mission.id, tags))
 
     @staticmethod
@@ -53,6 +56,57 @@ class SyncSubmitterInterface(SubmitterInterface):
         SyncSubmitterInterface._delete_tags(session, mission, tags)
         session.commit()
 
+    @staticmethod
+    def add_dependencies(session: Session, match_patterns: List[str], depends_on: List[List[str]]):
+        mission = SyncSubmitterInterface._query_mission(session, match_patterns)
+        if mission is None:
+            raise ValueError("Mission not found")
+        parents = []
+        for parent_patterns in depends_on:
+            parent = SyncSubmitterInterface._query_mission(session, parent_patterns)
+            if parent is None:
+                raise ValueError("Depended mission not found")
+            if parent.id == mission.id or session.execute(SubmitterInterface.query_dependency_cycle(mission.id, parent.id)).scalar():
+                session.rollback()
+                raise ValueError(f"Mission {mission.id} depending on {parent.id} makes a cycle")
+            parents.append(parent)
+        parent_ids = [parent.id for parent in parents]
+        # the parents cannot succeed until the dependencies are committed, or have succeeded before
+        session.execute(SubmitterInterface.lock_missions(parent_ids))
+        exist_dependencies = session.execute(SubmitterInterface.query_dependencies(mission.id)).scalars().all()
+        SubmitterInterface.add_mission_dependencies(session, mission, parents, [], exist_dependencies)
+        session.flush()
+        session.execute(SubmitterInterface.resolve_succeeded_dependencies(mission.id, parent_ids))
+        session.execute(SubmitterInterface.recount_dependencies([mission.id]))
+        session.commit()
+
+    @staticmethod
+    def list_quarantined(session: Session, tags: List[str] = []) -> List[Mission]:
+        missions = session.execute(SubmitterInterface.query_quarantined_missions(tags)).scalars().all()
+        # detach them so that commit does not expire them
+        for mission in missions:
+            session.expunge(mission)
+        session.commit()
+        return missions
+
+    @staticmethod
+    def find_missions(session: Session, path: str, value) -> List[Mission]:
+        missions = session.execute(*SubmitterInterface.prepare_missions_by_content(path, value)).scalars().all()
+        # detach them so that commit does not expire them
+        for mission in missions:
+            session.expunge(mission)
+        session.commit()
+        return missions
+
+    @staticmethod
+    def requeue(session: Session, match_patterns: List[str]):
+        mission = SyncSubmitterInterface._query_mission(session, match_patterns)
+        if mission is None:
+            raise ValueError("Mission not found")
+        session.execute(move_missions([mission.id], "pending"))
+        session.execute(SubmitterInterface.requeue_missions([mission.id]))
+        session.commit()
+
 
 class Submitter(SyncSubmitterInterface):
     def __init__(self, session: Session):
@@ -69,3 +123,15 @@ class Submitter(SyncSubmitterInterface):
 
     def delete_tags(self, match_patterns: List[str], tags: List[str]):
         return SyncSubmitterInterface.delete_tags(self.session, match_patterns, tags)
+
+    def add_dependencies(self, match_patterns: List[str], depends_on: List[List[str]]):
+        return SyncSubmitterInterface.add_dependencies(self.session, match_patterns, depends_on)
+
+    def list_quarantined(self, tags: List[str] = []) -> List[Mission]:
+        return SyncSubmitterInterface.list_quarantined(self.session, tags)
+
+    def find_missions(self, path: str, value) -> List[Mission]:
+        return SyncSubmitterInterface.find_missions(self.session, path, value)
+
+    def requeue(self, match_patterns: List[str]):
+        return SyncSubmitterInterface.requeue(self.session, match_patterns)
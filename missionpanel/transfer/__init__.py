@@ -0,0 +1,2 @@
+from .export import export_panel
+from .importer import import_panel
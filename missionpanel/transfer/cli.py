@@ -0,0 +1,53 @@
+import argparse
+import gzip
+import io
+import logging
+import sys
+from sqlalchemy import create_engine
+from .export import export_panel
+from .importer import import_panel
+
+
+def open_text(path: str, mode: str, compress: bool):
+    if path == "-":
+        stream = sys.stdout.buffer if mode == "w" else sys.stdin.buffer
+        if compress:
+            stream = gzip.GzipFile(fileobj=stream, mode=mode + "b")
+        return io.TextIOWrapper(stream, encoding="utf8")
+    if compress or path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf8")
+    return open(path, mode, encoding="utf8")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="missionpanel-transfer", description="Export or import a whole mission panel.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    exporter = subparsers.add_parser("export", help="write the panel to a JSON lines file")
+    exporter.add_argument("url", help="SQLAlchemy database URL")
+    exporter.add_argument("file", help="output file, - for stdout, compressed if it ends with .gz")
+    importer = subparsers.add_parser("import", help="load a JSON lines file into the panel")
+    importer.add_argument("url", help="SQLAlchemy database URL")
+    importer.add_argument("file", help="input file, - for stdin, decompressed if it ends with .gz")
+    importer.add_argument("--checkpoint", default=None, help="name to record the progress under in the target, so that an interrupted import can resume")
+    for subparser in (exporter, importer):
+        subparser.add_argument("--gzip", action="store_true", help="force gzip compression")
+        subparser.add_argument("--batch-size", type=int, default=10000, help="rows per fetch or per INSERT")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    engine = create_engine(args.url)
+    try:
+        if args.command == "export":
+            with open_text(args.file, "w", args.gzip) as fp:
+                n = export_panel(engine, fp, args.batch_size)
+            logging.info(f"Exported {n} rows")
+        else:
+            with open_text(args.file, "r", args.gzip) as fp:
+                n = import_panel(engine, fp, args.batch_size, args.checkpoint)
+            logging.info(f"Imported {n} rows")
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
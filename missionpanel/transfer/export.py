@@ -0,0 +1,49 @@
+import json
+import logging
+from typing import TextIO
+from sqlalchemy import Connection, Engine, select
+from .schema import FORMAT, VERSION, panel_tables, encode
+
+logger = logging.getLogger("export")
+
+# dialects where REPEATABLE READ reads the whole transaction from the snapshot taken by its first statement
+SNAPSHOT_DIALECTS = ("postgresql", "mysql", "mariadb")
+
+
+def begin_snapshot(connection: Connection):
+    '''
+    Read the following statements of the connection from one snapshot, so that the tables agree with each other.
+    SQLite keeps its snapshot until the transaction ends, which blocks the writers unless the database is in WAL mode.
+    Other dialects read each statement on its own, export them from a quiesced panel.
+    '''
+    if connection.dialect.name in SNAPSHOT_DIALECTS:
+        connection.execution_options(isolation_level="REPEATABLE READ")
+    elif connection.dialect.name == "sqlite":
+        # pysqlite only begins the transactions before the writes
+        connection.exec_driver_sql("BEGIN")
+
+
+def export_panel(engine: Engine, fp: TextIO, batch_size: int = 10000) -> int:
+    '''
+    Write the whole panel to fp as JSON lines: a format line, then for each table
+    a line naming the table and its columns followed by one JSON array per row.
+    Rows are streamed with a server-side cursor in primary key order, so memory does not grow with the panel.
+    The tables are read in one transaction from one snapshot where the dialect allows it, see begin_snapshot.
+    Return the number of exported rows.
+    '''
+    fp.write(json.dumps({"format": FORMAT, "version": VERSION}) + "\n")
+    total = 0
+    with engine.connect() as connection:
+        begin_snapshot(connection)
+        for table in panel_tables():
+            columns = list(table.columns)
+            fp.write(json.dumps({"table": table.name, "columns": [column.name for column in columns]}) + "\n")
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(
+                select(*columns).order_by(*table.primary_key.columns))
+            n = 0
+            for row in result:
+                fp.write(json.dumps([encode(value) for value in row], ensure_ascii=False, separators=(',', ':')) + "\n")
+                n += 1
+            logger.info(f"Exported {n} rows of {table.name}")
+            total += n
+    return total
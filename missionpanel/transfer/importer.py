@@ -0,0 +1,143 @@
+import json
+import logging
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import Engine, Connection, Table, select, func, insert, update, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from missionpanel.orm import Base, create_content_indexes
+from missionpanel.orm.dialect import insert_or_skip
+from missionpanel.stats import Stats
+from .schema import FORMAT, VERSION, SHARED_TABLES, import_checkpoint, panel_tables, serial_column, remapped_columns, decode
+
+logger = logging.getLogger("import")
+
+
+def load_checkpoint(engine: Engine, name: Optional[str]) -> Optional[dict]:
+    if name is None:
+        return None
+    import_checkpoint.create(engine, checkfirst=True)
+    with engine.connect() as connection:
+        return connection.execute(select(import_checkpoint.c.state).where(import_checkpoint.c.name == name)).scalar()
+
+
+def save_checkpoint(connection: Connection, name: Optional[str], state: dict):
+    '''Run in the transaction of the chunk, so that the checkpoint never lags behind or runs ahead of the committed rows.'''
+    if name is None:
+        return
+    if connection.execute(update(import_checkpoint).where(import_checkpoint.c.name == name).values(state=state)).rowcount <= 0:
+        connection.execute(insert(import_checkpoint).values(name=name, state=state))
+
+
+def serial_offsets(engine: Engine) -> Dict[str, int]:
+    '''Imported serial ids are shifted past the largest id in the target, so that they never collide with existing rows.'''
+    offsets = {}
+    with engine.connect() as connection:
+        for table in panel_tables():
+            serial = serial_column(table)
+            if serial is not None:
+                offsets[table.name] = connection.execute(select(func.coalesce(func.max(serial), 0))).scalar()
+    return offsets
+
+
+def reset_sequences(engine: Engine):
+    # explicit ids do not advance the sequences of PostgreSQL
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as connection:
+        for table in panel_tables():
+            serial = serial_column(table)
+            if serial is not None:
+                connection.execute(
+                    text(f"SELECT setval(pg_get_serial_sequence(:table, :column), (SELECT coalesce(max({serial.name}), 0) + 1 FROM {table.name}), false)"),
+                    {"table": table.name, "column": serial.name})
+
+
+class ChunkWriter:
+    def __init__(self, engine: Engine, table: Table, columns: List[str], offsets: Dict[str, int]):
+        self.engine = engine
+        self.table = table
+        known = {column.name for column in table.columns}
+        self.columns = [(i, table.columns[name]) for i, name in enumerate(columns) if name in known]
+        self.remap = {name: offsets[owner] for name, owner in remapped_columns(table).items() if offsets.get(owner, 0) > 0}
+        self.rows = []
+
+    def add(self, values: list):
+        row = {}
+        for i, column in self.columns:
+            value = decode(column, values[i])
+            if value is not None and column.name in self.remap:
+                value += self.remap[column.name]
+            row[column.name] = value
+        self.rows.append(row)
+
+    def flush(self, checkpoint: Optional[str] = None, state: dict = {}) -> int:
+        n = len(self.rows)
+        if n > 0:
+            with self.engine.begin() as connection:
+                if self.table.name in SHARED_TABLES:
+                    insert_or_skip(connection, self.table, self.rows)
+                else:
+                    try:
+                        connection.execute(insert(self.table), self.rows)
+                    except IntegrityError as e:
+                        # e.g. a Matcher pattern already used by a Mission of the target
+                        raise ValueError(f"Rows of {self.table.name} conflict with the target: {e.orig}") from e
+                save_checkpoint(connection, checkpoint, state)
+            self.rows = []
+        return n
+
+
+def import_panel(engine: Engine, fp: Iterable[str], batch_size: int = 10000, checkpoint: Optional[str] = None) -> int:
+    '''
+    Load a panel written by export_panel into engine, in chunks of batch_size rows each committed in its own transaction.
+    Serial ids are remapped by an offset instead of a lookup table, so memory does not grow with the panel.
+    With a checkpoint name, an interrupted import started again with the same file resumes after the last committed chunk,
+    the progress being committed in the target together with each chunk.
+    Tags and content blobs already in the target are shared, any other conflicting row, such as a Matcher pattern
+    already used in the target, raises ValueError with the chunk rolled back. Derived tables are rebuilt at the end.
+    Return the number of rows imported by this call.
+    '''
+    Base.metadata.create_all(engine)
+    state = load_checkpoint(engine, checkpoint)
+    if state is None:
+        state = {"line": 1, "offsets": serial_offsets(engine)}
+        with engine.begin() as connection:
+            save_checkpoint(connection, checkpoint, state)
+    lines = iter(fp)
+    header = json.loads(next(lines))
+    if header.get("format") != FORMAT or header.get("version") != VERSION:
+        raise ValueError(f"Not a missionpanel export: {header}")
+    tables = {table.name: table for table in panel_tables()}
+    writer, total = None, 0
+
+    def flush(line: int):
+        nonlocal total
+        if writer is not None:
+            n = writer.flush(checkpoint, {**state, "line": line})
+            if n > 0:
+                total += n
+                state["line"] = line
+                logger.info(f"Imported {n} rows of {writer.table.name}")
+
+    line = 1
+    for line, raw in enumerate(lines, start=2):
+        record = json.loads(raw)
+        if isinstance(record, dict):  # a new table begins
+            flush(line - 1)
+            if record["table"] not in tables:
+                logger.warning(f"Skipping unknown table {record['table']}")
+                writer = None
+            else:
+                writer = ChunkWriter(engine, tables[record["table"]], record["columns"], state["offsets"])
+            continue
+        if line <= state["line"] or writer is None:
+            continue  # committed before the interruption
+        writer.add(record)
+        if len(writer.rows) >= batch_size:
+            flush(line)
+    flush(line)
+    reset_sequences(engine)
+    create_content_indexes(engine)
+    with Session(engine) as session:
+        Stats(session).reconcile()
+    return total
@@ -0,0 +1,64 @@
+import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import Table, Column, MetaData, Integer, Text, JSON, DateTime, Interval
+from missionpanel.orm import Base
+
+FORMAT = "missionpanel"
+VERSION = 1
+
+# derived tables, rebuilt on import instead of transferred
+DERIVED_TABLES = ("tagstat", "tagstatdelta")
+# tables whose rows are identified by their content, so that a row already in the target is the same row
+SHARED_TABLES = ("tag", "contentblob")
+
+# progress of the imports into this database, kept out of Base so that it is not part of the panel
+import_checkpoint = Table(
+    "importcheckpoint", MetaData(),
+    Column("name", Text, primary_key=True, comment="Checkpoint name given to import_panel"),
+    Column("state", JSON, comment="Last committed line and the serial offsets"),
+)
+
+
+def panel_tables() -> List[Table]:
+    '''Tables to transfer, parents before children so that foreign keys are satisfied on import.'''
+    return [table for table in Base.metadata.sorted_tables if table.name not in DERIVED_TABLES]
+
+
+def serial_column(table: Table) -> Optional[Column]:
+    '''The integer primary key assigned by the database, which has to be remapped on import.'''
+    pk = list(table.primary_key.columns)
+    if len(pk) == 1 and isinstance(pk[0].type, Integer) and pk[0].autoincrement in (True, "auto") and len(pk[0].foreign_keys) == 0:
+        return pk[0]
+    return None
+
+
+def remapped_columns(table: Table) -> Dict[str, str]:
+    '''Map the columns of table holding a serial id (its own or a foreign key to one) to the table owning the serial.'''
+    columns = {}
+    serial = serial_column(table)
+    if serial is not None:
+        columns[serial.name] = table.name
+    for column in table.columns:
+        for foreign_key in column.foreign_keys:
+            target = foreign_key.column
+            if serial_column(target.table) is target:
+                columns[column.name] = target.table.name
+    return columns
+
+
+def encode(value: Any) -> Any:
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return value
+
+
+def decode(column: Column, value: Any) -> Any:
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime):
+        return datetime.datetime.fromisoformat(value)
+    if isinstance(column.type, Interval):
+        return datetime.timedelta(seconds=value)
+    return value
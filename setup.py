@@ -29,5 +29,10 @@ setup(
     install_requires=[
         'sqlalchemy>=2',
         'chardet',
-    ]
+    ],
+    entry_points={
+        'console_scripts': [
+            'missionpanel-transfer = missionpanel.transfer.cli:main',
+        ],
+    },
 )
@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+from sqlalchemy import create_engine, select, func, text, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from missionpanel.orm import Base, Mission, Attempt, AttemptArchive
+from missionpanel.orm.migrate import migrate_archive
+from missionpanel.submitter import Submitter, AsyncSubmitter
+from missionpanel.handler import Handler, AsyncHandler, RetryPolicy
+from missionpanel.handler.handler import HandlerInterface
+from missionpanel.archive import Archive, AsyncArchive
+from missionpanel.stats import Stats
+
+
+class FakeHandler(Handler):
+    def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    def execute_mission(self, mission, attempt):
+        print(f"Attempt {attempt.id} is executing mission {mission.content['name']}")
+        return not mission.content['name'].startswith("Broken")
+
+
+class FakeAsyncHandler(AsyncHandler):
+    async def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    async def execute_mission(self, mission, attempt):
+        return True
+
+
+def count(session: Session, model) -> int:
+    return session.execute(select(func.count()).select_from(model)).scalar()
+
+
+def main(session: Session):
+    submitter = Submitter(session)
+    for i in range(4):
+        submitter.create_mission(content={"name": f"Mission {i}"}, match_patterns=[f"Mission {i}"], tags=["mission"])
+    submitter.create_mission(content={"name": "Broken mission"}, match_patterns=["Broken"], tags=["mission"])
+    handler = FakeHandler(session, "Fake handler", retry_policy=RetryPolicy(base_delay=datetime.timedelta(0), jitter=0, max_failures=2))
+    while handler.run_once(["mission"]) is not None:
+        pass
+    stats = Stats(session)
+    counters = stats.tag_stats()
+
+    archive = Archive(session)
+    assert archive.archive(batch_size=3) == 4
+    assert archive.archive() == 0
+    assert count(session, Attempt) == 2 and count(session, AttemptArchive) == 4
+    assert [mission.archived for mission in session.execute(select(Mission).order_by(Mission.id)).scalars().all()] == [True] * 4 + [False]
+    # nothing changes for the statistics
+    assert stats.tag_stats() == counters
+    assert stats.reconcile() == 0 and stats.tag_stats() == counters
+
+    # the handlers search the active Missions only
+    statement, params = HandlerInterface.prepare_todo_missions(["mission"])
+    compiled = statement.params(**params).compile(session.get_bind(), compile_kwargs={"literal_binds": True})
+    plan = " ".join(row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all())
+    print(plan)
+    assert "ix_mission_eligible" in plan
+
+    # archived Missions still resolve dependencies
+    submitter.create_mission(content={"name": "Report"}, match_patterns=["Report"], tags=["report"])
+    submitter.add_dependencies(["Report"], [["Mission 0"]])
+    assert submitter.match_mission(["Report"]).unresolved_dependencies == 0
+
+    # resubmitting the same content keeps it archived, a new content reactivates it
+    submitter.create_mission(content={"name": "Mission 1"}, match_patterns=["Mission 1"])
+    assert submitter.match_mission(["Mission 1"]).archived
+    submitter.create_mission(content={"name": "Mission 2 v2"}, match_patterns=["Mission 2"])
+    mission = submitter.match_mission(["Mission 2"])
+    assert not mission.archived and mission.state == "pending"
+    attempt = handler.run_once(["mission"])
+    assert attempt.mission.content["name"] == "Mission 2 v2" and attempt.success
+    assert handler.run_once(["mission"]) is None
+
+    history = archive.history(mission.id)
+    print(history)
+    assert [type(attempt) for attempt in history] == [AttemptArchive, Attempt]
+    assert [attempt.content["name"] for attempt in history] == ["Mission 2", "Mission 2 v2"]
+    assert all(attempt.success for attempt in history)
+
+    # only the Missions finished before the given time
+    assert archive.archive(finished_before=datetime.datetime.now() - datetime.timedelta(hours=1)) == 0
+    assert archive.archive() == 1
+    assert [attempt.content["name"] for attempt in archive.history(mission.id)] == ["Mission 2", "Mission 2 v2"]
+    # the history read before is still readable after its Attempt was moved to the archive
+    assert all(attempt.success for attempt in history)
+    assert stats.reconcile() == 0
+
+
+def migrate_main():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    # a panel created before the archive tier
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_mission_eligible"))
+        connection.execute(text("ALTER TABLE mission DROP COLUMN archived"))
+        connection.execute(text("DROP TABLE attemptarchive"))
+    with Session(engine) as session:
+        session.execute(text("INSERT INTO mission (id, state) VALUES (1, 'pending')"))
+        session.commit()
+    migrate_archive(engine)
+    migrate_archive(engine)
+    assert "ix_mission_eligible" in {index["name"] for index in inspect(engine).get_indexes("mission")}
+    with Session(engine) as session:
+        assert session.get(Mission, 1).archived is False
+        assert count(session, AttemptArchive) == 0
+
+
+async def async_main():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine) as session:
+        submitter = AsyncSubmitter(session)
+        for i in range(3):
+            await submitter.create_mission(content={"name": f"Mission {i}"}, match_patterns=[f"Mission {i}"])
+            await submitter.add_tags([f"Mission {i}"], ["mission"])
+        await FakeAsyncHandler(session, "Fake async handler").run_all(["mission"])
+        archive = AsyncArchive(session)
+        assert await archive.archive(batch_size=2) == 3
+        mission = await submitter.match_mission(["Mission 0"])
+        history = await archive.history(inspect(mission).identity[0])
+        assert len(history) == 1 and history[0].success and history[0].handler == "Fake async handler"
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        main(session)
+    migrate_main()
+    asyncio.run(async_main())
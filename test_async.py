@@ -1,6 +1,6 @@
 import asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
-from missionpanel.orm import Base, Mission, Tag, MissionTag, Matcher, Attempt
+from missionpanel.orm import Base, Mission, Tag, MissionTag, Matcher, Attempt, content_cache
 from missionpanel.submitter import AsyncSubmitter
 from missionpanel.handler import AsyncHandler
 
@@ -77,6 +77,15 @@ async def async_main(engine: AsyncEngine):
         await conn.run_sync(Base.metadata.create_all)
     async with AsyncSession(engine) as session:
         await main(session)
+    # a new process starts with an empty content cache
+    content_cache.clear()
+    async with AsyncSession(engine) as session:
+        submitter = AsyncSubmitter(session)
+        mission = await submitter.create_mission(content={"name": "Easy mission v2"}, match_patterns=["Easy mission"])
+        assert mission.content == {"name": "Easy mission v2"}
+        content_cache.clear()
+        mission = await submitter.match_mission(["E Mission"])
+        assert mission.content == {"name": "Easy mission v2"}
 
 if __name__ == "__main__":
     engine = create_async_engine("sqlite+aiosqlite://", echo=True)
@@ -0,0 +1,108 @@
+import datetime
+from sqlalchemy import create_engine, select, delete, func, text
+from sqlalchemy.orm import Session
+from missionpanel.orm import Base, ContentBlob, Mission, Attempt, content_cache
+from missionpanel.orm.migrate import migrate_content_blobs, migrate_panel, collect_content_blobs
+from missionpanel.submitter import Submitter
+from missionpanel.handler import Handler, RetryPolicy
+from missionpanel.stats import Stats
+
+
+class FailingHandler(Handler):
+    def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    def execute_mission(self, mission, attempt):
+        print(f"Attempt {attempt.id} is failing mission {mission.content['name']}")
+        return False
+
+
+def main(session: Session):
+    submitter = Submitter(session)
+    payload = {"name": "Feed", "items": [{"title": f"Item {i}"} for i in range(100)]}
+    submitter.create_mission(content=payload, match_patterns=["Feed"], tags=["feed"])
+    submitter.create_mission(content=payload, match_patterns=["Feed mirror"], tags=["feed"])
+
+    handler = FailingHandler(session, "Failing handler", retry_policy=RetryPolicy(base_delay=datetime.timedelta(0), jitter=0, max_failures=None))
+    for _ in range(10):
+        assert handler.run_once(["feed"]) is not None
+    assert session.execute(select(func.count(Attempt.id))).scalar() == 10
+    assert session.execute(select(func.count(ContentBlob.digest))).scalar() == 1  # two missions and ten attempts, one blob
+
+    # reads resolve through the LRU without touching the blob
+    content_cache.clear()
+    session.expunge_all()
+    attempt = session.execute(select(Attempt).limit(1)).scalar_one()
+    assert attempt.content == payload and content_cache.misses == 1
+    attempt = session.execute(select(Attempt).offset(1).limit(1)).scalar_one()
+    assert attempt.content == payload and content_cache.hits == 1
+
+    # modifying a content in place does not leak into other objects
+    attempt.content["name"] = "Modified"
+    mission = session.execute(select(Mission).limit(1)).scalar_one()
+    assert mission.content == payload
+
+    # new content gets its own blob
+    mission = submitter.create_mission(content={"name": "Feed v2"}, match_patterns=["Feed"])
+    session.commit()
+    assert session.execute(select(func.count(ContentBlob.digest))).scalar() == 2
+    assert handler.run_once(["feed"]) is not None
+
+
+def legacy_main(session: Session):
+    session.execute(text("CREATE TABLE mission (id INTEGER PRIMARY KEY, content JSON, create_time DATETIME, last_update_time DATETIME)"))
+    session.execute(text("CREATE TABLE attempt (id INTEGER PRIMARY KEY, handler TEXT, content JSON, mission_id INTEGER)"))
+    session.execute(text("INSERT INTO mission (id, content) VALUES (1, '{\"name\": \"Feed\"}'), (2, '{\"name\": \"Other\"}')"))
+    for i in range(20):
+        session.execute(text(f"INSERT INTO attempt (id, handler, content, mission_id) VALUES ({i + 1}, 'handler', '{{\"name\": \"Feed\"}}', 1)"))
+    session.commit()
+    n_rows, n_blobs = migrate_content_blobs(session.get_bind(), batch_size=7, drop_legacy=True)
+    assert (n_rows, n_blobs) == (22, 2)
+    assert migrate_content_blobs(session.get_bind()) == (0, 0)
+    digests = session.execute(text("SELECT DISTINCT content_digest FROM attempt")).scalars().all()
+    blob = session.get(ContentBlob, digests[0])
+    print(blob)
+    assert len(digests) == 1 and blob.content == {"name": "Feed"}
+
+
+def panel_main(session: Session):
+    # a panel created by the first version, with one finished and one new Mission
+    session.execute(text("CREATE TABLE mission (id INTEGER PRIMARY KEY, content JSON, create_time DATETIME, last_update_time DATETIME)"))
+    session.execute(text("CREATE TABLE attempt (id INTEGER PRIMARY KEY, handler TEXT, create_time DATETIME, last_update_time DATETIME, max_time_interval DATETIME, content JSON, success BOOLEAN, mission_id INTEGER)"))
+    session.execute(text("CREATE TABLE matcher (pattern TEXT PRIMARY KEY, mission_id INTEGER)"))
+    session.execute(text("CREATE TABLE tag (name TEXT PRIMARY KEY)"))
+    session.execute(text("CREATE TABLE missiontag (tag_name TEXT, mission_id INTEGER, PRIMARY KEY (tag_name, mission_id))"))
+    session.execute(text("INSERT INTO mission (id, content) VALUES (1, '{\"name\": \"Done\"}'), (2, '{\"name\": \"New\"}')"))
+    session.execute(text("INSERT INTO attempt (id, handler, last_update_time, content, success, mission_id) VALUES (1, 'handler', '2024-01-01 00:00:00', '{\"name\": \"Done\"}', 1, 1)"))
+    session.execute(text("INSERT INTO matcher VALUES ('Done', 1), ('New', 2)"))
+    session.execute(text("INSERT INTO tag VALUES ('mission')"))
+    session.execute(text("INSERT INTO missiontag VALUES ('mission', 1), ('mission', 2)"))
+    session.commit()
+    engine = session.get_bind()
+    assert migrate_panel(engine, drop_legacy=True) > 0
+    assert migrate_panel(engine) == 0
+    mission = session.get(Mission, 2)
+    assert (mission.quarantined, mission.failure_count, mission.unresolved_dependencies, mission.archived) == (False, 0, 0, False)
+    assert session.get(Mission, 1).state == "done" and mission.state == "pending"
+    assert Stats(session).tag_stats() == {"mission": {"pending": 1, "running": 0, "done": 1, "quarantined": 0}}
+    attempt = FailingHandler(session, "Failing handler").run_once(["mission"])
+    assert attempt.mission.content == {"name": "New"}
+
+    # the old content of a resubmitted Mission is collected once nothing refers to it
+    Submitter(session).create_mission(content={"name": "New v2"}, match_patterns=["New"])
+    assert collect_content_blobs(engine) == 0
+    session.execute(delete(Attempt).where(Attempt.mission_id == 2))
+    session.commit()
+    assert collect_content_blobs(engine, batch_size=1) == 1
+    assert sorted(blob.content["name"] for blob in session.execute(select(ContentBlob)).scalars().all()) == ["Done", "New v2"]
+
+
+if __name__ == "__main__":
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        main(session)
+    with Session(create_engine("sqlite://")) as session:
+        legacy_main(session)
+    with Session(create_engine("sqlite://")) as session:
+        panel_main(session)
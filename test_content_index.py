@@ -0,0 +1,107 @@
+import asyncio
+from sqlalchemy import create_engine, select, func, text, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from missionpanel.orm import Base, ContentField, content_index
+from missionpanel.orm import index
+from missionpanel.submitter import Submitter, AsyncSubmitter
+from missionpanel.handler import Handler
+from missionpanel.submitter.abc import SubmitterInterface
+
+content_index("url")
+content_index("feed.url")
+
+
+class FeedHandler(Handler):
+    def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    def execute_mission(self, mission, attempt):
+        print(f"Attempt {attempt.id} is executing mission {mission.content['url']}")
+        return True
+
+
+def main(session: Session):
+    submitter = Submitter(session)
+    for feed in ["a", "b"]:
+        for i in range(3):
+            url = f"https://{feed}.example.com/{i}"
+            submitter.create_mission(content={"url": url, "feed": {"url": f"https://{feed}.example.com/feed"}}, match_patterns=[url], tags=["item"])
+
+    missions = submitter.find_missions("url", "https://a.example.com/1")
+    assert [mission.content["url"] for mission in missions] == ["https://a.example.com/1"]
+    missions = submitter.find_missions("feed.url", "https://b.example.com/feed")
+    assert len(missions) == 3 and all(mission.content["feed"]["url"] == "https://b.example.com/feed" for mission in missions)
+    # detached and loaded, so that they can be read after the session moved on
+    assert all(inspect(mission).detached and "content_digest" in mission.__dict__ for mission in missions)
+    assert submitter.find_missions("url", "https://c.example.com/0") == []
+    try:
+        submitter.find_missions("title", "nothing")
+        assert False, "unregistered path should be refused"
+    except ValueError as e:
+        print(e)
+
+    # the lookup goes through the expression index
+    statement, params = SubmitterInterface.prepare_missions_by_content("url", "https://a.example.com/1")
+    compiled = statement.compile(session.get_bind(), compile_kwargs={"literal_binds": True})
+    plan = " ".join(row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all())
+    print(plan)
+    assert "ix_contentblob_url" in plan
+
+    # handle only the missions of feed b
+    handler = FeedHandler(session, "Feed handler", content_filter={"feed.url": "https://b.example.com/feed"})
+    attempts = []
+    while (attempt := handler.run_once(["item"])) is not None:
+        attempts.append(attempt)
+    assert len(attempts) == 3
+    assert all(attempt.mission.content["feed"]["url"] == "https://b.example.com/feed" for attempt in attempts)
+    assert FeedHandler(session, "Feed handler").run_once(["item"]) is not None
+
+
+def side_index_main():
+    # as on a dialect without expression indexes
+    original, index.EXPRESSION_INDEX_DIALECTS = index.EXPRESSION_INDEX_DIALECTS, ()
+    try:
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        assert "contentfield" in inspect(engine).get_table_names()
+        with Session(engine) as session:
+            submitter = Submitter(session)
+            for i in range(3):
+                url = f"https://a.example.com/{i}"
+                submitter.create_mission(content={"url": url, "feed": {"url": "https://a.example.com/feed"}}, match_patterns=[url], tags=["item"])
+            assert session.execute(select(func.count()).select_from(ContentField)).scalar() == 6
+            missions = submitter.find_missions("url", "https://a.example.com/1")
+            assert [mission.content["url"] for mission in missions] == ["https://a.example.com/1"]
+            assert len(submitter.find_missions("feed.url", "https://a.example.com/feed")) == 3
+            statement, params = SubmitterInterface.prepare_missions_by_content("url", "https://a.example.com/1")
+            compiled = statement.compile(engine, compile_kwargs={"literal_binds": True})
+            plan = " ".join(row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all())
+            print(plan)
+            assert "contentfield" in plan
+        Base.metadata.drop_all(engine)
+    finally:
+        index.EXPRESSION_INDEX_DIALECTS = original
+
+
+async def async_main():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine) as session:
+        submitter = AsyncSubmitter(session)
+        await submitter.create_mission(content={"url": "https://a.example.com/0"}, match_patterns=["a0"])
+        missions = await submitter.find_missions("url", "https://a.example.com/0")
+        assert len(missions) == 1 and missions[0].content == {"url": "https://a.example.com/0"}
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    # the side index is only created where it is used
+    assert "contentfield" not in inspect(engine).get_table_names()
+    with Session(engine) as session:
+        main(session)
+    side_index_main()
+    asyncio.run(async_main())
@@ -0,0 +1,60 @@
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from missionpanel.orm import Base
+from missionpanel.submitter import Submitter
+from missionpanel.submitter.abc import SubmitterInterface
+from missionpanel.handler import Handler
+
+
+class FakeHandler(Handler):
+    def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    def execute_mission(self, mission, attempt):
+        print(f"Attempt {attempt.id} is executing mission {mission.content['name']}")
+        return True
+
+
+def main(session: Session):
+    submitter = Submitter(session)
+    submitter.create_mission(content={"name": "Post-processing"}, match_patterns=["Post-processing"], tags=["mission"])
+    submitter.create_mission(content={"name": "Download 1"}, match_patterns=["Download 1"], tags=["mission"])
+    submitter.create_mission(content={"name": "Download 2"}, match_patterns=["Download 2"], tags=["mission"])
+    submitter.create_mission(content={"name": "Root feed"}, match_patterns=["Root feed"], tags=["mission"])
+    submitter.add_dependencies(["Download 1"], [["Root feed"]])
+    submitter.add_dependencies(["Download 2"], [["Root feed"]])
+    submitter.add_dependencies(["Post-processing"], [["Download 1"], ["Download 2"]])
+    submitter.add_dependencies(["Post-processing"], [["Download 1"]])  # added twice
+    try:
+        submitter.add_dependencies(["Root feed"], [["Post-processing"]])
+        raise AssertionError("cycle not detected")
+    except ValueError as e:
+        print(e)
+    assert submitter.match_mission(["Post-processing"]).unresolved_dependencies == 2
+
+    handler = FakeHandler(session, "Pipeline handler")
+    order = []
+    while True:
+        attempt = handler.run_once(["mission"])
+        if attempt is None:
+            break
+        order.append(attempt.mission.content['name'])
+    print(order)
+    assert order[0] == "Root feed" and order[-1] == "Post-processing" and len(order) == 4
+
+    # depending on a succeeded mission is resolved at once
+    submitter.create_mission(content={"name": "Report"}, match_patterns=["Report"], tags=["mission"])
+    submitter.add_dependencies(["Report"], [["Post-processing"]])
+    assert submitter.match_mission(["Report"]).unresolved_dependencies == 0
+
+    # the parents are locked the same way by the submitters and the handlers, so that no success is missed
+    dialect = postgresql.dialect()
+    assert "FOR UPDATE" in str(SubmitterInterface.lock_missions([1, 2]).compile(dialect=dialect))
+
+
+if __name__ == "__main__":
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        main(session)
@@ -0,0 +1,111 @@
+import asyncio
+import datetime
+import os
+import tempfile
+import time
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from missionpanel.orm import Base, Attempt
+from missionpanel.submitter import Submitter, AsyncSubmitter
+from missionpanel.handler import Handler, AsyncHandler
+
+
+class SlowHandler(Handler):
+    def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    def execute_mission(self, mission, attempt):
+        print(f"Attempt {attempt.id} is executing mission {mission.content['name']}")
+        with Session(self.session.get_bind()) as session:
+            Submitter(session).create_mission(content={"name": "Changed mission"}, match_patterns=["Mission"])
+        for _ in range(50):
+            if self.lease_lost.is_set():
+                print(f"Attempt {attempt.id} gave up mission {mission.content['name']}")
+                return False
+            time.sleep(0.1)
+        return True
+
+
+class FastHandler(Handler):
+    def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    def execute_mission(self, mission, attempt):
+        return True
+
+
+class StalledHandler(SlowHandler):
+    def execute_mission(self, mission, attempt):
+        engine = self.session.get_bind()
+        # another writer holds the database, so the heartbeats fail until the lease expires
+        with engine.connect() as connection:
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            assert self.lease_lost.wait(2)
+            connection.rollback()
+        with Session(engine) as session:
+            taken_over = FastHandler(session, "Fast handler").run_once(["mission"])
+            assert taken_over is not None and taken_over.success
+        return True
+
+
+class SlowAsyncHandler(AsyncHandler):
+    async def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    async def execute_mission(self, mission, attempt):
+        print(f"Attempt {attempt.id} is executing mission {mission.content['name']}")
+        self.started.set()
+        await asyncio.sleep(5)
+        return True
+
+
+def sync_main(path: str):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        Submitter(session).create_mission(content={"name": "Mission"}, match_patterns=["Mission"], tags=["mission"])
+        handler = SlowHandler(session, "Slow handler", max_time_interval=datetime.timedelta(seconds=0.2))
+        start = time.time()
+        attempt = handler.run_once(["mission"])
+        assert handler.lease_lost.is_set() and not attempt.success
+        assert time.time() - start < 2
+
+
+def takeover_main(path: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 0.05})
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        Submitter(session).create_mission(content={"name": "Mission"}, match_patterns=["Mission"], tags=["mission"])
+        handler = StalledHandler(session, "Stalled handler", max_time_interval=datetime.timedelta(seconds=0.2))
+        attempt = handler.run_once(["mission"])
+        assert handler.lease_lost.is_set() and not attempt.success
+        attempts = session.execute(select(Attempt).order_by(Attempt.id)).scalars().all()
+        assert [(attempt.handler, attempt.success) for attempt in attempts] == [("Stalled handler", False), ("Fast handler", True)]
+
+
+async def async_main(path: str):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine) as session, AsyncSession(engine) as submitter_session:
+        submitter = AsyncSubmitter(submitter_session)
+        await submitter.create_mission(content={"name": "Mission"}, match_patterns=["Mission"])
+        await submitter.add_tags(["Mission"], ["mission"])
+        handler = SlowAsyncHandler(session, "Slow handler", max_time_interval=datetime.timedelta(seconds=0.2))
+        handler.started = asyncio.Event()
+        start = time.time()
+        run = asyncio.create_task(handler.run_once(["mission"]))
+        await handler.started.wait()
+        await submitter.create_mission(content={"name": "Changed mission"}, match_patterns=["Mission"])
+        attempt = await run
+        assert not attempt.success
+        assert time.time() - start < 2
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sync_main(os.path.join(tmpdir, "sync.db"))
+        takeover_main(os.path.join(tmpdir, "takeover.db"))
+        asyncio.run(async_main(os.path.join(tmpdir, "async.db")))
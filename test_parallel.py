@@ -0,0 +1,79 @@
+import asyncio
+import datetime
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
+from missionpanel.orm import Base
+from missionpanel.submitter import AsyncSubmitter
+from missionpanel.handler import ParallelAsyncHandler, ConcurrencyLimiter, RetryPolicy
+
+
+class FakeHandler(ParallelAsyncHandler):
+    async def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    async def execute_mission(self, mission, attempt):
+        self.max_in_flight = max(getattr(self, 'max_in_flight', 0), len(self.task_dict))
+        # read before awaiting, other tasks sharing the session may expire it
+        ok = mission.content['ok']
+        await asyncio.sleep(0.01)
+        return ok
+
+
+async def main(session: AsyncSession):
+    submitter = AsyncSubmitter(session)
+    for i in range(60):
+        await submitter.create_mission(content={"name": f"Mission {i}", "ok": True}, match_patterns=[f"Mission {i}"])
+        await submitter.add_tags([f"Mission {i}"], ["good"])
+        await submitter.create_mission(content={"name": f"Bad mission {i}", "ok": False}, match_patterns=[f"Bad mission {i}"])
+        await submitter.add_tags([f"Bad mission {i}"], ["bad"])
+
+    # fixed concurrency
+    handler = FakeHandler(3, session, "Fixed handler", max_time_interval=datetime.timedelta(seconds=10))
+    await handler.run_all(["good"])
+    print(handler.max_in_flight)
+    assert handler.max_in_flight <= 3
+
+    # grows when everything succeeds
+    for i in range(60):
+        await submitter.create_mission(content={"name": f"Mission {i}", "ok": True, "round": 2}, match_patterns=[f"Mission {i}"])
+    limiter = ConcurrencyLimiter(min_limit=1, max_limit=8, window=5)
+    handler = FakeHandler(1, session, "Adaptive handler", limiter=limiter, max_time_interval=datetime.timedelta(seconds=10))
+    await handler.run_all(["good"])
+    print(handler.concurrency_limit, list(limiter.history))
+    assert handler.concurrency_limit > 1 and handler.max_in_flight <= 8
+
+    # shrinks when everything fails
+    grown = handler.concurrency_limit
+    handler.retry_policy = RetryPolicy(max_failures=None)
+    await handler.run_all(["bad"])
+    print(handler.concurrency_limit, list(limiter.history))
+    assert handler.concurrency_limit < grown
+
+    # starts from n_parallel
+    assert FakeHandler(8, session, "Seeded handler", limiter=ConcurrencyLimiter()).concurrency_limit == 8
+    assert FakeHandler(8, session, "Seeded handler", limiter=ConcurrencyLimiter(initial_limit=2)).concurrency_limit == 2
+
+
+def baseline_main():
+    # a workload slowing down gradually is taken as the new normal
+    limiter = ConcurrencyLimiter(initial_limit=4, window=2, baseline_windows=2, latency_tolerance=2)
+    for latency in [1.0] * 4 + [1.9] * 8 + [3.0] * 4:
+        limiter.on_complete(latency, True, 0)
+    print(list(limiter.history))
+    assert limiter.limit == 4 and limiter.best_latency > 1.0
+    # but not a sudden jump
+    for latency in [10.0] * 2:
+        limiter.on_complete(latency, True, 0)
+    assert limiter.limit == 2
+
+
+async def async_main(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine) as session:
+        await main(session)
+
+if __name__ == "__main__":
+    engine = create_async_engine("sqlite+aiosqlite://")
+    asyncio.run(async_main(engine))
+    baseline_main()
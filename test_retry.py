@@ -0,0 +1,49 @@
+import datetime
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import Session
+from missionpanel.orm import Base
+from missionpanel.submitter import Submitter
+from missionpanel.handler import Handler, RetryPolicy
+
+
+class FailingHandler(Handler):
+    def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    def execute_mission(self, mission, attempt):
+        print(f"Attempt {attempt.id} is failing mission {mission.content['name']}")
+        return False
+
+
+def main(session: Session):
+    submitter = Submitter(session)
+    submitter.create_mission(content={"name": "Broken mission"}, match_patterns=["Broken mission"], tags=["mission"])
+
+    # no backoff, quarantine after 3 failures
+    handler = FailingHandler(session, "Failing handler", retry_policy=RetryPolicy(base_delay=datetime.timedelta(0), jitter=0, max_failures=3))
+    attempts = [handler.run_once(["mission"]) for _ in range(5)]
+    assert [attempt is not None for attempt in attempts] == [True, True, True, False, False]
+    quarantined = submitter.list_quarantined(["mission"])
+    print(quarantined)
+    assert len(quarantined) == 1 and quarantined[0].failure_count == 3
+    # detached and loaded, like the async version
+    assert inspect(quarantined[0]).detached and quarantined[0].content == {"name": "Broken mission"}
+
+    # requeue and fail with backoff
+    submitter.requeue(["Broken mission"])
+    assert len(submitter.list_quarantined()) == 0
+    handler = FailingHandler(session, "Failing handler", retry_policy=RetryPolicy(base_delay=datetime.timedelta(hours=1), max_failures=None))
+    assert handler.run_once(["mission"]) is not None
+    assert handler.run_once(["mission"]) is None
+
+    # changing content resets the retry state
+    mission = submitter.create_mission(content={"name": "Fixed mission"}, match_patterns=["Broken mission"])
+    assert mission.failure_count == 0 and mission.next_eligible_time is None
+    assert handler.run_once(["mission"]) is not None
+
+
+if __name__ == "__main__":
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        main(session)
@@ -0,0 +1,170 @@
+import asyncio
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from missionpanel.orm import Base, Mission, Attempt, content_index
+from missionpanel.handler import RetryPolicy
+from missionpanel.shard import ShardRouter, ShardedSubmitter, ShardedAsyncSubmitter, ShardedHandler, rebalance
+
+content_index("group")
+
+
+class FakeHandler(ShardedHandler):
+    def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    def execute_mission(self, mission, attempt):
+        print(f"Attempt {attempt.id} is executing mission {mission.content['name']}")
+        return True
+
+
+class FailingHandler(ShardedHandler):
+    def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    def execute_mission(self, mission, attempt):
+        return False
+
+
+def count(session: Session, entity) -> int:
+    n = session.execute(select(func.count()).select_from(entity)).scalar()
+    session.commit()
+    return n
+
+
+def main(sessions):
+    submitter = ShardedSubmitter(sessions[:2])
+    for i in range(20):
+        submitter.create_mission(content={"name": f"Mission {i}"}, match_patterns=[f"Mission {i}", f"M{i}"], tags=["mission"])
+    submitter.add_tags(["Mission 1"], ["hard"])
+    submitter.delete_tags(["Mission 1"], ["hard"])
+    print([count(session, Mission) for session in sessions])
+    assert sum(count(session, Mission) for session in sessions) == 20
+
+    # test handler
+    handler = FakeHandler(sessions[:2], "Shard handler")
+    handler.run_once(["mission"])
+    handler.run_once(["mission"])
+    handler = FakeHandler(sessions[:2], "Shard handler", by_backlog=True)
+    handler.run_once(["mission"])
+    assert sum(count(session, Attempt) for session in sessions) == 3
+
+    # test resharding from 2 to 3 shards
+    router = ShardRouter(3)
+    print(rebalance(sessions, router, batch_size=7))
+    print([count(session, Mission) for session in sessions])
+    assert sum(count(session, Mission) for session in sessions) == 20
+    assert sum(count(session, Attempt) for session in sessions) == 3
+    submitter = ShardedSubmitter(sessions, router)
+    for i in range(20):
+        assert submitter.match_mission([f"Mission {i}", f"M{i}"]) is not None
+    assert rebalance(sessions, router) == 0
+
+
+def overlap_main(sessions):
+    # a pattern routed to another shard than "zz" and smaller than it, so that it becomes the routing key
+    pattern = next(p for p in map(str, range(100)) if ShardRouter.hash_key(p, 2) != ShardRouter.hash_key("zz", 2))
+    submitter = ShardedSubmitter(sessions)
+    submitter.create_mission(content={"name": "Overlap"}, match_patterns=["zz"])
+    submitter.create_mission(content={"name": "Overlap"}, match_patterns=[pattern, "zz"])
+    assert [count(session, Mission) for session in sessions].count(1) == 1
+    assert submitter.match_mission([pattern]) is not None
+
+    # missions created without tags follow their tags once they get some
+    router = ShardRouter(2, by_tag=True)
+    submitter = ShardedSubmitter(sessions, router)
+    tag = next(t for t in map(str, range(100)) if ShardRouter.hash_key(t, 2) != router.route(["Tagged"]))
+    submitter.create_mission(content={"name": "Tagged"}, match_patterns=["Tagged"])
+    submitter.add_tags(["Tagged"], [tag])
+    shard = router.route(["Tagged"], [tag])
+    mission = submitter.match_mission(["Tagged"])
+    assert mission is not None and [t.tag_name for t in mission.tags] == [tag]
+    assert sessions[shard].execute(select(Mission.id).where(Mission.id == mission.id)).scalar() is not None
+    sessions[shard].commit()
+    assert sum(count(session, Mission) for session in sessions) == 2
+
+
+def routed_main(sessions):
+    submitter = ShardedSubmitter(sessions)
+    names = [f"Mission {i}" for i in range(8)]
+    for name in names:
+        submitter.create_mission(content={"name": name, "group": "all"}, match_patterns=[name], tags=["mission"])
+    assert sorted(mission.content["name"] for mission in submitter.find_missions("group", "all")) == names
+    assert {submitter.router.route([name]) for name in names} == {0, 1}
+
+    # a mission depends on the missions of its own shard only
+    local = [name for name in names[1:] if submitter.router.route([name]) == submitter.router.route([names[0]])]
+    remote = [name for name in names if submitter.router.route([name]) != submitter.router.route([names[0]])]
+    submitter.add_dependencies([names[0]], [[local[0]]])
+    assert submitter.match_mission([names[0]]).unresolved_dependencies == 1
+    try:
+        submitter.add_dependencies([names[0]], [[remote[0]]])
+        assert False, "dependency across shards"
+    except ValueError as e:
+        print(e)
+
+    handler = FailingHandler(sessions, "Failing handler", retry_policy=RetryPolicy(max_failures=1))
+    while handler.run_once(["mission"]) is not None:
+        pass
+    quarantined = submitter.list_quarantined(["mission"])
+    assert sorted(mission.content["name"] for mission in quarantined) == sorted(set(names) - {names[0]})
+    submitter.requeue([remote[0]])
+    submitter.requeue([local[0]])
+    assert len(submitter.list_quarantined()) == len(names) - 3
+
+
+async def async_main():
+    engines = [create_async_engine("sqlite+aiosqlite://") for _ in range(2)]
+    for engine in engines:
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+    sessions = [AsyncSession(engine) for engine in engines]
+    router = ShardRouter(2, by_tag=True)
+    submitter = ShardedAsyncSubmitter(sessions, router)
+    tag = next(t for t in map(str, range(100)) if ShardRouter.hash_key(t, 2) != router.route(["Tagged"]))
+    await submitter.create_mission(content={"name": "Tagged"}, match_patterns=["Tagged"])
+    await submitter.add_tags(["Tagged"], [tag])
+    await submitter.add_tags(["Tagged"], ["other"])
+    counts = []
+    for session in sessions:
+        counts.append((await session.execute(select(func.count()).select_from(Mission))).scalar())
+        await session.commit()
+    assert counts[router.route(["Tagged"], [tag])] == 1 and sum(counts) == 1
+    await submitter.create_mission(content={"name": "Other", "group": "all"}, match_patterns=["Other"], tags=["other"])
+    assert [mission.content["name"] for mission in await submitter.find_missions("group", "all")] == ["Other"]
+    assert await submitter.list_quarantined() == []
+    await submitter.requeue(["Tagged"])
+    try:
+        await submitter.add_dependencies(["Tagged"], [["Missing"]])
+        assert False, "missing dependency"
+    except ValueError as e:
+        print(e)
+    for session in sessions:
+        await session.close()
+    for engine in engines:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    engines = [create_engine("sqlite://") for _ in range(3)]
+    for engine in engines:
+        Base.metadata.create_all(engine)
+    sessions = [Session(engine) for engine in engines]
+    main(sessions)
+    for session in sessions:
+        session.close()
+    engines = [create_engine("sqlite://") for _ in range(2)]
+    for engine in engines:
+        Base.metadata.create_all(engine)
+    sessions = [Session(engine) for engine in engines]
+    overlap_main(sessions)
+    for session in sessions:
+        session.close()
+    engines = [create_engine("sqlite://") for _ in range(2)]
+    for engine in engines:
+        Base.metadata.create_all(engine)
+    sessions = [Session(engine) for engine in engines]
+    routed_main(sessions)
+    for session in sessions:
+        session.close()
+    asyncio.run(async_main())
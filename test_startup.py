@@ -0,0 +1,41 @@
+import subprocess
+import sys
+
+
+def run(code: str) -> str:
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip()
+
+
+def own_import_time(module: str) -> float:
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True).stderr
+    total = 0
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "self [us]" not in line:
+            self_us, _, name = line[len("import time:"):].split("|")
+            if name.strip().startswith("missionpanel"):
+                total += int(self_us)
+    return total / 1e6
+
+
+def main():
+    # optional subsystems are not loaded by the package
+    loaded = run("import sys, missionpanel.example; print([m for m in ('httpx', 'chardet', 'xml.etree.ElementTree') if m in sys.modules])")
+    print(loaded)
+    assert loaded == "[]"
+    loaded = run("import sys, missionpanel.handler, missionpanel.submitter; print([m for m in ('httpx', 'chardet', 'xml.etree.ElementTree') if m in sys.modules])")
+    print(loaded)
+    assert loaded == "[]"
+    # but still available
+    assert run("from missionpanel.example import RSSHubRootSubmitter, SubprocessParallelAsyncHandler; print('ok')") == "ok"
+    # mappers are configured on first use, not at import
+    assert run("import missionpanel.handler; from missionpanel.orm import Mission; print(Mission.__mapper__.configured)") == "False"
+
+    # time spent in missionpanel's own modules, sqlalchemy excluded
+    for module in ["missionpanel.handler", "missionpanel.submitter", "missionpanel.example"]:
+        seconds = min(own_import_time(module) for _ in range(3))
+        print(f"{module}: {seconds * 1e3:.1f} ms")
+        assert seconds < 0.2, f"importing {module} got slow"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import asyncio
+import datetime
+import time
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from missionpanel.orm import Base, TagStatDelta, HandlerStatDelta
+from missionpanel.submitter import Submitter, AsyncSubmitter
+from missionpanel.handler import Handler, AsyncHandler, RetryPolicy
+from missionpanel.handler.handler import HandlerInterface
+from missionpanel.stats import Stats, AsyncStats
+
+
+class FakeHandler(Handler):
+    def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    def execute_mission(self, mission, attempt):
+        print(f"Attempt {attempt.id} is executing mission {mission.content['name']}")
+        return not mission.content['name'].startswith("Broken")
+
+
+class FakeAsyncHandler(AsyncHandler):
+    async def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    async def execute_mission(self, mission, attempt):
+        return True
+
+
+def main(session: Session):
+    submitter = Submitter(session)
+    stats = Stats(session)
+    for i in range(6):
+        submitter.create_mission(content={"name": f"Mission {i}"}, match_patterns=[f"Mission {i}"], tags=["mission", "even" if i % 2 == 0 else "odd"])
+    submitter.create_mission(content={"name": "Broken mission"}, match_patterns=["Broken"], tags=["mission"])
+    counters = stats.tag_stats()
+    print(counters)
+    assert counters["mission"] == {"pending": 7, "running": 0, "done": 0, "quarantined": 0}
+    assert counters["even"]["pending"] == 3 and counters["odd"]["pending"] == 3
+
+    handler = FakeHandler(session, "Fake handler", retry_policy=RetryPolicy(base_delay=datetime.timedelta(0), jitter=0, max_failures=2))
+    while handler.run_once(["mission"]) is not None:
+        pass
+    counters = stats.tag_stats(["mission", "even"])
+    print(counters)
+    assert counters["mission"] == {"pending": 0, "running": 0, "done": 6, "quarantined": 1}
+    # the handlers only append changes, which are folded into the counters later
+    assert session.execute(select(func.count()).select_from(TagStatDelta)).scalar() > 0
+    assert session.execute(select(func.count()).select_from(HandlerStatDelta)).scalar() == 8
+    unfolded = [(bucket.handler, bucket.bucket, bucket.succeeded, bucket.failed) for bucket in stats.handler_stats()]
+    assert stats.fold() > 0 and stats.fold() == 0
+    assert session.execute(select(func.count()).select_from(HandlerStatDelta)).scalar() == 0
+    assert [(bucket.handler, bucket.bucket, bucket.succeeded, bucket.failed) for bucket in stats.handler_stats()] == unfolded
+    assert stats.tag_stats(["mission", "even"]) == counters
+    assert counters["even"]["done"] == 3 and "odd" not in counters
+
+    # submitter write paths
+    submitter.requeue(["Broken"])
+    submitter.create_mission(content={"name": "Mission 0 v2"}, match_patterns=["Mission 0"])
+    submitter.delete_tags(["Mission 1"], ["odd"])
+    submitter.add_tags(["Mission 1"], ["even"])
+    counters = stats.tag_stats()
+    print(counters)
+    assert counters["mission"] == {"pending": 2, "running": 0, "done": 5, "quarantined": 0}
+    assert counters["odd"]["done"] == 2 and counters["even"] == {"pending": 1, "running": 0, "done": 3, "quarantined": 0}
+
+    # a handler dies while running a mission
+    mission = submitter.match_mission(["Broken"])
+    HandlerInterface.create_attempt(session, mission, "Dead handler", datetime.timedelta(seconds=0.1))
+    session.commit()
+    assert stats.tag_stats(["mission"])["mission"]["running"] == 1
+    time.sleep(0.2)
+    incremental = stats.tag_stats()
+    assert stats.reconcile() == 1
+    reconciled = stats.tag_stats()
+    print(reconciled)
+    incremental["mission"]["running"] -= 1
+    incremental["mission"]["pending"] += 1
+    assert reconciled == incremental
+
+    # throughput and latency
+    buckets = stats.handler_stats("Fake handler")
+    assert sum(bucket.succeeded for bucket in buckets) == 6 and sum(bucket.failed for bucket in buckets) == 2
+    summary = stats.latency_summary("Fake handler")
+    print(summary)
+    assert summary.count == 8 and summary.max < 1 and summary.p95 <= 1
+    stats.prune(datetime.datetime.now() + datetime.timedelta(minutes=1))
+    assert stats.handler_stats() == []
+
+
+async def async_main():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine) as session:
+        submitter = AsyncSubmitter(session)
+        for i in range(3):
+            await submitter.create_mission(content={"name": f"Mission {i}"}, match_patterns=[f"Mission {i}"])
+            await submitter.add_tags([f"Mission {i}"], ["mission"])
+        handler = FakeAsyncHandler(session, "Fake async handler")
+        await handler.run_all(["mission"])
+        stats = AsyncStats(session)
+        assert (await stats.tag_stats())["mission"]["done"] == 3
+        assert await stats.fold() > 0
+        assert (await stats.tag_stats())["mission"]["done"] == 3
+        assert sum(bucket.succeeded for bucket in await stats.handler_stats("Fake async handler")) == 3
+        assert (await stats.latency_summary("Fake async handler")).count == 3
+        assert await stats.reconcile() == 0
+    await engine.dispose()
+
+
+def no_returning_main():
+    # the dialects without DELETE ... RETURNING fold the rows they selected
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    engine.dialect.delete_returning = False
+    with Session(engine) as session:
+        main(session)
+
+
+if __name__ == "__main__":
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        main(session)
+    no_returning_main()
+    asyncio.run(async_main())
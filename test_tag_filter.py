@@ -0,0 +1,92 @@
+import asyncio
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from missionpanel.orm import Base, statement_cache
+from missionpanel.submitter import Submitter, AsyncSubmitter
+from missionpanel.handler import Handler, AsyncHandler, AllOf, AnyOf, NoneOf
+from missionpanel.handler.handler import HandlerInterface
+
+
+class FakeHandler(Handler):
+    def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    def execute_mission(self, mission, attempt):
+        print(f"Attempt {attempt.id} is executing mission {mission.content['name']}")
+        return True
+
+
+class FakeAsyncHandler(AsyncHandler):
+    async def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    async def execute_mission(self, mission, attempt):
+        return True
+
+
+TAGS = {
+    "rsshub twitter": ["rsshub", "twitter"],
+    "rsshub youtube": ["rsshub", "youtube"],
+    "rsshub": ["rsshub"],
+    "twitter": ["twitter"],
+    "youtube": ["youtube"],
+}
+
+
+def todo(session: Session, tag_filter):
+    statement, params = HandlerInterface.prepare_todo_missions(tag_filter)
+    return sorted(mission.content['name'] for mission in session.execute(statement, params).scalars().all())
+
+
+def main(session: Session):
+    submitter = Submitter(session)
+    for name, tags in TAGS.items():
+        submitter.create_mission(content={"name": name}, match_patterns=[name], tags=tags)
+
+    assert todo(session, ["rsshub", "twitter"]) == ["rsshub twitter"]
+    assert todo(session, AllOf("rsshub", "twitter")) == ["rsshub twitter"]
+    assert todo(session, AllOf(["rsshub", "rsshub"])) == ["rsshub", "rsshub twitter", "rsshub youtube"]
+    assert todo(session, AnyOf("twitter", "youtube")) == ["rsshub twitter", "rsshub youtube", "twitter", "youtube"]
+    assert todo(session, NoneOf("rsshub")) == ["twitter", "youtube"]
+    assert todo(session, AnyOf("rsshub") & NoneOf("twitter")) == ["rsshub", "rsshub youtube"]
+    assert todo(session, AllOf("rsshub", "twitter") | NoneOf("rsshub", "twitter")) == ["rsshub twitter", "youtube"]
+    assert todo(session, ~AnyOf("youtube") & ["rsshub"]) == ["rsshub", "rsshub twitter"]
+    assert todo(session, ~~NoneOf("youtube")) == todo(session, NoneOf("youtube"))
+
+    # filters of the same shape share one statement
+    hits = statement_cache.hits
+    todo(session, AnyOf("rsshub") & NoneOf("twitter"))
+    todo(session, AnyOf("youtube", "twitter") & NoneOf("rsshub"))
+    assert statement_cache.hits == hits + 2
+    assert todo(session, AnyOf("youtube", "twitter") & NoneOf("rsshub")) == ["twitter", "youtube"]
+
+    handler = FakeHandler(session, "Fake handler")
+    while handler.run_once(AnyOf("rsshub") & NoneOf("twitter")) is not None:
+        pass
+    assert todo(session, AnyOf("rsshub")) == ["rsshub twitter"]
+
+
+async def async_main():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine) as session:
+        submitter = AsyncSubmitter(session)
+        for name, tags in TAGS.items():
+            await submitter.create_mission(content={"name": name}, match_patterns=[name])
+            await submitter.add_tags([name], tags)
+        handler = FakeAsyncHandler(session, "Fake async handler")
+        await handler.run_all(NoneOf("rsshub"))
+        statement, params = HandlerInterface.prepare_todo_missions(AnyOf("twitter", "youtube"))
+        missions = (await session.execute(statement, params)).scalars().all()
+        assert sorted(mission.content['name'] for mission in missions) == ["rsshub twitter", "rsshub youtube"]
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        main(session)
+    asyncio.run(async_main())
@@ -0,0 +1,152 @@
+import gzip
+import io
+import os
+import tempfile
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import Session
+from missionpanel.orm import Base, Mission, Matcher, MissionTag, MissionDependency, Attempt
+from missionpanel.submitter import Submitter
+from missionpanel.handler import Handler
+from missionpanel.transfer import export_panel, import_panel
+from missionpanel.transfer.cli import main as cli
+
+
+class FakeHandler(Handler):
+    def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    def execute_mission(self, mission, attempt):
+        return True
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(fp, n_lines):
+    for i, line in enumerate(fp):
+        if i >= n_lines:
+            raise Interrupted()
+        yield line
+
+
+class SubmitDuringExport(io.StringIO):
+    '''Submits and handles a Mission once the export has moved past the mission table.'''
+
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+        self.submitted = False
+
+    def write(self, s):
+        if not self.submitted and s.startswith('{"table": "attempt"'):
+            with Session(self.engine) as session:
+                Submitter(session).create_mission(content={"name": "Live"}, match_patterns=["Live"], tags=["live"])
+                assert FakeHandler(session, "Fake handler").run_once(["live"]) is not None
+            self.submitted = True
+        return super().write(s)
+
+
+def count(session: Session, model) -> int:
+    return session.execute(select(func.count()).select_from(model)).scalar()
+
+
+def snapshot(session: Session):
+    return sorted(
+        (tuple(sorted(matcher.pattern for matcher in mission.matchers)),
+         mission.content["name"],
+         tuple(sorted(tag.tag_name for tag in mission.tags)),
+         tuple(sorted(attempt.content["name"] for attempt in mission.attempts)))
+        for mission in session.execute(select(Mission)).unique().scalars().all()
+        if len(mission.matchers) > 0 and mission.matchers[0].pattern.startswith("Mission"))
+
+
+def main(tmpdir: str):
+    source = create_engine(f"sqlite:///{os.path.join(tmpdir, 'source.db')}")
+    Base.metadata.create_all(source)
+    with Session(source) as session:
+        submitter = Submitter(session)
+        for i in range(50):
+            submitter.create_mission(content={"name": f"Mission {i}"}, match_patterns=[f"Mission {i}"], tags=["mission", f"group {i % 3}"])
+        submitter.add_dependencies(["Mission 1"], [["Mission 0"]])
+        handler = FakeHandler(session, "Fake handler")
+        for _ in range(10):
+            handler.run_once(["mission"])
+        expected = snapshot(session)
+
+    path = os.path.join(tmpdir, "panel.jsonl.gz")
+    cli(["export", str(source.url), path, "--batch-size", "7"])
+    with gzip.open(path, "rt", encoding="utf8") as fp:
+        n_lines = sum(1 for _ in fp)
+
+    # the target already has missions, imported ids are shifted past them
+    target = create_engine(f"sqlite:///{os.path.join(tmpdir, 'target.db')}")
+    Base.metadata.create_all(target)
+    with Session(target) as session:
+        Submitter(session).create_mission(content={"name": "Existing"}, match_patterns=["Existing"], tags=["mission"])
+
+    checkpoint = os.path.join(tmpdir, "import.checkpoint")
+    with gzip.open(path, "rt", encoding="utf8") as fp:
+        try:
+            import_panel(target, interrupt_after(fp, n_lines // 2), batch_size=5, checkpoint=checkpoint)
+            assert False, "should have been interrupted"
+        except Interrupted:
+            pass
+    cli(["import", str(target.url), path, "--batch-size", "5", "--checkpoint", checkpoint])
+
+    with Session(target) as session:
+        assert snapshot(session) == expected
+        assert count(session, Mission) == 51 and count(session, Matcher) == 51 and count(session, Attempt) == 10
+        assert count(session, MissionTag) == 101
+        dependency = session.execute(select(MissionDependency)).scalar_one()
+        assert session.get(Mission, dependency.mission_id).content["name"] == "Mission 1"
+        assert session.get(Mission, dependency.depends_on_id).content["name"] == "Mission 0"
+        # ids assigned after the import do not collide with imported ones
+        Submitter(session).create_mission(content={"name": "New"}, match_patterns=["New"])
+        assert count(session, Mission) == 52
+
+    # importing the same file again with the finished checkpoint does nothing
+    with gzip.open(path, "rt", encoding="utf8") as fp:
+        assert import_panel(target, fp, checkpoint=checkpoint) == 0
+
+    # plain text round trip through memory
+    buffer = io.StringIO()
+    n = export_panel(source, buffer)
+    buffer.seek(0)
+    memory = create_engine("sqlite://")
+    assert import_panel(memory, buffer) == n
+    with Session(memory) as session:
+        assert snapshot(session) == expected
+
+    # a pattern already used in the target is reported instead of leaving the imported Mission without Matcher
+    conflicting = create_engine("sqlite://")
+    Base.metadata.create_all(conflicting)
+    with Session(conflicting) as session:
+        Submitter(session).create_mission(content={"name": "Other"}, match_patterns=["Mission 3"], tags=["mission"])
+    buffer.seek(0)
+    try:
+        import_panel(conflicting, buffer, checkpoint="conflict")
+        assert False, "the conflict should have been reported"
+    except ValueError as e:
+        print(e)
+    with Session(conflicting) as session:
+        assert session.execute(select(Matcher.mission_id).where(Matcher.pattern == "Mission 3")).scalar() == 1
+        assert count(session, Matcher) == 1
+
+    # a live export reads every table from the snapshot taken before the Mission submitted meanwhile
+    with source.connect() as connection:
+        connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+    buffer = SubmitDuringExport(source)
+    assert export_panel(source, buffer) == n and buffer.submitted
+    buffer.seek(0)
+    live = create_engine("sqlite://")
+    assert import_panel(live, buffer) == n
+    with Session(live) as session:
+        assert snapshot(session) == expected and count(session, Attempt) == 10
+    for engine in (source, target, memory, conflicting, live):
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        main(tmpdir)
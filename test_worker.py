@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import logging
+import os
+import sys
+import tempfile
+import time
+from sqlalchemy import select, inspect
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from missionpanel.orm import Base, Mission, Attempt
+from missionpanel.submitter import AsyncSubmitter
+from missionpanel.handler import ConcurrencyLimiter
+from missionpanel.example import WarmSubprocessParallelAsyncHandler
+from missionpanel.example.subprocess import WorkerPool
+
+
+def execute(request):
+    '''Runs in the workers.'''
+    name = request["content"]["name"]
+    print(f"Worker {os.getpid()} is executing mission {name}")
+    if name == "Hang":
+        time.sleep(60)
+    if name == "Raise":
+        raise RuntimeError(name)
+    return name != "Broken"
+
+
+class FakeHandler(WarmSubprocessParallelAsyncHandler):
+    async def select_mission(self, missions):
+        return missions[0] if missions else None
+
+    async def construct_worker_command(self):
+        return [sys.executable, "-m", "missionpanel.example.worker", "test_worker:execute"]
+
+    async def construct_request(self, mission, attempt):
+        request = await super().construct_request(mission, attempt)
+        if request["content"]["name"] == "Hang":
+            self.hanging = request["attempt"]
+        if request["content"]["name"].startswith("Unserializable"):
+            request["content"] = {"name": {"not", "json"}}
+        return request
+
+    async def renew_attempt(self, mission, attempt):
+        renewed = await super().renew_attempt(mission, attempt)
+        # as if another handler took the mission over
+        return renewed and inspect(attempt).identity[0] != self.hanging
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+async def succeeded(session: AsyncSession):
+    missions = (await session.execute(select(Mission).join(Attempt).where(Attempt.success))).unique().scalars().all()
+    return sorted(mission.content["name"] for mission in missions)
+
+
+async def main(session: AsyncSession):
+    submitter = AsyncSubmitter(session)
+    names = [f"Mission {i}" for i in range(6)] + ["Broken", "Raise", "Hang"]
+    for name in names:
+        await submitter.create_mission(content={"name": name}, match_patterns=[name])
+        await submitter.add_tags([name], ["mission"])
+    records = Records()
+    logging.getLogger("WarmSubprocessAsyncHandler").addHandler(records)
+
+    handler = FakeHandler(2, session, "Fake handler", max_time_interval=datetime.timedelta(seconds=0.2), max_missions=3)
+    handler.hanging = None
+    start = time.time()
+    await handler.run_all(["mission"])
+    print(handler.pool.n_started, "workers started")
+    assert time.time() - start < 10, "the hung worker should have been killed"
+    assert await succeeded(session) == [f"Mission {i}" for i in range(6)]
+    # warm workers are reused, the killed one is replaced
+    assert 3 <= handler.pool.n_started < len(names)
+    assert handler.pool.idle == []
+    assert any("is executing mission Mission 0" in message for message in records.messages)
+    assert any("RuntimeError: Raise" in message for message in records.messages)
+    assert any(message.startswith("killed") for message in records.messages)
+
+    # recycled after every Mission when over the memory limit
+    for i in range(3):
+        await submitter.create_mission(content={"name": f"Another {i}"}, match_patterns=[f"Another {i}"])
+        await submitter.add_tags([f"Another {i}"], ["another"])
+    handler = FakeHandler(1, session, "Fake handler", max_memory=1)
+    handler.hanging = None
+    await handler.run_all(["another"])
+    assert handler.pool.n_started == (3 if os.path.exists("/proc/self/statm") else 1)
+    assert (await succeeded(session))[:3] == [f"Another {i}" for i in range(3)]
+
+    # failures outside the worker give the worker back, more of them than workers do not block the pool
+    for name in ["Unserializable 0", "Unserializable 1", "After"]:
+        await submitter.create_mission(content={"name": name}, match_patterns=[name])
+        await submitter.add_tags([name], ["unserializable"])
+    handler = FakeHandler(1, session, "Fake handler")
+    handler.hanging = None
+    await asyncio.wait_for(handler.run_all(["unserializable"]), 30)
+    assert "After" in await succeeded(session)
+    assert not any(name.startswith("Unserializable") for name in await succeeded(session))
+
+    # a worker exiting while idle is replaced instead of handed out
+    pool = WorkerPool(await handler.construct_worker_command(), 1, 10, None, logging.getLogger("WorkerPool"))
+    worker = await pool.acquire()
+    await pool.release(worker)
+    worker.proc.kill()
+    await worker.proc.wait()
+    replaced = await pool.acquire()
+    assert replaced is not worker and replaced.proc.returncode is None and pool.n_started == 2
+    await pool.release(replaced)
+    await pool.close()
+
+    # sized for the limiter, which may let more Missions in flight than n_parallel
+    limiter = ConcurrencyLimiter(max_limit=16)
+    assert FakeHandler(2, session, "Fake handler", limiter=limiter).n_workers == 16
+    FakeHandler(2, session, "Fake handler", limiter=limiter, n_workers=4)
+    assert limiter.max_limit == 4
+
+
+async def async_main(path: str):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine) as session:
+        await main(session)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        asyncio.run(async_main(os.path.join(tmpdir, "worker.db")))